@@ -0,0 +1,84 @@
+import argparse
+import json
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+FIXTURE_DIR = os.path.join(BENCHMARK_DIR, 'fixtures')
+CASES_FILE = os.path.join(BENCHMARK_DIR, 'cases.json')
+
+
+def load_cases(path: str = CASES_FILE):
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def case_path(case: dict) -> str:
+    return f"/{case['retailer']}/{case['name']}"
+
+
+class FixtureServer:
+    """Serves the recorded retailer pages of ``cases.json`` on localhost, each with its own status code.
+
+    ``delay`` adds a fixed server-side latency (seconds) to every response to mimic a real site.
+    """
+
+    def __init__(self, cases, host: str = '127.0.0.1', port: int = 0, delay: float = 0):
+        self.delay = delay
+        self.pages = {}
+        for case in cases:
+            with open(os.path.join(FIXTURE_DIR, case['fixture']), 'rb') as f:
+                self.pages[case_path(case)] = (case['status'], f.read())
+        self.httpd = ThreadingHTTPServer((host, port), self._handler())
+        self.httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def url(self, case: dict) -> str:
+        return self.base_url + case_path(case)
+
+    def start(self):
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                status, body = server.pages.get(self.path.split('?', 1)[0], (404, b'Not found'))
+                if server.delay:
+                    time.sleep(server.delay)
+                self.send_response(status)
+                self.send_header('Content-Type', 'text/html; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Serve the benchmark fixture pages.")
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--delay', type=float, default=0, help="Seconds added to every response")
+    args = parser.parse_args()
+
+    fixture_server = FixtureServer(load_cases(), port=args.port, delay=args.delay)
+    for case in load_cases():
+        print(fixture_server.url(case))
+    fixture_server.httpd.serve_forever()
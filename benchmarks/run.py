@@ -0,0 +1,241 @@
+"""Offline spider benchmark.
+
+    python benchmarks/run.py --iterations 20 --output report.json
+    python benchmarks/run.py --baseline report.json   # exits 1 on wrong results or a regression
+
+Every case of cases.json is served from fixtures/ by a local server and crawled by each engine that
+handles its retailer: the Scrapy workers, the HTTP fast paths and, with --engines selenium, the
+Selenium spiders through a DriverPool.
+"""
+import argparse
+import json
+import os
+import resource
+import sys
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.fixture_server import FixtureServer, load_cases  # noqa: E402
+from scraper_utils.registry import registry  # noqa: E402
+from scraper_utils.result import parse_price, parse_prices  # noqa: E402
+
+ENGINES = ('scrapy', 'http', 'selenium')
+
+# Price texts the spiders have run into, on top of the expected prices of cases.json
+PRICE_SAMPLES = ['$3,149', '$ 669.00', '$2,474.255', '$2,474.254', '$0.995', 'MXN 1,299.5', '-$12.345', '-1.5', '0',
+                 0, 669.5, 'N/A', '$None', None, '']
+
+
+def percentile(values, fraction: float):
+    """Nearest-rank percentile of a non-empty list."""
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, int(round(fraction * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+
+def peak_rss_mb():
+    """Largest resident set of the harness and of any finished child process (Scrapy workers, browsers)."""
+    # ru_maxrss is in kilobytes on Linux
+    return {
+        'harness': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        'children': round(resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024, 1),
+    }
+
+
+def price_parser_mismatches(cases):
+    """Prices on which the vectorized parse_prices disagrees with parse_price, as 'text: scalar != batch'."""
+    samples = [case['expected']['price'] for case in cases if 'price' in case['expected']] + PRICE_SAMPLES
+    batch = [None if pd.isna(cents) else int(cents) for cents in parse_prices(samples)]
+    return [f"{sample!r}: {parse_price(sample)} != {cents}" for sample, cents in zip(samples, batch)
+            if parse_price(sample) != cents]
+
+
+def matches(result, expected: dict) -> bool:
+    # Compared as shown, so an expected price is the display text ("$0" for broken links)
+    if not isinstance(result, dict):
+        return False
+    return all(str(result.get(key)) == str(value) for key, value in expected.items())
+
+
+class Crawlers:
+    """Runs one crawl of a case with a given engine, starting the engine's services on first use."""
+
+    def __init__(self, scrapy_workers: int, pool_size: int):
+        self.scrapy_workers = scrapy_workers
+        self.pool_size = pool_size
+        self.scrapy_service = None
+        self.driver_pool = None
+
+    def supports(self, engine: str, spec) -> bool:
+        if engine == 'scrapy':
+            return spec.engine == 'scrapy'
+        if engine == 'http':
+            return spec.fast_path is not None
+        return spec.engine == 'selenium'
+
+    def crawl(self, engine: str, spec, url: str):
+        if engine == 'scrapy':
+            if self.scrapy_service is None:
+                from scraper_utils.scrapy_service import ScrapyService
+                self.scrapy_service = ScrapyService(workers=self.scrapy_workers)
+                self.scrapy_service.start()
+            return self.scrapy_service.submit(spec.spider, url).result(timeout=120)
+
+        if engine == 'http':
+            result = spec.load_fast_path()(url=url).run()
+            return result.to_dict() if result is not None else None
+
+        if self.driver_pool is None:
+            from scraper_utils.driver_pool import DriverPool
+            self.driver_pool = DriverPool(size=self.pool_size)
+        spider = spec.load()(url=url, driver_pool=self.driver_pool)
+        try:
+            return spider.run().to_dict()
+        finally:
+            spider.close_browser()
+
+    def close(self):
+        if self.scrapy_service is not None:
+            self.scrapy_service.stop()
+        if self.driver_pool is not None:
+            self.driver_pool.close()
+
+
+def run_engine(crawlers: Crawlers, engine: str, cases, server: FixtureServer, iterations: int, concurrency: int):
+    """Crawl every supported case ``iterations`` times and return per-retailer samples and failures."""
+    work = [case for case in cases if crawlers.supports(engine, registry.get(case['retailer']))]
+    if not work:
+        return None
+
+    # One untimed crawl per retailer so worker start up and browser launch are not measured
+    for retailer in sorted({case['retailer'] for case in work}):
+        case = next(case for case in work if case['retailer'] == retailer)
+        crawlers.crawl(engine, registry.get(retailer), server.url(case))
+
+    def timed(case):
+        started = time.perf_counter()
+        try:
+            result = crawlers.crawl(engine, registry.get(case['retailer']), server.url(case))
+        except Exception as e:
+            result = {'error': str(e)}
+        return case, time.perf_counter() - started, result
+
+    latencies = defaultdict(list)
+    failures = []
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for case, latency, result in executor.map(timed, work * iterations):
+            latencies[case['retailer']].append(latency)
+            if not matches(result, case['expected']):
+                failures.append({'case': f"{case['retailer']}/{case['name']}", 'expected': case['expected'],
+                                 'got': result})
+    wall = time.perf_counter() - started
+
+    report = {'pages': len(work) * iterations, 'seconds': round(wall, 3),
+              'pages_per_second': round(len(work) * iterations / wall, 2), 'retailers': {}}
+    for retailer, samples in sorted(latencies.items()):
+        report['retailers'][retailer] = latency_summary(samples)
+    report.update(latency_summary([sample for samples in latencies.values() for sample in samples]))
+    # Each case fails the same way on every iteration, report it once
+    report['failures'] = list({failure['case']: failure for failure in failures}.values())
+    return report
+
+
+def latency_summary(samples):
+    return {
+        'p50_ms': round(percentile(samples, 0.50) * 1000, 1),
+        'p90_ms': round(percentile(samples, 0.90) * 1000, 1),
+        'p99_ms': round(percentile(samples, 0.99) * 1000, 1),
+        'max_ms': round(max(samples) * 1000, 1),
+    }
+
+
+def regressions(report: dict, baseline: dict, tolerance: float):
+    """Compare against a saved report: slower p50/p90 or lower throughput beyond ``tolerance`` fails."""
+    found = []
+    for engine, current in report['engines'].items():
+        previous = baseline.get('engines', {}).get(engine)
+        if not previous:
+            continue
+        for key in ('p50_ms', 'p90_ms'):
+            if current[key] > previous[key] * (1 + tolerance):
+                found.append(f"{engine} {key} {previous[key]} -> {current[key]}")
+        if current['pages_per_second'] < previous['pages_per_second'] * (1 - tolerance):
+            found.append(f"{engine} pages_per_second {previous['pages_per_second']} -> {current['pages_per_second']}")
+    return found
+
+
+def print_report(report: dict):
+    print(f"{'engine':<10}{'retailer':<14}{'p50 ms':>9}{'p90 ms':>9}{'p99 ms':>9}{'pages/s':>9}")
+    for engine, result in report['engines'].items():
+        for retailer, summary in result['retailers'].items():
+            print(f"{engine:<10}{retailer:<14}{summary['p50_ms']:>9}{summary['p90_ms']:>9}{summary['p99_ms']:>9}")
+        print(f"{engine:<10}{'all':<14}{result['p50_ms']:>9}{result['p90_ms']:>9}{result['p99_ms']:>9}"
+              f"{result['pages_per_second']:>9}")
+        for failure in result['failures']:
+            print(f"  WRONG {failure['case']}: expected {failure['expected']}, got {failure['got']}")
+    print(f"Peak RSS (MB): harness {report['peak_rss_mb']['harness']}, "
+          f"largest child {report['peak_rss_mb']['children']}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the spiders against recorded pages served locally.")
+    parser.add_argument('--engines', default='scrapy,http',
+                        help="Comma separated, from scrapy, http and selenium (needs Chrome)")
+    parser.add_argument('--iterations', type=int, default=20, help="Crawls of every case per engine")
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--delay', type=float, default=0, help="Seconds the fixture server waits per response")
+    parser.add_argument('--scrapy-workers', type=int, default=1)
+    parser.add_argument('--pool-size', type=int, default=2, help="Browser sessions for the selenium engine")
+    parser.add_argument('--output', help="Write the report as JSON")
+    parser.add_argument('--baseline', help="Fail when slower than this earlier JSON report")
+    parser.add_argument('--tolerance', type=float, default=0.25, help="Allowed regression against the baseline")
+    args = parser.parse_args(argv)
+
+    engines = [engine.strip() for engine in args.engines.split(',') if engine.strip()]
+    unknown = set(engines) - set(ENGINES)
+    if unknown:
+        parser.error(f"Unknown engines: {', '.join(sorted(unknown))}")
+
+    # Measure the spiders, not Scrapy's on-disk cache
+    os.environ['SCRAPY_HTTPCACHE'] = '0'
+
+    cases = load_cases()
+    server = FixtureServer(cases, delay=args.delay).start()
+    crawlers = Crawlers(args.scrapy_workers, args.pool_size)
+    report = {'iterations': args.iterations, 'concurrency': args.concurrency, 'delay': args.delay, 'engines': {}}
+    try:
+        for engine in engines:
+            result = run_engine(crawlers, engine, cases, server, args.iterations, args.concurrency)
+            if result is not None:
+                report['engines'][engine] = result
+    finally:
+        crawlers.close()
+        server.stop()
+    report['peak_rss_mb'] = peak_rss_mb()
+    report['price_parser_mismatches'] = price_parser_mismatches(cases)
+
+    print_report(report)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+
+    for mismatch in report['price_parser_mismatches']:
+        print("PRICE PARSER MISMATCH " + mismatch)
+    failed = any(result['failures'] for result in report['engines'].values()) or bool(report['price_parser_mismatches'])
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            found = regressions(report, json.load(f), args.tolerance)
+        for regression in found:
+            print("REGRESSION " + regression)
+        failed = failed or bool(found)
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,27 +1,41 @@
+import asyncio
 import gc
-import json
-import multiprocessing
 import os
+import tempfile
+import threading
+import time
 import traceback
-from concurrent.futures import ProcessPoolExecutor
-from logging import Logger
+import uuid
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
 from typing import Optional
 
-from fastapi import FastAPI, HTTPException
-from pydantic import BaseModel
-from scrapy.crawler import CrawlerProcess
-from scrapy.utils.project import get_project_settings
+from fastapi import FastAPI, Header, HTTPException, Request
+from fastapi.responses import JSONResponse, ORJSONResponse
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
 from starlette.middleware.cors import CORSMiddleware
+from starlette.responses import FileResponse, PlainTextResponse, Response, StreamingResponse
 
-from scraper_utils import BaseSpider, BaseSelenium
-from scraper_utils.result import Result
-from scraper_utils.spiders.CostcoSeleniumSpider import CostcoSeleniumSpider
-from scraper_utils.spiders.CostcoSpider import CostcoSpider
-from scraper_utils.spiders.MercadoLibreSelenium import MercadoLibreSeleniumSpider
-from scraper_utils.spiders.LiverpoolSelenium import LiverPoolSeleniumSpider
-from scraper_utils.spiders.PalacioSpyder import PalacioSpyder
+from scraper_utils.cache import ResultCache, canonical_url
+from scraper_utils.deadline import CrawlInterrupted, current_deadline, enforce, interrupted_result, on_expire
+from scraper_utils.history import HistoryStore
+from scraper_utils.ingest import catalog_format, crawl_catalog, format_records, read_catalog
+from scraper_utils.jobs import JobManager
+from scraper_utils.metrics import REQUEST_SECONDS, current_timings, measure_crawl, outcome_of
+from scraper_utils.profiling import artifact_paths, import_capture, list_profiles, profiled
+from scraper_utils.queues import job_queue_from_url, new_job
+from scraper_utils.recrawl import RecrawlScheduler
+from scraper_utils.registry import SpiderSpec, registry
+from scraper_utils.result import Result, StockStatus
+from scraper_utils.schemas import BatchCrawlerRequest, CrawlerRequest
+from scraper_utils.serialization import dumps, orjson
+from scraper_utils.scrapy_service import ScrapyService
+from scraper_utils.singleflight import SingleFlight
+from scraper_utils.throttle import BLOCK_STATUSES, Throttler
 
-app = FastAPI()
+# orjson, when installed, encodes the responses several times faster
+app = FastAPI(default_response_class=ORJSONResponse if orjson is not None else JSONResponse)
 
 app.add_middleware(
     CORSMiddleware,
@@ -31,123 +45,668 @@ app.add_middleware(
     allow_headers=["*"],  # Allows all headers. Adjust as needed.
 )
 
-processes = {}
+# Hard limit of one crawl. On expiry its browser or Scrapy job is killed and it returns a timeout result
+CRAWL_TIMEOUT_SECONDS = float(os.getenv('CRAWL_TIMEOUT', '300'))
 
+# Warm headless Chrome sessions borrowed by the Selenium spiders (size from DRIVER_POOL_SIZE).
+# Created on first use so the API starts without importing Selenium.
+driver_pool = None
+driver_pool_lock = threading.Lock()
 
-def run_scrapy_crawler_process(url: str, spider: BaseSpider, result_file: str):
-    settings = get_project_settings()
-    process = CrawlerProcess(settings)
-    process.crawl(spider, url=url)
-    process.start()
-    return read_result_file(result_file)
+# Long-lived Scrapy workers with a running reactor (count from SCRAPY_WORKERS)
+scrapy_service = ScrapyService()
 
+# With JOB_QUEUE_URL set the API crawls nothing itself: crawls are queued for worker processes
+# (python -m scraper_utils.worker) and this process starts neither Scrapy nor Chrome
+job_queue = job_queue_from_url(os.environ['JOB_QUEUE_URL']) if os.getenv('JOB_QUEUE_URL') else None
 
-def run_selenium_crawler_process(url: str, spider_class: BaseSelenium, result_file: str):
+# Per-retailer token buckets and concurrency caps that adapt to each site's latency and blocks
+throttler = Throttler()
+
+# Price and stock history, buffered and written in batches (database from HISTORY_DATABASE_URL)
+history_store = HistoryStore()
+
+# Concurrent requests for the same URL share one crawl, across uvicorn workers through a shared
+# table (INFLIGHT_DATABASE_URL). Claims outlive the longest crawl a little.
+inflight = SingleFlight(lease=CRAWL_TIMEOUT_SECONDS + 60)
+
+# Threads that run the crawls of batch requests and catalog imports
+CRAWL_WORKERS = sum(spec.max_concurrency for spec in registry)
+crawl_executor = ThreadPoolExecutor(max_workers=CRAWL_WORKERS)
+
+# Uploaded catalogs are kept in memory up to this size, then spooled to a temporary file
+INGEST_SPOOL_BYTES = 1024 * 1024
+
+# Streamed batches pause their crawls once this many results are waiting for a slow client, and
+# server-sent event streams send a keep-alive comment after this many idle seconds
+BATCH_STREAM_BUFFER = int(os.getenv('BATCH_STREAM_BUFFER', '32'))
+SSE_KEEPALIVE_SECONDS = float(os.getenv('SSE_KEEPALIVE', '15'))
+
+
+def get_driver_pool():
+    global driver_pool
+    with driver_pool_lock:
+        if driver_pool is None:
+            from scraper_utils.driver_pool import DriverPool
+            driver_pool = DriverPool()
+    return driver_pool
+
+
+@app.on_event("startup")
+def start_crawler_services():
+    """What any crawl needs, the ingest CLI starts only these."""
+    history_store.start()
+    inflight.start()
+    if job_queue is None:
+        scrapy_service.start()
+
+
+@app.on_event("startup")
+def start_api_services():
+    if job_queue is None and os.getenv('DRIVER_POOL_WARM', '1') == '1':
+        # Launch the browsers in the background so the API starts answering right away
+        threading.Thread(target=lambda: get_driver_pool().start(), daemon=True).start()
+    recrawl_scheduler.start()
+
+
+@app.on_event("shutdown")
+def stop_api_services():
+    recrawl_scheduler.stop()
+
+
+@app.on_event("shutdown")
+def stop_crawler_services():
+    job_manager.shutdown()
+    scrapy_service.stop()
+    if driver_pool is not None:
+        driver_pool.close()
+    history_store.stop()
+
+
+def run_selenium_crawler_process(url: str, spider_class, slot=None):
+    spider = None
     try:
-        spider = spider_class(url=url, result_file=result_file)
-        spider.run()
-        return read_result_file(result_file)
+        spider = spider_class(url=url, driver_pool=get_driver_pool())
+        with on_expire(spider.abort):
+            result = spider.run()
+        if slot is not None:
+            slot.blocked = spider.blocked
+        return result.to_dict()
     except Exception as e:
         traceback.print_exc()
         return {"error": str(e)}
+    finally:
+        # Always hand the session back, even when the spider did not close it itself
+        if spider is not None:
+            spider.close_browser()
+
+
+def run_http_crawler_process(url: str, spider_class, slot=None):
+    """Try the HTTP fast path. Returns the result dict, or None when the browser is needed."""
+    try:
+        spider = spider_class(url=url)
+        result = spider.run()
+        # Only the engine whose result is returned reports a block: a 403 here that the browser then
+        # gets past must not slow the retailer down
+        if slot is not None:
+            slot.blocked = result is not None and spider.status_code in BLOCK_STATUSES
+    except Exception:
+        traceback.print_exc()
+        if slot is not None:
+            slot.blocked = False
+        return None
+    return result.to_dict() if result is not None else None
+
+
+def run_scrapy_crawler(url: str, spec: SpiderSpec, slot=None, profile_id: Optional[str] = None):
+    """Crawl on the Scrapy workers, cancelling the crawl there if the current deadline expires."""
+    deadline = current_deadline()
+    # Only the worker process imports the Scrapy spider
+    future = scrapy_service.submit(spec.spider, url, profile_id=profile_id,
+                                   timeout=deadline.remaining() if deadline is not None else None)
+    with on_expire(lambda: scrapy_service.cancel(future, deadline.error())):
+        result = future.result()
+    timings = current_timings()
+    if timings is not None:
+        timings.extend(future.info.get('phases', ()))
+    if slot is not None:
+        slot.blocked = future.info.get('http_status') in BLOCK_STATUSES
+    return result
+
+
+def run_engine(url: str, spec: SpiderSpec, engine: str, slot=None, profile_id: Optional[str] = None):
+    """Crawl with one engine in this process. The 'http' fast path returns None when the page needs a browser."""
+    if engine == 'scrapy':
+        return run_scrapy_crawler(url, spec, slot, profile_id)
+    with profiled(profile_id, f"{spec.name} {url} ({engine})"):
+        if engine == 'http':
+            return run_http_crawler_process(url, spec.load_fast_path(), slot)
+        return run_selenium_crawler_process(url, spec.load(), slot)
+
+
+def run_remote_crawler(url: str, spec: SpiderSpec, slot=None, profile_id: Optional[str] = None):
+    """Queue the crawl for the workers and wait for their reply, within the current deadline."""
+    deadline = current_deadline()
+    job = new_job(url, spec.name, spec.engines, deadline.remaining(), profile_id)
+    job_queue.put(job)
+    with on_expire(lambda: job_queue.cancel(job['id'])):
+        reply = job_queue.wait(job['id'], timeout=deadline.remaining())
+    deadline.check()
+    if reply is None:
+        raise RuntimeError("No worker replied")
+    timings = current_timings()
+    if timings is not None:
+        timings.extend(reply['phases'])
+        timings.add_network(reply.get('network', {}))
+    if profile_id and reply.get('profile'):
+        import_capture(profile_id, reply['profile'])
+    if slot is not None:
+        slot.blocked = reply['blocked']
+    return reply['result']
+
+
+def run_browser_crawler(url: str, spec: SpiderSpec, slot=None):
+    """Run a Selenium retailer, reading embedded page data over plain HTTP first when it supports it."""
+    if spec.fast_path:
+        result = run_http_crawler_process(url, spec.load_fast_path(), slot)
+        if result is not None:
+            return result
+        print("Fast path could not extract the product, falling back to Selenium")
+    return run_selenium_crawler_process(url, spec.load(), slot)
+
+
+def resolve_spider(url: str) -> Optional[SpiderSpec]:
+    """Return the spec of the spider handling a URL's hostname, or None when unsupported."""
+    return registry.lookup(url)
+
+
+def unsupported_result():
+    return Result(price=0, status=StockStatus.URL_NOT_SUPPORTED, category="URL not supported")
+
+
+def crawl_url(url: str, profile_id: Optional[str] = None):
+    """Run the matching spider for a URL and return its result dict. Blocks until the crawl is done."""
+    spec = resolve_spider(url)
+    if spec is None:
+        return unsupported_result().to_dict()
+    return crawl_with_spec(url, spec, profile_id)
+
+
+def crawl_with_spec(url: str, spec: SpiderSpec, profile_id: Optional[str] = None):
+    """Crawl a URL of a known retailer under that retailer's throttle.
+
+    With ``profile_id`` the crawl runs under cProfile and tracemalloc, in the Scrapy worker, the
+    queue worker or this process, and the capture is saved under that id in this process's
+    PROFILE_DIR (a queue worker sends it back with its reply). The crawl runs under
+    the caller's deadline (a job's) or one of CRAWL_TIMEOUT_SECONDS, and returns a timeout result
+    when it expires.
+    """
+    with measure_crawl(spec.name, spec.engine) as timings, enforce(CRAWL_TIMEOUT_SECONDS) as deadline:
+        try:
+            waiting = time.perf_counter()
+            with throttler.get(spec).slot() as slot:
+                timings.add('throttle_wait', time.perf_counter() - waiting)
+                deadline.check()
+                if job_queue is not None:
+                    result = run_remote_crawler(url, spec, slot, profile_id)
+                elif spec.engine == 'scrapy':
+                    result = run_scrapy_crawler(url, spec, slot, profile_id)
+                else:
+                    with profiled(profile_id, f"{spec.name} {url}"):
+                        result = run_browser_crawler(url, spec, slot)
+                # Whatever a killed browser left behind is not a result
+                deadline.check()
+                timings.outcome = 'blocked' if slot.blocked else outcome_of(result)
+                return result
+        except CrawlInterrupted as e:
+            print(f"Crawl of {url} stopped: {e}")
+            timings.outcome = e.reason
+            return interrupted_result(deadline)
+
+
+# Crawl jobs run on worker threads off the event loop (thread count from JOB_WORKERS)
+job_manager = JobManager(crawl_url, timeout=CRAWL_TIMEOUT_SECONDS)
+
+# Seconds a cached result stays fresh per retailer, it is then served stale while it refreshes
+result_cache = ResultCache(max_entries=int(os.getenv('RESULT_CACHE_SIZE', '5000')),
+                           ttls={spec.name: spec.cache_ttl for spec in registry})
+
+
+def crawl_item(item: CrawlerRequest):
+    """Crawl one catalog item and add its result to the history."""
+    spec = resolve_spider(item.url)
+    if spec is None:
+        return unsupported_result().to_dict()
+    result = crawl_with_spec(item.url, spec)
+    history_store.record(item.sku, item.url, spec.name, result)
+    return result
+
+
+def cache_job_result(key: str, retailer: str, job):
+    """Store the job's result in the cache once it finishes successfully."""
+    def store(future):
+        if not future.cancelled() and future.exception() is None and result_cache.is_cacheable(future.result()):
+            result_cache.set(key, future.result(), retailer)
+
+    job.future.add_done_callback(store)
+
+
+def record_job_history(retailer: str, job):
+    """Add the job's result to the price history once it finishes."""
+    def record(future):
+        if not future.cancelled() and future.exception() is None:
+            history_store.record(job.sku, job.url, retailer, future.result())
+
+    job.future.add_done_callback(record)
+
+
+def refresh_in_background(key: str, retailer: str, sku: Optional[str], url: str):
+    if not result_cache.begin_refresh(key):
+        return
+    job = job_manager.submit(sku, url)
+    cache_job_result(key, retailer, job)
+    record_job_history(retailer, job)
+    job.future.add_done_callback(lambda _: result_cache.end_refresh(key))
+
+
+def dispatch_recrawl(sku: Optional[str], url: str, spec: SpiderSpec):
+    """Start a scheduled crawl the same way /run_crawler/ does and return its job's future."""
+    job = job_manager.submit(sku, url)
+    cache_job_result(canonical_url(url), spec.name, job)
+    record_job_history(spec.name, job)
+    return job.future
+
+
+# Keeps tracked products fresh within each retailer's hourly recrawl budget. The tracked products
+# are kept in the history database, shared by every uvicorn worker.
+recrawl_scheduler = RecrawlScheduler(resolve_spider, dispatch_recrawl, history_store.engine)
+
+
+async def crawl_async(url: str, spec: SpiderSpec):
+    """Run one crawl without blocking the event loop, or join the one already running for the URL.
+
+    Returns ``(result, joined)``. The crawl's deadline is enforced by crawl_with_spec.
+    """
+    return await inflight.run(canonical_url(url), lambda: crawl_executor.submit(crawl_with_spec, url, spec))
+
+
+async def crawl_batch(items, buffer: Optional[int] = None, idle: Optional[float] = None):
+    """Crawl batch items, yielding ``(index, record)`` as each one finishes.
+
+    With ``buffer`` at most that many crawls run or sit finished waiting for the consumer, so a
+    consumer that stops reading stops further crawls. With ``idle`` it yields None when nothing
+    finished for that many seconds.
+    """
+    finished = asyncio.Queue()
+    credits = asyncio.Semaphore(buffer) if buffer else None
+
+    # Group the items by retailer so each group runs at that retailer's own (throttled) concurrency
+    groups = defaultdict(list)
+    unsupported = []
+    for index, item in enumerate(items):
+        spec = resolve_spider(item.url)
+        if spec is None:
+            unsupported.append((index, {"sku": item.sku, "url": item.url, "result": unsupported_result().to_dict()}))
+        else:
+            groups[spec].append((index, item))
+
+    async def run_group(spec, entries):
+        # Never hold more executor threads than the throttle could ever let through for this retailer
+        semaphore = asyncio.Semaphore(spec.max_concurrency)
+
+        async def run_one(index, item):
+            if credits is not None:
+                await credits.acquire()
+            joined = False
+            async with semaphore:
+                try:
+                    result, joined = await crawl_async(item.url, spec)
+                except Exception as e:
+                    traceback.print_exc()
+                    result = {"error": str(e)}
+            if not joined:
+                history_store.record(item.sku, item.url, spec.name, result)
+            finished.put_nowait((index, {"sku": item.sku, "url": item.url, "result": result}))
+
+        await asyncio.gather(*(run_one(*entry) for entry in entries))
+
+    tasks = [asyncio.create_task(run_group(spec, entries)) for spec, entries in groups.items()]
+    getter = None
+    try:
+        for entry in unsupported:
+            yield entry
+        for _ in range(len(items) - len(unsupported)):
+            # The same get is awaited across idle timeouts so no result is lost to a cancellation
+            getter = asyncio.ensure_future(finished.get())
+            while not (await asyncio.wait({getter}, timeout=idle))[0]:
+                yield None
+            yield getter.result()
+            # Only once the consumer asks for more may another crawl start
+            if credits is not None:
+                credits.release()
+        await asyncio.gather(*tasks)
+    finally:
+        # The client went away: drop the crawls not started yet. Started ones finish for the cache.
+        for task in tasks + [getter]:
+            if task is not None:
+                task.cancel()
+
+
+def sse_event(event: str, data, event_id=None) -> str:
+    lines = [f"event: {event}"]
+    if event_id is not None:
+        lines.append(f"id: {event_id}")
+    lines.append(f"data: {dumps(data)}")
+    return '\n'.join(lines) + '\n\n'
+
+
+def stream_batch(items, stream: str):
+    """Send each result of the batch as soon as it is crawled, as NDJSON lines or server-sent events."""
+    async def ndjson():
+        async for index, record in crawl_batch(items, BATCH_STREAM_BUFFER):
+            yield dumps(dict(record, index=index)) + '\n'
+        print("Completed streamed batch of " + str(len(items)))
+
+    async def events():
+        count = 0
+        async for entry in crawl_batch(items, BATCH_STREAM_BUFFER, idle=SSE_KEEPALIVE_SECONDS):
+            if entry is None:
+                # Keeps proxies from closing a stream waiting on slow crawls
+                yield ": keep-alive\n\n"
+                continue
+            index, record = entry
+            count += 1
+            yield sse_event('result', dict(record, index=index), event_id=index)
+        yield sse_event('done', {'count': count})
+        print("Completed streamed batch of " + str(count))
+
+    if stream == 'sse':
+        # X-Accel-Buffering stops nginx from holding the events back
+        return StreamingResponse(events(), media_type='text/event-stream',
+                                 headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+    return StreamingResponse(ndjson(), media_type='application/x-ndjson')
+
+
+@app.post("/run_crawler/batch")
+async def run_crawler_batch(request: BatchCrawlerRequest, stream: Optional[str] = None,
+                            accept: Optional[str] = Header(None)):
+    """Crawl several URLs.
 
+    With ``?stream=ndjson`` or ``?stream=sse`` (or an ``Accept`` of ``application/x-ndjson`` or
+    ``text/event-stream``) each result is sent as soon as its crawl finishes, tagged with its
+    item's index; otherwise the response waits for the whole batch.
+    """
+    if stream is None:
+        accept = accept or ''
+        stream = 'sse' if 'text/event-stream' in accept else 'ndjson' if 'application/x-ndjson' in accept else None
+    elif stream not in ('ndjson', 'sse'):
+        raise HTTPException(status_code=400, detail="stream must be ndjson or sse")
+    if stream is not None:
+        return stream_batch(request.items, stream)
 
-class CrawlerRequest(BaseModel):
-    sku: Optional[str]
-    url: str
+    results = [None] * len(request.items)
+    async for index, record in crawl_batch(request.items):
+        results[index] = record
+    print("Completed batch of " + str(len(results)))
+    return {"results": results}
 
 
-def clean_json_file(file_path):
-    if os.path.exists(file_path):
-        with open(file_path, "w") as f:
-            json.dump({}, f)
+@app.post("/ingest")
+async def ingest_catalog(request: Request, input_format: Optional[str] = None, output_format: str = 'ndjson'):
+    """Crawl a CSV or JSONL catalog sent as the request body, streaming results back as they finish."""
+    if output_format not in ('ndjson', 'csv'):
+        raise HTTPException(status_code=400, detail="output_format must be ndjson or csv")
+    input_format = input_format or catalog_format(request.headers.get('content-type'))
 
+    catalog = tempfile.SpooledTemporaryFile(max_size=INGEST_SPOOL_BYTES)
+    async for chunk in request.stream():
+        catalog.write(chunk)
+    catalog.seek(0)
 
-def read_result_file(result_file):
-    if os.path.exists(result_file):
-        with open(result_file, 'r') as f:
-            return json.load(f)
-    else:
-        return {"No result found"}
+    def lines():
+        # Starlette iterates this on its thread pool, a slow client simply stops further crawls
+        try:
+            rows = read_catalog(catalog, input_format)
+            yield from format_records(crawl_catalog(rows, crawl_item, crawl_executor, CRAWL_WORKERS), output_format)
+        finally:
+            catalog.close()
 
+    media_type = 'text/csv' if output_format == 'csv' else 'application/x-ndjson'
+    return StreamingResponse(lines(), media_type=media_type)
 
-def stop_process(url):
-    if url in processes:
-        process = processes[url]
-        if isinstance(process, multiprocessing.Process):
-            process.terminate()
-        del processes[url]
+
+def crawler_response(result, timings: Optional[dict] = None, profile_id: Optional[str] = None):
+    response = {"message": result}
+    if timings is not None:
+        response["timings"] = timings
+    # No link when no capture was saved here, e.g. a worker that could not send it back
+    if profile_id is not None and os.path.exists(artifact_paths(profile_id)[0]):
+        response["profile"] = {"id": profile_id, "summary": f"/profiles/{profile_id}",
+                               "pstats": f"/profiles/{profile_id}/pstats"}
+    return response
 
 
 @app.post("/run_crawler/")
-async def run_crawler(request: CrawlerRequest):
+async def run_crawler(request: CrawlerRequest, timings: bool = False, profile: bool = False,
+                      x_profile: Optional[str] = Header(None)):
+    """Crawl one URL.
+
+    With ``?timings=true`` the response also breaks down where the time went (ms) and, for browser
+    crawls, how many requests Chrome sent and blocked and the bytes it downloaded. With
+    ``?profile=true`` or an ``X-Profile: 1`` header the crawl skips the cache and runs under the
+    profiler, the response then links to the saved capture.
+    """
+    started = time.perf_counter()
+    profile_id = uuid.uuid4().hex if profile or (x_profile or '').lower() in ('1', 'true', 'yes') else None
     url = request.url
-    result = Result()
-    # Determine the spider type and result file based on URL
-    if 'costco' in url:
-        spider = CostcoSpider
-        result_file = 'result_costco.json'
-        clean_json_file(result_file)
-        spider_type = 'scrapy'
-    elif 'elpalaciodehierro' in url:
-        spider = PalacioSpyder
-        result_file = 'result_palacio.json'
-        clean_json_file(result_file)
-        spider_type = 'scrapy'
-    elif 'liverpool' in url:
-        spider = LiverPoolSeleniumSpider
-        result_file = "result_liverpool.json"
-        clean_json_file(result_file)
-        spider_type = 'selenium'
-    elif 'mercadolibre' in url:
-        spider = MercadoLibreSeleniumSpider
-        result_file = "result_mercadolibre.json"
-        clean_json_file(result_file)
-        spider_type = 'selenium'
-    else:
-
-        result.status = "URL not supported"
-        result.price = "0"
-        result.category = "URL not supported"
+    spec = resolve_spider(url)
+    if spec is None:
         print("Completed")
-        return {"message": result}
+        return {"message": unsupported_result().to_dict()}
+
+    # Serve from the cache when we can, stale entries are returned right away and refreshed behind
+    retailer = spec.name
+    cache_key = canonical_url(url)
+    cached, state = result_cache.get(cache_key) if profile_id is None else (None, result_cache.MISS)
+    cache_lookup_ms = round((time.perf_counter() - started) * 1000, 1)
+    if state == result_cache.STALE:
+        refresh_in_background(cache_key, retailer, request.sku, url)
+    if state != result_cache.MISS:
+        print("Completed from cache")
+        REQUEST_SECONDS.labels(retailer, state).observe(time.perf_counter() - started)
+        return crawler_response(cached, {"cache_lookup": cache_lookup_ms} if timings else None)
+
+    jobs = []
 
-    if url in processes:
-        raise HTTPException(status_code=400, detail="Crawler is already running for this URL")
+    def start():
+        # Run the crawl as a job and await it, so the event loop keeps serving other clients
+        job = job_manager.submit(request.sku, url, profile_id=profile_id)
+        cache_job_result(cache_key, retailer, job)
+        record_job_history(retailer, job)
+        jobs.append(job)
+        return job.future
 
     try:
         print("SKU: " + request.sku + " URL: " + request.url)
-        timeout_seconds = 300
-        if spider_type == 'scrapy':
-            # For Scrapy spiders, use ProcessPoolExecutor
-            with ProcessPoolExecutor(max_workers=min(multiprocessing.cpu_count(), 4)) as pool:
-                result_future = pool.submit(run_scrapy_crawler_process, url, spider, result_file)
-                processes[url] = result_future
-                result = result_future.result()
-                try:
-                    result = result_future.result(timeout=timeout_seconds)
-                except TimeoutError:
-                    Logger.info("timed out")
-                    stop_process(url)
-                    raise HTTPException(status_code=504, detail="Crawler timed out")
+        if profile_id is None:
+            # A request for a URL that is already being crawled, here or in another worker, waits for that crawl
+            result, joined = await inflight.run(cache_key, start)
         else:
-            # For Selenium spiders, run directly in the main process (single-threaded)
-            try:
-                result = run_selenium_crawler_process(spider_class=spider, url=url, result_file=result_file)
-            except TimeoutError:
-                Logger.info("timed out")
-                stop_process(url)
-                raise HTTPException(status_code=504, detail="Crawler timed out")
+            result, joined = await asyncio.wrap_future(start()), False
+        error_type = result.get('error_type') if isinstance(result, dict) else None
+        if error_type == 'timeout':
+            print("Crawler timed out")
+            raise HTTPException(status_code=504, detail=result)
+        if error_type == 'cancelled':
+            raise HTTPException(status_code=409, detail=result)
 
-        print("Completed")
-        return {"message": result}
+        print("Completed" + (" by a crawl already running" if joined else ""))
+        REQUEST_SECONDS.labels(retailer, 'coalesced' if joined else 'crawl').observe(time.perf_counter() - started)
+        if jobs:
+            crawl_timings = jobs[0].timings.to_dict()
+        else:
+            crawl_timings = {"coalesced_wait": round((time.perf_counter() - started) * 1000, 1)}
+        return crawler_response(result, {"cache_lookup": cache_lookup_ms, **crawl_timings} if timings else None,
+                                profile_id)
 
+    except HTTPException:
+        raise
     except Exception as e:
         traceback.print_exc()
         raise HTTPException(status_code=500, detail=str(e))
     finally:
-        stop_process(url)
-        # Clean up process entry if the process is completed or failed
-        if url in processes:
-            del processes[url]
         gc.collect()
+
+
+@app.post("/jobs/", status_code=202)
+async def submit_job(request: CrawlerRequest):
+    job = job_manager.submit(request.sku, request.url)
+    spec = resolve_spider(request.url)
+    if spec is not None:
+        record_job_history(spec.name, job)
+    return {"job_id": job.id, "status": job.status}
+
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    job = job_manager.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job.to_dict()
+
+
+@app.delete("/jobs/{job_id}")
+async def cancel_job(job_id: str):
+    """Cancel a queued or running job. A running crawl has its browser or Scrapy job killed."""
+    job = job_manager.cancel(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job.to_dict()
+
+
+@app.get("/jobs/{job_id}/result")
+async def get_job_result(job_id: str):
+    job = job_manager.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    if job.status == job.FAILED:
+        raise HTTPException(status_code=500, detail=job.error)
+    if job.status == job.TIMED_OUT:
+        raise HTTPException(status_code=504, detail=job.result)
+    if job.status == job.CANCELLED:
+        raise HTTPException(status_code=409, detail=job.result)
+    if not job.done:
+        raise HTTPException(status_code=409, detail=f"Job is {job.status}")
+    return {"message": job.result}
+
+
+@app.get("/cache/stats")
+async def get_cache_stats():
+    return result_cache.stats()
+
+
+@app.get("/workers")
+async def get_workers():
+    """Workers that checked in recently and the engines they run, in distributed mode."""
+    if job_queue is None:
+        return {"distributed": False, "workers": []}
+    return {"distributed": True, "workers": job_queue.workers()}
+
+
+@app.get("/inflight/stats")
+async def get_inflight_stats():
+    return inflight.stats()
+
+
+@app.get("/throttle/stats")
+async def get_throttle_stats():
+    return throttler.stats()
+
+
+# Plain def endpoints: FastAPI runs them on its thread pool, so the database query never blocks the loop
+@app.get("/history/latest")
+def get_latest_observation(sku: Optional[str] = None, url: Optional[str] = None):
+    if sku is None and url is None:
+        raise HTTPException(status_code=400, detail="Pass a sku or a url")
+    observation = history_store.latest(sku=sku, url=url)
+    if observation is None:
+        raise HTTPException(status_code=404, detail="No observations found")
+    return observation
+
+
+@app.get("/history")
+def get_history(sku: Optional[str] = None, retailer: Optional[str] = None, start: Optional[datetime] = None,
+                end: Optional[datetime] = None, limit: int = 1000):
+    if sku is None and retailer is None:
+        raise HTTPException(status_code=400, detail="Pass a sku or a retailer")
+    return {"observations": history_store.history(sku=sku, retailer=retailer, start=start, end=end,
+                                                  limit=min(limit, 10000))}
+
+
+@app.get("/history/stats")
+async def get_history_stats():
+    return history_store.stats()
+
+
+@app.get("/browsers/stats")
+async def get_browser_stats():
+    if driver_pool is None:
+        return {"sessions": [], "total_rss_mb": 0, "recycled": {}, "orphans_killed": 0}
+    return driver_pool.watchdog.stats()
+
+
+# Plain def endpoints as well, tracking reads and writes the database
+@app.post("/recrawl/products")
+def track_products(request: BatchCrawlerRequest):
+    for item in request.items:
+        if resolve_spider(item.url) is None:
+            raise HTTPException(status_code=400, detail=f"URL not supported: {item.url}")
+    products = [recrawl_scheduler.track(item.sku, item.url) for item in request.items]
+    return {"products": [product.to_dict() for product in products]}
+
+
+@app.get("/recrawl/products")
+def get_tracked_product(url: str):
+    product = recrawl_scheduler.get(url)
+    if product is None:
+        raise HTTPException(status_code=404, detail="Product is not tracked")
+    return product.to_dict()
+
+
+@app.delete("/recrawl/products")
+def untrack_product(url: str):
+    if not recrawl_scheduler.untrack(url):
+        raise HTTPException(status_code=404, detail="Product is not tracked")
+    return {"url": url, "tracked": False}
+
+
+@app.get("/recrawl/stats")
+async def get_recrawl_stats():
+    return recrawl_scheduler.stats()
+
+
+@app.get("/metrics")
+async def get_metrics():
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
+
+@app.get("/profiles")
+async def get_profiles():
+    return {"profiles": list_profiles()}
+
+
+@app.get("/profiles/{profile_id}")
+async def get_profile_summary(profile_id: str):
+    paths = artifact_paths(profile_id)
+    if paths is None or not os.path.exists(paths[0]):
+        raise HTTPException(status_code=404, detail="Profile not found")
+    with open(paths[0], encoding='utf-8') as f:
+        return PlainTextResponse(f.read())
+
+
+@app.get("/profiles/{profile_id}/pstats")
+async def get_profile_stats(profile_id: str):
+    paths = artifact_paths(profile_id)
+    if paths is None or not os.path.exists(paths[1]):
+        raise HTTPException(status_code=404, detail="Profile not found")
+    return FileResponse(paths[1], media_type='application/octet-stream', filename=f"{profile_id}.prof")
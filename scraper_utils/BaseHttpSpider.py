@@ -0,0 +1,163 @@
+import gzip
+import json
+import re
+import urllib.error
+import urllib.request
+import zlib
+
+from parsel import Selector
+
+from scraper_utils.deadline import remaining
+from scraper_utils.metrics import span
+from scraper_utils.result import Result, StockStatus
+
+USER_AGENT = ("Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) "
+              "Chrome/114.0.5735.199 Safari/537.36")
+
+SCHEMA_AVAILABILITY = {
+    'instock': StockStatus.IN_STOCK,
+    'limitedavailability': StockStatus.IN_STOCK,
+    'onlineonly': StockStatus.IN_STOCK,
+    'preorder': StockStatus.IN_STOCK,
+    'outofstock': StockStatus.OUT_OF_STOCK,
+    'soldout': StockStatus.OUT_OF_STOCK,
+    'discontinued': StockStatus.OUT_OF_STOCK,
+}
+
+
+class BaseHttpSpider:
+    """Extracts a product from the server rendered HTML with a single GET, without a browser.
+
+    Subclasses implement ``parse``. It returns the Result, or None when the page does not carry
+    the fields we need, in which case the caller falls back to the Selenium spider.
+    """
+
+    timeout = 15
+
+    def __init__(self, url: str):
+        self.url = url
+        self.result = Result()
+        self.status_code = None
+
+    def fetch(self):
+        """GET the page and return (status code, decoded body)."""
+        request = urllib.request.Request(self.url, headers={
+            'User-Agent': USER_AGENT,
+            'Accept': 'text/html,application/xhtml+xml',
+            'Accept-Language': 'es-MX,es;q=0.9',
+            'Accept-Encoding': 'gzip, deflate',
+        })
+        try:
+            with urllib.request.urlopen(request, timeout=remaining(self.timeout)) as response:
+                return response.status, self.decode(response.read(), response.headers)
+        except urllib.error.HTTPError as e:
+            return e.code, self.decode(e.read(), e.headers)
+
+    @staticmethod
+    def decode(body: bytes, headers):
+        encoding = headers.get('Content-Encoding', '')
+        if encoding == 'gzip':
+            body = gzip.decompress(body)
+        elif encoding == 'deflate':
+            body = zlib.decompress(body)
+        return body.decode(headers.get_content_charset() or 'utf-8', errors='replace')
+
+    def run(self):
+        """Fetch and parse the page. Returns the Result, or None if the fast path can't answer."""
+        with span('http_fetch'):
+            self.status_code, body = self.fetch()
+        if self.status_code in (404, 410):
+            return self.link_broken()
+        if self.status_code != 200:
+            return None
+        with span('http_parse'):
+            return self.parse(Selector(text=body))
+
+    def parse(self, selector: Selector):
+        raise NotImplementedError("Subclasses must implement this method")
+
+    def link_broken(self):
+        self.result.status = 'Link broken'
+        self.result.price = 0
+        self.result.category = 'Link broken'
+        return self.result
+
+    @staticmethod
+    def json_ld(selector: Selector):
+        """Return every JSON-LD object on the page, with @graph containers flattened."""
+        objects = []
+        for script in selector.css('script[type="application/ld+json"]::text').getall():
+            try:
+                data = json.loads(script)
+            except ValueError:
+                continue
+            for item in data if isinstance(data, list) else [data]:
+                if isinstance(item, dict) and '@graph' in item:
+                    objects.extend(item['@graph'])
+                else:
+                    objects.append(item)
+        return [item for item in objects if isinstance(item, dict)]
+
+    @staticmethod
+    def find_type(objects, type_name: str):
+        for item in objects:
+            item_type = item.get('@type')
+            if item_type == type_name or (isinstance(item_type, list) and type_name in item_type):
+                return item
+        return None
+
+    @staticmethod
+    def find_key(data, keys):
+        """Depth-first search of an embedded state blob for the first value stored under one of ``keys``."""
+        stack = [data]
+        while stack:
+            node = stack.pop()
+            if isinstance(node, dict):
+                for key in keys:
+                    if node.get(key) not in (None, '', [], {}):
+                        return node[key]
+                stack.extend(reversed(list(node.values())))
+            elif isinstance(node, list):
+                stack.extend(reversed(node))
+        return None
+
+    @staticmethod
+    def embedded_json(selector: Selector, pattern: str):
+        """Parse a JSON blob assigned in an inline script, e.g. ``window.__PRELOADED_STATE__ = {...};``."""
+        for script in selector.css('script:not([src])::text').getall():
+            match = re.search(pattern + r'\s*=\s*(\{.*\})\s*;?\s*$', script, re.S)
+            if match:
+                try:
+                    return json.loads(match.group(1))
+                except ValueError:
+                    return None
+        return None
+
+    @staticmethod
+    def offer_price(product: dict):
+        offers = product.get('offers')
+        if isinstance(offers, list):
+            offers = offers[0] if offers else None
+        if not isinstance(offers, dict):
+            return None, None
+        price = offers.get('price', offers.get('lowPrice'))
+        return price, offers.get('availability')
+
+    @staticmethod
+    def availability_status(availability):
+        if not availability:
+            return None
+        return SCHEMA_AVAILABILITY.get(str(availability).rstrip('/').rsplit('/', 1)[-1].lower())
+
+    @staticmethod
+    def breadcrumb_names(objects):
+        breadcrumbs = BaseHttpSpider.find_type(objects, 'BreadcrumbList')
+        if not breadcrumbs:
+            return []
+        elements = sorted(breadcrumbs.get('itemListElement', []), key=lambda element: element.get('position', 0))
+        names = []
+        for element in elements:
+            name = element.get('name') or (element.get('item') or {}).get('name')
+            if name:
+                names.append(name.strip())
+        return names
@@ -9,45 +9,85 @@ from selenium.webdriver.chrome.options import Options as ChromeOptions
 from selenium.webdriver.firefox.options import Options as FirefoxOptions
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
-from selenium.common.exceptions import TimeoutException, NoSuchElementException
+from selenium.common.exceptions import TimeoutException, NoSuchElementException, WebDriverException
+from parsel import Selector
 from webdriver_manager.chrome import ChromeDriverManager
 from selenium.webdriver.chrome.service import Service
 
+from scraper_utils.browser_watchdog import BrowserSession
+from scraper_utils.metrics import record_network, span, timed
+from scraper_utils.resource_blocking import ResourceBlockingPolicy, collect_network_stats
+
+# Titles of the bot protection and rate limit pages retailers serve instead of the product
+BLOCK_PAGE_MARKERS = ('access denied', 'attention required', 'too many requests', '403 forbidden', 'captcha',
+                      'just a moment', 'pardon our interruption')
+
 
 class BaseSelenium:
     logging.basicConfig(level=logging.CRITICAL)
 
-    def __init__(self, browser: str = 'chrome', implicit_wait: int = 10):
-        # Initialize the WebDriver based on the browser type
-        if browser == 'chrome':
-            chrome_options = ChromeOptions()
-            chrome_options.page_load_strategy = 'eager'
-            chrome_options.add_argument("--no-sandbox")
-            chrome_options.add_argument("--disable-dev-shm-usage")
-            chrome_options.add_argument("--disable-gpu")
-            chrome_options.add_argument("--headless")
-            chrome_options.add_argument("--log-level=4")
-            chrome_options.add_argument("--window-size=1920x1080")
-            chrome_options.add_argument(
-                "user-agent=Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) "
-                "Chrome/114.0.5735.199 Safari/537.36")
-            chrome_options.add_argument("--disable-blink-features=AutomationControlled")  # Prevent detection
-            chrome_options.add_argument("--enable-javascript")  # Ensure JS is enabled
-            prefs = {
-                "profile.managed_default_content_settings.images": 2,  # Disable images
-                "profile.default_content_setting_values.notifications": 2,  # Disable notifications
-                "profile.managed_default_content_settings.stylesheets": 2  # Disable CSS
-            }
-            driver_path = self.get_chrome_driver_path()
-
-            service = Service(driver_path)
-
-            self.driver = webdriver.Chrome(service=service, options=chrome_options)
-        else:
-            raise ValueError(f"Browser {browser} is not supported.")
+    # Requests the browser may skip on this retailer's pages, None to let everything through
+    resource_blocking = ResourceBlockingPolicy()
+
+    # 'snapshot' waits once and parses one copy of the DOM locally, 'live' queries the driver per field
+    extraction_mode = 'snapshot'
+
+    def __init__(self, browser: str = 'chrome', implicit_wait: int = 10, driver_pool=None):
+        # Borrow a warm session from the pool when one is given, otherwise own a fresh browser
+        self.driver_pool = driver_pool
+        with span('driver_start'):
+            if driver_pool is not None:
+                self.driver = driver_pool.acquire()
+            elif browser == 'chrome':
+                self.driver = self.create_chrome_driver()
+            else:
+                raise ValueError(f"Browser {browser} is not supported.")
 
+        self.implicit_wait = implicit_wait
         self.driver.implicitly_wait(implicit_wait)
         self.result = None
+        self.network_stats = None
+        self.blocked = False
+        self.aborted = False
+        try:
+            self.apply_resource_blocking()
+        except Exception:
+            # No spider is returned to close it, so give the session up here rather than leak it
+            if driver_pool is not None:
+                driver_pool.discard(self.driver)
+            else:
+                self.driver.quit()
+            self.driver = None
+            raise
+
+    @classmethod
+    def create_chrome_driver(cls):
+        """Launch a new headless Chrome session."""
+        chrome_options = ChromeOptions()
+        chrome_options.page_load_strategy = 'eager'
+        chrome_options.add_argument("--no-sandbox")
+        chrome_options.add_argument("--disable-dev-shm-usage")
+        chrome_options.add_argument("--disable-gpu")
+        chrome_options.add_argument("--headless")
+        chrome_options.add_argument("--log-level=4")
+        chrome_options.add_argument("--window-size=1920x1080")
+        chrome_options.add_argument(
+            "user-agent=Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) "
+            "Chrome/114.0.5735.199 Safari/537.36")
+        chrome_options.add_argument("--disable-blink-features=AutomationControlled")  # Prevent detection
+        chrome_options.add_argument("--enable-javascript")  # Ensure JS is enabled
+        # Images and CSS are left to each spider's resource_blocking policy, which can allow them back
+        prefs = {
+            "profile.default_content_setting_values.notifications": 2,  # Disable notifications
+        }
+        chrome_options.add_experimental_option("prefs", prefs)
+        # Keep the DevTools network events so we can measure what resource blocking saved
+        chrome_options.set_capability("goog:loggingPrefs", {"performance": "ALL"})
+        driver_path = cls.get_chrome_driver_path()
+
+        service = Service(driver_path)
+
+        return webdriver.Chrome(service=service, options=chrome_options)
 
     @staticmethod
     def get_chrome_driver_path():
@@ -74,9 +114,32 @@ class BaseSelenium:
 
         return custom_driver_path  # Return the path of the ChromeDriver in the project directory
 
+    def apply_resource_blocking(self):
+        """Block this retailer's unneeded requests (images, fonts, trackers...) at the network level."""
+        policy = self.resource_blocking or ResourceBlockingPolicy(block_types=(), deny_patterns=())
+        policy.apply(self.driver)
+
+    def record_network_stats(self):
+        """Add how many requests were made and blocked, and the bytes downloaded, to this crawl's timings."""
+        try:
+            self.network_stats = collect_network_stats(self.driver)
+        except WebDriverException:
+            self.network_stats = None
+            return
+        record_network(self.network_stats)
+
+    @timed
     def navigate_to_page(self, url: str):
         """Navigate to the given URL."""
         self.driver.get(url)
+        self.blocked = self.is_block_page()
+        if self.blocked:
+            print(f"Blocked by the retailer: {self.driver.title}")
+
+    def is_block_page(self):
+        """Check whether the retailer answered with a bot check or rate limit page."""
+        title = self.driver.title.lower()
+        return any(marker in title for marker in BLOCK_PAGE_MARKERS)
 
     def find_element(self, by: By, value: str):
         """Find an element on the page."""
@@ -86,6 +149,7 @@ class BaseSelenium:
             print(f"Element not found: {value}")
             return None
 
+    @timed
     def wait_for_element(self, by: By, value: str, timeout: int = 10):
         """Wait for an element to be present on the page."""
         try:
@@ -98,6 +162,44 @@ class BaseSelenium:
             print(f"Timed out waiting for element: {value}")
             return None
 
+    @timed
+    def wait_for_any(self, conditions: dict, timeout: float = 10):
+        """Race several page outcomes and resolve on whichever shows up first.
+
+        ``conditions`` maps an outcome name to a (By, value) locator or to a callable taking the driver.
+        Conditions are checked in order on each poll, so list the most specific outcome first.
+        Returns (name, element) for the winner, or (None, None) if nothing matched before the timeout.
+        """
+        def first_outcome(driver):
+            for name, condition in conditions.items():
+                if callable(condition):
+                    if condition(driver):
+                        return name, None
+                else:
+                    elements = driver.find_elements(*condition)
+                    if elements:
+                        return name, elements[0]
+            return False
+
+        # With an implicit wait every missing locator would block the poll for the full implicit wait
+        self.driver.implicitly_wait(0)
+        try:
+            return WebDriverWait(self.driver, timeout, poll_frequency=0.1).until(first_outcome)
+        except TimeoutException:
+            return None, None
+        finally:
+            self.driver.implicitly_wait(self.implicit_wait)
+
+    @timed
+    def snapshot(self, ready_selector, timeout: int = 10):
+        """Wait once for the page to be ready, then fetch the whole DOM in a single call to parse locally.
+
+        ``ready_selector`` is a CSS selector or a (By, value) locator.
+        """
+        by, value = ready_selector if isinstance(ready_selector, tuple) else (By.CSS_SELECTOR, ready_selector)
+        self.wait_for_element(by, value, timeout=timeout)
+        return Selector(text=self.driver.page_source)
+
     def click_element(self, by: By, value: str):
         """Click an element on the page."""
         element = self.find_element(by, value)
@@ -111,16 +213,38 @@ class BaseSelenium:
             element.clear()
             element.send_keys(text)
 
+    @timed
+    def abort(self):
+        """Kill the browser from another thread, so the call the crawl is blocked in fails right away."""
+        driver = self.driver
+        if driver is None:
+            return
+        self.aborted = True
+        if self.driver_pool is not None:
+            self.driver_pool.discard(driver, force=True)
+        else:
+            BrowserSession(driver).kill()
+
     def close_browser(self):
-        """Close the browser."""
+        """Close the browser, or hand it back to the pool it was borrowed from."""
+        if self.driver and self.aborted:
+            # Already killed by abort(), the pool has replaced it
+            self.driver = None
         if self.driver:
-            self.driver.quit()
-            gc.collect()
+            self.record_network_stats()
+            if self.driver_pool is not None:
+                self.driver_pool.release(self.driver)
+            else:
+                self.driver.quit()
+                gc.collect()
+            self.driver = None
 
     def take_screenshot(self, file_name: str):
         """Take a screenshot of the current page."""
+        if self.driver is None or self.aborted:
+            return
         self.driver.save_screenshot(file_name)
 
     def run(self):
-        """Main method to be overridden by child classes with specific test steps."""
+        """Main method to be overridden by child classes with specific test steps. Returns the Result."""
         raise NotImplementedError("You must override the run() method in a subclass.")
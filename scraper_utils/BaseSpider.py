@@ -1,11 +1,26 @@
 import scrapy
 
+from scraper_utils.metrics import Timings
+
 
 class BaseSpider(scrapy.Spider):
     def __init__(self, url=None, *args, **kwargs):
         super(BaseSpider, self).__init__(*args, **kwargs)
         self.start_urls = [url]
         self.result = None
+        # Runs in the Scrapy worker, the service sends these phases back with the result
+        self.timings = Timings()
+
+    def start_requests(self):
+        for url in self.start_urls:
+            yield scrapy.Request(url, callback=self.timed_parse, dont_filter=True)
+
+    def timed_parse(self, response, **kwargs):
+        """Record the download and parse time of the response around the subclass's parse."""
+        if 'download_latency' in response.meta:
+            self.timings.add('download', response.meta['download_latency'])
+        with self.timings.span('parse'):
+            return self.parse(response, **kwargs)
 
     def parse(self, response, **kwargs):
         raise NotImplementedError("Subclasses must implement this method")
@@ -0,0 +1,188 @@
+import logging
+import os
+import threading
+import time
+
+import psutil
+
+from scraper_utils.metrics import BROWSERS_RECYCLED
+
+logger = logging.getLogger(__name__)
+
+BROWSER_PROCESS_NAMES = ('chromedriver', 'chrome', 'chromium', 'google-chrome', 'headless_shell')
+
+
+class BrowserSession:
+    """Book-keeping for one pooled browser: its chromedriver/Chrome process tree, pages served and memory."""
+
+    def __init__(self, driver):
+        self.driver = driver
+        self.pages = 0
+        self.rss = 0
+        self.created_at = time.monotonic()
+        self.checked_out_at = None
+        self.retire_reason = None
+        # pid -> create time, so a recycled pid is never mistaken for one of ours
+        self.processes = {}
+        self.refresh()
+
+    @property
+    def root_pid(self):
+        process = getattr(getattr(self.driver, 'service', None), 'process', None)
+        return getattr(process, 'pid', None)
+
+    def refresh(self) -> int:
+        """Re-read the process tree (Chrome forks renderers as it goes) and return its total RSS."""
+        if self.root_pid is None:
+            return 0
+        try:
+            root = psutil.Process(self.root_pid)
+            tree = [root] + root.children(recursive=True)
+        except psutil.Error:
+            tree = []
+        rss = 0
+        for process in tree:
+            try:
+                self.processes.setdefault(process.pid, process.create_time())
+                rss += process.memory_info().rss
+            except psutil.Error:
+                continue
+        self.rss = rss
+        return rss
+
+    def kill(self):
+        """SIGKILL whatever is left of the tree, e.g. after quit() failed or hung."""
+        kill_processes(self.processes)
+
+
+def kill_processes(processes: dict):
+    """Kill each still running pid of ``{pid: create_time}`` that is the same process we recorded."""
+    for pid, created in processes.items():
+        try:
+            process = psutil.Process(pid)
+            if process.create_time() == created:
+                process.kill()
+        except psutil.Error:
+            continue
+
+
+def find_orphans(known_pids, min_age: float = 0):
+    """Browser processes re-parented to init: chromedriver whose owner died, or the automation Chrome it left.
+
+    Only processes running as our user, not part of a live session and older than ``min_age`` seconds
+    are considered. When we run as PID 1 (a container entrypoint) our own chromedrivers have ppid 1
+    too, and one still being launched belongs to no session yet.
+    """
+    orphans = []
+    user = psutil.Process().username()
+    started_before = time.time() - min_age
+    for process in psutil.process_iter(['pid', 'ppid', 'name', 'username', 'cmdline', 'create_time']):
+        info = process.info
+        if info['ppid'] != 1 or info['pid'] in known_pids or info['username'] != user:
+            continue
+        if (info['create_time'] or 0) > started_before:
+            continue
+        name = (info['name'] or '').lower()
+        if not name.startswith(BROWSER_PROCESS_NAMES):
+            continue
+        cmdline = ' '.join(info['cmdline'] or [])
+        if name.startswith('chromedriver') or '--enable-automation' in cmdline:
+            orphans.append(process)
+    return orphans
+
+
+class BrowserWatchdog:
+    """Background thread that keeps a DriverPool's browsers within bounds.
+
+    Every ``interval`` seconds it measures each session's process tree, marks idle sessions above
+    ``max_rss_mb`` for recycling, discards sessions checked out for longer than ``max_checkout``
+    (their crawl died without handing them back) and kills orphaned chromedriver/Chrome processes.
+    Sessions are also recycled after ``max_pages`` crawls, checked when they are released.
+    """
+
+    def __init__(self, pool, max_pages: int = None, max_rss_mb: float = None, max_checkout: float = None,
+                 interval: float = None):
+        self.pool = pool
+        self.max_pages = max_pages or int(os.getenv('DRIVER_MAX_PAGES', '50'))
+        self.max_rss_mb = max_rss_mb or float(os.getenv('DRIVER_MAX_RSS_MB', '1024'))
+        self.max_checkout = max_checkout or float(os.getenv('DRIVER_MAX_CHECKOUT', '900'))
+        self.interval = interval or float(os.getenv('DRIVER_WATCHDOG_INTERVAL', '30'))
+        self.recycled = {}
+        self.orphans_killed = 0
+        self._stopping = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            self._stopping.clear()
+            self._thread = threading.Thread(target=self._run, name='browser-watchdog', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stopping.set()
+        if self._thread is not None:
+            self._thread.join(timeout=10)
+            self._thread = None
+
+    def recycle_reason(self, session: BrowserSession):
+        """Why a session should be replaced rather than reused, or None."""
+        if session.retire_reason:
+            return session.retire_reason
+        if session.pages >= self.max_pages:
+            return 'pages'
+        if session.refresh() > self.max_rss_mb * 1024 * 1024:
+            return 'rss'
+        return None
+
+    def count_recycled(self, reason: str):
+        self.recycled[reason] = self.recycled.get(reason, 0) + 1
+        BROWSERS_RECYCLED.labels(reason).inc()
+
+    def check(self):
+        """One watchdog pass, also run once when the pool starts."""
+        now = time.monotonic()
+        for session in self.pool.sessions():
+            session.refresh()
+            if session.checked_out_at is None:
+                if session.rss > self.max_rss_mb * 1024 * 1024:
+                    # Idle, so it can't be quit under a crawl; acquire() replaces it instead
+                    session.retire_reason = 'rss'
+            elif now - session.checked_out_at > self.max_checkout:
+                logger.warning("Browser session checked out for %.0fs, its crawl is gone; killing it",
+                               now - session.checked_out_at)
+                self.count_recycled('abandoned')
+                self.pool.discard(session.driver, force=True)
+        self.reap_orphans()
+
+    def reap_orphans(self, min_age: float = None):
+        """Kill orphaned browsers. Those younger than a watchdog interval may be a launch in progress."""
+        if self.pool.launching():
+            return
+        known = set()
+        for session in self.pool.sessions():
+            known.update(session.processes)
+        for process in find_orphans(known, self.interval if min_age is None else min_age):
+            try:
+                logger.warning("Killing orphaned browser process %s (%s)", process.pid, process.info['name'])
+                process.kill()
+                self.orphans_killed += 1
+            except psutil.Error:
+                continue
+
+    def stats(self):
+        sessions = self.pool.sessions()
+        return {
+            'sessions': [{'pages': session.pages, 'rss_mb': round(session.rss / 1024 / 1024, 1),
+                          'age': round(time.monotonic() - session.created_at),
+                          'checked_out': session.checked_out_at is not None} for session in sessions],
+            'total_rss_mb': round(sum(session.rss for session in sessions) / 1024 / 1024, 1),
+            'recycled': dict(self.recycled),
+            'orphans_killed': self.orphans_killed,
+        }
+
+    def _run(self):
+        while not self._stopping.wait(self.interval):
+            try:
+                self.check()
+            except Exception:
+                logger.exception("Browser watchdog pass failed")
@@ -0,0 +1,119 @@
+import threading
+import time
+from collections import OrderedDict
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+from scraper_utils.registry import registry
+
+# Query parameters that only feed analytics on any site and never change the product. Parameters
+# only some retailer uses for tracking are listed in its SpiderSpec's ``tracking_params``.
+TRACKING_PARAMS = {'gclid', 'gclsrc', 'dclid', 'fbclid', 'msclkid', 'srsltid', '_ga', '_gl'}
+TRACKING_PREFIXES = ('utm_',)
+
+
+def canonical_url(url: str) -> str:
+    """Normalize a product URL so every way of linking to the same product maps to one cache key."""
+    parts = urlsplit(url.strip())
+    host = (parts.hostname or '').lower()
+    if parts.port and parts.port not in (80, 443):
+        host = f"{host}:{parts.port}"
+    spec = registry.lookup(url)
+    ignored = TRACKING_PARAMS.union(spec.tracking_params) if spec is not None else TRACKING_PARAMS
+    query = sorted(
+        (key, value) for key, value in parse_qsl(parts.query, keep_blank_values=True)
+        if key not in ignored and not key.startswith(TRACKING_PREFIXES)
+    )
+    return urlunsplit((parts.scheme.lower(), host, parts.path or '/', urlencode(query), ''))
+
+
+class ResultCache:
+    """Bounded LRU cache of crawl results with per-retailer TTLs and stale-while-revalidate.
+
+    An entry is fresh for its retailer's TTL, then stale for ``stale_ttl`` more seconds. Stale
+    entries are still served, the caller is expected to refresh them in the background.
+    """
+
+    FRESH = 'fresh'
+    STALE = 'stale'
+    MISS = 'miss'
+
+    def __init__(self, max_entries: int = 5000, ttls: dict = None, default_ttl: float = 600,
+                 stale_ttl: float = 3600):
+        self.max_entries = max_entries
+        self.ttls = ttls or {}
+        self.default_ttl = default_ttl
+        self.stale_ttl = stale_ttl
+        self._entries = OrderedDict()
+        self._refreshing = set()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.refreshes = 0
+
+    def get(self, key: str):
+        """Return (result, state) where state is FRESH, STALE or MISS."""
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None, self.MISS
+
+            result, stored_at, retailer = entry
+            age = now - stored_at
+            ttl = self.ttls.get(retailer, self.default_ttl)
+            if age < ttl:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return result, self.FRESH
+            if age < ttl + self.stale_ttl:
+                self._entries.move_to_end(key)
+                self.stale_hits += 1
+                return result, self.STALE
+
+            del self._entries[key]
+            self.misses += 1
+            return None, self.MISS
+
+    def set(self, key: str, result, retailer: str = None):
+        with self._lock:
+            self._entries[key] = (result, time.time(), retailer)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def begin_refresh(self, key: str) -> bool:
+        """Claim the background refresh of a stale key. Returns False if one is already running."""
+        with self._lock:
+            if key in self._refreshing:
+                return False
+            self._refreshing.add(key)
+            self.refreshes += 1
+            return True
+
+    def end_refresh(self, key: str):
+        with self._lock:
+            self._refreshing.discard(key)
+
+    @staticmethod
+    def is_cacheable(result) -> bool:
+        # Never cache failed crawls, they should be retried on the next request
+        return isinstance(result, dict) and 'error' not in result
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.stale_hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'hits': self.hits,
+                'stale_hits': self.stale_hits,
+                'misses': self.misses,
+                'hit_ratio': (self.hits + self.stale_hits) / lookups if lookups else 0.0,
+                'evictions': self.evictions,
+                'refreshes': self.refreshes,
+                'refreshing': len(self._refreshing),
+            }
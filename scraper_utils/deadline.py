@@ -0,0 +1,152 @@
+import contextvars
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+_current = contextvars.ContextVar('crawl_deadline', default=None)
+
+
+class CrawlInterrupted(Exception):
+    reason = 'interrupted'
+
+
+class CrawlTimeout(CrawlInterrupted):
+    reason = 'timeout'
+
+
+class CrawlCancelled(CrawlInterrupted):
+    reason = 'cancelled'
+
+
+class Deadline:
+    """Time limit and cancel switch of one crawl.
+
+    When it expires, by timing out or through ``cancel()``, every registered hook runs right away on
+    the expiring thread. Hooks kill whatever the crawl is blocked on (its browser, its Scrapy job),
+    so the crawl unwinds and frees its slot instead of running on unattended.
+    """
+
+    def __init__(self, seconds: float):
+        self.seconds = seconds
+        self.reason = None
+        self.expires_at = None
+        self._hooks = []
+        self._lock = threading.Lock()
+        self._timer = None
+
+    @property
+    def expired(self):
+        return self.reason is not None
+
+    def remaining(self):
+        if self.expires_at is None:
+            return self.seconds
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def arm(self):
+        """Start the clock. Arming twice keeps the first start."""
+        with self._lock:
+            if self._timer is not None or self.reason is not None:
+                return
+            self.expires_at = time.monotonic() + self.seconds
+            self._timer = threading.Timer(self.seconds, self.expire, args=('timeout',))
+            self._timer.daemon = True
+            self._timer.start()
+
+    def disarm(self):
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+
+    def cancel(self):
+        self.expire('cancelled')
+
+    def expire(self, reason: str = 'timeout'):
+        with self._lock:
+            if self.reason is not None:
+                return
+            self.reason = reason
+            hooks, self._hooks = self._hooks, []
+        for hook in hooks:
+            try:
+                hook()
+            except Exception:
+                logger.exception("Deadline hook failed")
+
+    def error(self) -> CrawlInterrupted:
+        if self.reason == 'cancelled':
+            return CrawlCancelled("Crawl cancelled")
+        return CrawlTimeout(f"Crawler timed out after {self.seconds:g}s")
+
+    def check(self):
+        """Raise CrawlTimeout or CrawlCancelled once the deadline has expired."""
+        if self.reason is not None:
+            raise self.error()
+
+    @contextmanager
+    def hook(self, callback):
+        """Run ``callback`` if the deadline expires while the block runs, immediately if it already has."""
+        with self._lock:
+            expired = self.reason is not None
+            if not expired:
+                self._hooks.append(callback)
+        if expired:
+            callback()
+        try:
+            yield
+        finally:
+            with self._lock:
+                if callback in self._hooks:
+                    self._hooks.remove(callback)
+
+
+def current_deadline():
+    return _current.get()
+
+
+@contextmanager
+def enforce(seconds: float = None, deadline: Deadline = None):
+    """Run the block under ``deadline``, or a new one of ``seconds``, and make it the thread's current one.
+
+    Without an explicit deadline, a block nested in another enforced block joins the outer deadline.
+    """
+    if deadline is None:
+        deadline = _current.get()
+        if deadline is not None:
+            yield deadline
+            return
+        deadline = Deadline(seconds)
+    deadline.arm()
+    token = _current.set(deadline)
+    try:
+        yield deadline
+    finally:
+        deadline.disarm()
+        _current.reset(token)
+
+
+@contextmanager
+def on_expire(callback):
+    """Hook ``callback`` to the thread's current deadline, if any, for the duration of the block."""
+    deadline = _current.get()
+    if deadline is None:
+        yield
+        return
+    with deadline.hook(callback):
+        yield
+
+
+def remaining(default: float) -> float:
+    """Seconds a blocking call may take: ``default``, or less when the current deadline is closer."""
+    deadline = _current.get()
+    if deadline is None:
+        return default
+    return max(0.1, min(default, deadline.remaining()))
+
+
+def interrupted_result(deadline: Deadline) -> dict:
+    """The result of a crawl stopped by its deadline. Like every failed crawl it carries an ``error``."""
+    return {'error': str(deadline.error()), 'error_type': deadline.reason, 'timeout_seconds': deadline.seconds}
@@ -0,0 +1,214 @@
+import logging
+import os
+import queue
+import threading
+import time
+from contextlib import contextmanager
+from urllib.parse import urlsplit
+
+from selenium.common.exceptions import WebDriverException
+
+from scraper_utils.BaseSelenium import BaseSelenium
+from scraper_utils.browser_watchdog import BrowserSession, BrowserWatchdog
+
+logger = logging.getLogger(__name__)
+
+
+def origin_of(url: str):
+    """'https://host[:port]' of a page URL, None for about:blank, data: and the like."""
+    parts = urlsplit(url or '')
+    if parts.scheme not in ('http', 'https') or not parts.netloc:
+        return None
+    return f"{parts.scheme}://{parts.netloc}"
+
+
+class DriverPool:
+    """A bounded pool of pre-launched headless Chrome sessions shared by the Selenium spiders.
+
+    Spiders borrow a session with ``acquire()`` and hand it back with ``release()``. Sessions are
+    health checked when borrowed and wiped (cookies, storage, open tabs) when returned, so a
+    checkout never sees state left behind by a previous crawl. A BrowserWatchdog replaces sessions
+    after too many pages or too much memory and kills browsers whose crawl never returned them.
+    """
+
+    def __init__(self, size: int = None, factory=None, acquire_timeout: float = 120):
+        self.size = size or int(os.getenv('DRIVER_POOL_SIZE', '2'))
+        self.factory = factory or BaseSelenium.create_chrome_driver
+        self.acquire_timeout = acquire_timeout
+        # LIFO so the most recently used (and therefore warmest) session is handed out first
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._created = 0
+        self._closed = False
+        # id(driver) -> BrowserSession for every live browser, idle or checked out
+        self._sessions = {}
+        # Browsers being launched, not registered as sessions yet
+        self._launching = 0
+        self.watchdog = BrowserWatchdog(self)
+
+    def start(self):
+        """Clean up browsers orphaned by a previous run, then launch sessions until the pool is full."""
+        # Nothing of ours is running yet, every orphan is left over from a previous run
+        self.watchdog.reap_orphans(min_age=0)
+        self.watchdog.start()
+        while True:
+            driver = self._launch()
+            if driver is None:
+                return
+            self._idle.put(driver)
+
+    def acquire(self, timeout: float = None):
+        """Borrow a healthy session, launching one if the pool is not full yet."""
+        if self._closed:
+            raise RuntimeError("Driver pool is closed.")
+        timeout = self.acquire_timeout if timeout is None else timeout
+
+        while True:
+            try:
+                driver = self._idle.get_nowait()
+            except queue.Empty:
+                driver = self._launch()
+                if driver is None:
+                    # Pool is at capacity, wait for a session to come back
+                    try:
+                        driver = self._idle.get(timeout=timeout)
+                    except queue.Empty:
+                        raise TimeoutError(f"No browser session became available within {timeout}s")
+
+            session = self._sessions.get(id(driver))
+            if session is not None and session.retire_reason:
+                logger.info("Recycling idle browser session (%s)", session.retire_reason)
+                self.watchdog.count_recycled(session.retire_reason)
+                self.discard(driver)
+                continue
+            if self.is_healthy(driver):
+                if session is not None:
+                    session.checked_out_at = time.monotonic()
+                return driver
+            logger.warning("Discarding unhealthy browser session")
+            self.discard(driver)
+
+    def release(self, driver):
+        """Return a borrowed session to the pool after wiping its state, or replace it if it is worn out."""
+        session = self._sessions.get(id(driver))
+        if session is None:
+            # The watchdog already killed it as abandoned
+            return
+        session.checked_out_at = None
+        session.pages += 1
+        if self._closed:
+            self.discard(driver)
+            return
+        reason = self.watchdog.recycle_reason(session)
+        if reason:
+            logger.info("Recycling browser session after %s pages, %.0f MB (%s)", session.pages,
+                        session.rss / 1024 / 1024, reason)
+            self.watchdog.count_recycled(reason)
+            self.discard(driver)
+            return
+        try:
+            self.reset(driver)
+        except WebDriverException:
+            logger.warning("Could not reset browser session, discarding it")
+            self.discard(driver)
+            return
+        self._idle.put(driver)
+
+    def discard(self, driver, force: bool = False):
+        """Quit a session, kill anything it leaves running and free its slot in the pool.
+
+        With ``force`` the browser is killed before quit(), for a session a crawl is still blocked on.
+        """
+        with self._lock:
+            session = self._sessions.pop(id(driver), None)
+            if session is None:
+                return
+            self._created -= 1
+        session.refresh()
+        if force:
+            session.kill()
+        try:
+            driver.quit()
+        except Exception:
+            pass
+        session.kill()
+
+    def sessions(self):
+        with self._lock:
+            return list(self._sessions.values())
+
+    def launching(self) -> int:
+        with self._lock:
+            return self._launching
+
+    @staticmethod
+    def is_healthy(driver):
+        """Check that both chromedriver and the browser still answer."""
+        try:
+            return driver.execute_script("return 1;") == 1
+        except WebDriverException:
+            return False
+
+    @staticmethod
+    def reset(driver):
+        """Clear cookies, storage, extra tabs and network state so the next checkout starts clean."""
+        handles = driver.window_handles
+        # Storage is cleared per origin, note the ones the crawl's tabs ended up on before leaving them
+        origins = set()
+        for handle in reversed(handles):
+            driver.switch_to.window(handle)
+            origins.add(origin_of(driver.current_url))
+            if handle != handles[0]:
+                driver.close()
+        driver.switch_to.window(handles[0])
+
+        driver.execute_cdp_cmd('Network.clearBrowserCookies', {})
+        for origin in origins - {None}:
+            driver.execute_cdp_cmd('Storage.clearDataForOrigin', {
+                'origin': origin,
+                'storageTypes': 'local_storage,session_storage,indexeddb,websql,service_workers,cache_storage',
+            })
+        # Drop the previous crawl's block list, then its network events so stats start from zero
+        driver.execute_cdp_cmd('Network.setBlockedURLs', {'urls': []})
+        driver.get('about:blank')
+        driver.get_log('performance')
+
+    @contextmanager
+    def session(self, timeout: float = None):
+        """Borrow a session for the duration of a ``with`` block."""
+        driver = self.acquire(timeout)
+        try:
+            yield driver
+        finally:
+            self.release(driver)
+
+    def close(self):
+        """Quit every idle session and refuse further checkouts."""
+        self._closed = True
+        self.watchdog.stop()
+        while True:
+            try:
+                driver = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            self.discard(driver)
+
+    def _launch(self):
+        # Reserve a slot first so concurrent callers never launch more than `size` browsers
+        with self._lock:
+            if self._created >= self.size:
+                return None
+            self._created += 1
+            self._launching += 1
+        try:
+            driver = self.factory()
+        except Exception:
+            with self._lock:
+                self._created -= 1
+                self._launching -= 1
+            raise
+        session = BrowserSession(driver)
+        with self._lock:
+            self._sessions[id(driver)] = session
+            self._launching -= 1
+        return driver
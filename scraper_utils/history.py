@@ -0,0 +1,215 @@
+import logging
+import os
+import queue
+import threading
+from datetime import datetime, timezone
+from typing import Optional
+
+from sqlalchemy import DateTime, Index, Integer, String, create_engine, insert, inspect, select, text, update
+from sqlalchemy.orm import DeclarativeBase, Mapped, Session, mapped_column
+
+from scraper_utils.result import parse_price, parse_prices
+
+logger = logging.getLogger(__name__)
+
+
+class Base(DeclarativeBase):
+    pass
+
+
+class Observation(Base):
+    """One crawl result: what a retailer showed for a SKU at a point in time."""
+
+    __tablename__ = 'observations'
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    sku: Mapped[Optional[str]] = mapped_column(String(64))
+    url: Mapped[str] = mapped_column(String(2048))
+    retailer: Mapped[str] = mapped_column(String(64))
+    price: Mapped[Optional[str]] = mapped_column(String(32))
+    price_cents: Mapped[Optional[int]] = mapped_column(Integer)
+    currency: Mapped[Optional[str]] = mapped_column(String(3))
+    status: Mapped[Optional[str]] = mapped_column(String(64))
+    category: Mapped[Optional[str]] = mapped_column(String(255))
+    observed_at: Mapped[datetime] = mapped_column(DateTime)
+
+    __table_args__ = (
+        Index('ix_observations_sku_time', 'sku', 'observed_at'),
+        Index('ix_observations_retailer_time', 'retailer', 'observed_at'),
+    )
+
+    def to_dict(self):
+        return {
+            'sku': self.sku,
+            'url': self.url,
+            'retailer': self.retailer,
+            'price': self.price,
+            'price_cents': self.price_cents,
+            'currency': self.currency,
+            'status': self.status,
+            'category': self.category,
+            'observed_at': self.observed_at.isoformat() + 'Z',
+        }
+
+
+def utcnow():
+    # Stored naive in UTC, SQLite has no time zone support
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+class HistoryStore:
+    """Price and stock history, written in batches by a background thread.
+
+    ``record()`` only appends to an in-memory buffer, so crawls never wait on the database. The
+    writer thread inserts everything buffered in one executemany every ``flush_interval`` seconds,
+    or as soon as ``batch_size`` observations are waiting. ``database_url`` is any SQLAlchemy URL
+    (HISTORY_DATABASE_URL, SQLite by default, ``postgresql+psycopg://...`` in production).
+    """
+
+    def __init__(self, database_url: str = None, batch_size: int = 500, flush_interval: float = 2.0,
+                 max_buffer: int = 100000):
+        self.database_url = database_url or os.getenv('HISTORY_DATABASE_URL', 'sqlite:///history.db')
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.engine = create_engine(self.database_url, pool_pre_ping=True)
+        self._buffer = queue.Queue(maxsize=max_buffer)
+        self._writer = None
+        self._stopping = threading.Event()
+        self._wake = threading.Event()
+        self.dropped = 0
+
+    def start(self):
+        """Create the table if needed and start the writer thread."""
+        Base.metadata.create_all(self.engine)
+        self._add_missing_columns()
+        self._stopping.clear()
+        self._writer = threading.Thread(target=self._write_loop, name='history-writer', daemon=True)
+        self._writer.start()
+
+    def _add_missing_columns(self, chunk_size: int = 10000):
+        """Add the columns of tables created before prices were stored in cents, and fill them for old rows."""
+        existing = {column['name'] for column in inspect(self.engine).get_columns(Observation.__tablename__)}
+        missing = [column for column in Observation.__table__.columns if column.name not in existing]
+        if not missing:
+            return
+        with self.engine.begin() as connection:
+            for column in missing:
+                connection.execute(text(f"ALTER TABLE {Observation.__tablename__} ADD COLUMN {column.name} "
+                                        f"{column.type.compile(self.engine.dialect)}"))
+        if 'price_cents' not in {column.name for column in missing}:
+            return
+        # Old rows only have the display text, parsed a chunk at a time with the vectorized parser
+        last_id = 0
+        while True:
+            with Session(self.engine) as session, session.begin():
+                rows = session.execute(select(Observation.id, Observation.price).where(Observation.id > last_id)
+                                       .order_by(Observation.id).limit(chunk_size)).all()
+                if not rows:
+                    return
+                cents = parse_prices([row.price for row in rows])
+                session.execute(update(Observation), [
+                    {'id': row.id, 'price_cents': price_cents, 'currency': 'MXN'}
+                    for row, price_cents in zip(rows, cents.astype(object).where(cents.notna(), None))])
+                last_id = rows[-1].id
+
+    def stop(self):
+        """Flush what is still buffered and stop the writer thread."""
+        self._stopping.set()
+        self._wake.set()
+        if self._writer is not None:
+            self._writer.join(timeout=30)
+            self._writer = None
+        self.flush()
+
+    def record(self, sku: Optional[str], url: str, retailer: str, result: dict):
+        """Buffer a crawl result. Error results carry no price or status and are skipped."""
+        if not isinstance(result, dict) or 'error' in result:
+            return
+        row = {
+            'sku': sku,
+            'url': url,
+            'retailer': retailer,
+            'price': result.get('price'),
+            # Results cached before prices were kept in cents only carry the display text
+            'price_cents': result['price_cents'] if 'price_cents' in result else parse_price(result.get('price')),
+            'currency': result.get('currency', 'MXN'),
+            'status': result.get('status'),
+            'category': result.get('category'),
+            'observed_at': utcnow(),
+        }
+        try:
+            self._buffer.put_nowait(row)
+        except queue.Full:
+            # The database is down or far behind, losing history beats running out of memory
+            self.dropped += 1
+            return
+        if self._buffer.qsize() >= self.batch_size:
+            self._wake.set()
+
+    def flush(self):
+        """Insert every buffered observation. Returns how many rows were written."""
+        written = 0
+        while True:
+            rows = self._drain()
+            if not rows:
+                return written
+            try:
+                with Session(self.engine) as session, session.begin():
+                    session.execute(insert(Observation), rows)
+            except Exception:
+                logger.exception("Could not write %d observations", len(rows))
+                self.dropped += len(rows)
+                return written
+            written += len(rows)
+
+    def latest(self, sku: str = None, url: str = None) -> Optional[dict]:
+        """The most recent observation of a SKU or URL."""
+        query = select(Observation).order_by(Observation.observed_at.desc(), Observation.id.desc()).limit(1)
+        if sku is not None:
+            query = query.where(Observation.sku == sku)
+        if url is not None:
+            query = query.where(Observation.url == url)
+        with Session(self.engine) as session:
+            observation = session.scalars(query).first()
+            return observation.to_dict() if observation is not None else None
+
+    def history(self, sku: str = None, retailer: str = None, start: datetime = None, end: datetime = None,
+                limit: int = 1000):
+        """Observations of a SKU and/or retailer between ``start`` and ``end`` (UTC), oldest first."""
+        query = select(Observation).order_by(Observation.observed_at, Observation.id).limit(limit)
+        if sku is not None:
+            query = query.where(Observation.sku == sku)
+        if retailer is not None:
+            query = query.where(Observation.retailer == retailer)
+        if start is not None:
+            query = query.where(Observation.observed_at >= to_utc(start))
+        if end is not None:
+            query = query.where(Observation.observed_at < to_utc(end))
+        with Session(self.engine) as session:
+            return [observation.to_dict() for observation in session.scalars(query)]
+
+    def stats(self):
+        return {'buffered': self._buffer.qsize(), 'dropped': self.dropped}
+
+    def _drain(self):
+        rows = []
+        while len(rows) < self.batch_size:
+            try:
+                rows.append(self._buffer.get_nowait())
+            except queue.Empty:
+                break
+        return rows
+
+    def _write_loop(self):
+        while not self._stopping.is_set():
+            # record() wakes us early once a full batch is waiting
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            self.flush()
+
+
+def to_utc(value: datetime) -> datetime:
+    """Convert an aware datetime to the naive UTC the table stores, naive ones are taken as UTC."""
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
@@ -0,0 +1,73 @@
+import os
+import time
+
+from scrapy.downloadermiddlewares.httpcache import HttpCacheMiddleware
+from scrapy.extensions.httpcache import FilesystemCacheStorage, RFC2616Policy
+
+# Added to responses read back from the cache so the policy knows how old the stored copy is
+STORED_AT_HEADER = b'X-Cache-Stored-At'
+
+
+def http_cache_settings():
+    """Scrapy settings enabling the on-disk conditional cache, tunable through the environment."""
+    return {
+        'HTTPCACHE_ENABLED': os.getenv('SCRAPY_HTTPCACHE', '1') == '1',
+        'HTTPCACHE_DIR': os.getenv('SCRAPY_HTTPCACHE_DIR', 'httpcache'),
+        'HTTPCACHE_GZIP': True,
+        'HTTPCACHE_STORAGE': 'scraper_utils.httpcache.TimestampedFilesystemCacheStorage',
+        'HTTPCACHE_POLICY': 'scraper_utils.httpcache.FreshnessWindowPolicy',
+        'HTTPCACHE_FRESHNESS_WINDOW': float(os.getenv('SCRAPY_HTTPCACHE_FRESHNESS', '300')),
+        'DOWNLOADER_MIDDLEWARES': {
+            'scrapy.downloadermiddlewares.httpcache.HttpCacheMiddleware': None,
+            'scraper_utils.httpcache.RevalidatingHttpCacheMiddleware': 900,
+        },
+    }
+
+
+class TimestampedFilesystemCacheStorage(FilesystemCacheStorage):
+    """Filesystem storage that stamps retrieved responses with the time they were stored."""
+
+    def retrieve_response(self, spider, request):
+        response = super().retrieve_response(spider, request)
+        if response is None:
+            return None
+        metadata = self._read_meta(spider, request)
+        response.headers[STORED_AT_HEADER] = str(metadata['timestamp'])
+        return response
+
+
+class FreshnessWindowPolicy(RFC2616Policy):
+    """RFC 2616 caching plus a freshness window of HTTPCACHE_FRESHNESS_WINDOW seconds.
+
+    Within the window a stored page is served without touching the network. After it, the page is
+    revalidated with If-None-Match / If-Modified-Since built from its ETag and Last-Modified, so an
+    unchanged product costs a 304 instead of a full download.
+    """
+
+    def __init__(self, settings):
+        super().__init__(settings)
+        self.freshness_window = settings.getfloat('HTTPCACHE_FRESHNESS_WINDOW', 0)
+
+    def should_cache_response(self, response, request):
+        # Product pages rarely send caching headers, keep them anyway so the window can serve them
+        if self.freshness_window and response.status == 200:
+            return True
+        return super().should_cache_response(response, request)
+
+    def is_cached_response_fresh(self, cachedresponse, request):
+        stored_at = cachedresponse.headers.get(STORED_AT_HEADER)
+        if stored_at and time.time() - float(stored_at) < self.freshness_window:
+            return True
+        # Falls back to RFC 2616 freshness, which also adds the conditional headers to the request
+        return super().is_cached_response_fresh(cachedresponse, request)
+
+
+class RevalidatingHttpCacheMiddleware(HttpCacheMiddleware):
+    """HttpCacheMiddleware that restarts a stored page's freshness window when a 304 confirms it."""
+
+    def process_response(self, request, response, spider):
+        cachedresponse = request.meta.get('cached_response')
+        result = super().process_response(request, response, spider)
+        if cachedresponse is not None and result is cachedresponse and response.status == 304:
+            self.storage.store_response(spider, request, cachedresponse)
+        return result
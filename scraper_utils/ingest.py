@@ -0,0 +1,156 @@
+import argparse
+import csv
+import io
+import sys
+import traceback
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from pydantic import ValidationError
+
+from scraper_utils.schemas import CrawlerRequest
+from scraper_utils.serialization import dumps
+
+CSV_COLUMNS = ['row', 'sku', 'url', 'price', 'price_cents', 'currency', 'status', 'category', 'error']
+
+
+def catalog_format(name: str) -> str:
+    """Guess 'csv' or 'jsonl' from a file name or content type."""
+    name = (name or '').lower()
+    if name.endswith(('.jsonl', '.ndjson', '.json')) or 'json' in name:
+        return 'jsonl'
+    return 'csv'
+
+
+def read_catalog(source, fmt: str = 'csv', chunksize: int = 1000):
+    """Yield ``(row, CrawlerRequest or None, error)`` for every line of a CSV or JSONL catalog.
+
+    ``source`` is a path or a file object. pandas reads it ``chunksize`` rows at a time, so only
+    one chunk is ever held in memory. Rows that do not validate are yielded with their error.
+    """
+    # Imported here so the API starts without pandas, only catalog imports need it
+    import pandas as pd
+
+    if fmt == 'jsonl':
+        chunks = pd.read_json(source, lines=True, chunksize=chunksize, dtype=False)
+    else:
+        chunks = pd.read_csv(source, chunksize=chunksize, dtype=str, keep_default_na=False)
+
+    row = 0
+    with chunks:
+        for chunk in chunks:
+            for record in chunk.to_dict('records'):
+                row += 1
+                try:
+                    yield row, CrawlerRequest(**clean_record(record)), None
+                except ValidationError as e:
+                    yield row, None, "Invalid row: " + "; ".join(
+                        f"{'.'.join(map(str, error['loc']))}: {error['msg']}" for error in e.errors())
+
+
+def clean_record(record: dict) -> dict:
+    # Catalogs often hold numeric SKUs and blank cells, CrawlerRequest wants strings or None
+    cleaned = {}
+    for key, value in record.items():
+        if value is None or (isinstance(value, float) and value != value) or value == '':
+            cleaned[key] = None
+        elif isinstance(value, float) and value.is_integer():
+            cleaned[key] = str(int(value))
+        else:
+            cleaned[key] = str(value)
+    cleaned.setdefault('sku', None)
+    return cleaned
+
+
+def crawl_catalog(rows, crawl, executor: ThreadPoolExecutor, window: int = 16):
+    """Crawl validated catalog rows, yielding one output record per row as crawls finish.
+
+    At most ``window`` crawls are in flight at a time; the next row is only read once one of them
+    completes, so memory stays bounded however long the catalog is. Output follows completion
+    order, each record carries its ``row`` number.
+    """
+    pending = {}
+    for row, item, error in rows:
+        if item is None:
+            yield {'row': row, 'sku': None, 'url': None, 'error': error}
+            continue
+        pending[executor.submit(crawl, item)] = (row, item)
+        while len(pending) >= window:
+            yield from drain(pending)
+    while pending:
+        yield from drain(pending)
+
+
+def drain(pending: dict):
+    """Wait for at least one in-flight crawl and yield the records of those that finished."""
+    done, _ = wait(list(pending), return_when=FIRST_COMPLETED)
+    for future in done:
+        row, item = pending.pop(future)
+        record = {'row': row, 'sku': item.sku, 'url': item.url}
+        try:
+            result = future.result()
+        except Exception as e:
+            traceback.print_exc()
+            result = {'error': str(e)}
+        if 'error' in result:
+            record['error'] = result['error']
+        else:
+            record['result'] = result
+        yield record
+
+
+def to_ndjson(record: dict) -> str:
+    return dumps(record) + '\n'
+
+
+def to_csv(record: dict, header: bool = False) -> str:
+    """Format an output record as a CSV line, preceded by the header line when asked."""
+    result = record.get('result') or {}
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    if header:
+        writer.writerow(CSV_COLUMNS)
+    writer.writerow([record['row'], record.get('sku'), record.get('url'), result.get('price'),
+                     result.get('price_cents'), result.get('currency'), result.get('status'), result.get('category'),
+                     record.get('error')])
+    return buffer.getvalue()
+
+
+def format_records(records, output: str = 'ndjson'):
+    """Turn output records into NDJSON or CSV text, one line at a time."""
+    for index, record in enumerate(records):
+        yield to_csv(record, header=index == 0) if output == 'csv' else to_ndjson(record)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Crawl every SKU of a CSV or JSONL catalog.")
+    parser.add_argument('catalog', help="CSV or JSONL file with url and sku columns, '-' for stdin")
+    parser.add_argument('--input-format', choices=['csv', 'jsonl'], help="Defaults to the file extension")
+    parser.add_argument('--output', default='-', help="Where to write results, '-' for stdout")
+    parser.add_argument('--output-format', choices=['ndjson', 'csv'], help="Defaults to the output extension")
+    parser.add_argument('--chunksize', type=int, default=1000)
+    args = parser.parse_args(argv)
+
+    # Importing main sets up the same registry, throttles and history as the API. Only the crawl
+    # services start: no recrawls of tracked products and no browser warmup for a one-off import
+    import main as app
+
+    source = sys.stdin if args.catalog == '-' else args.catalog
+    input_format = args.input_format or catalog_format(args.catalog)
+    output_format = args.output_format or ('csv' if args.output.endswith('.csv') else 'ndjson')
+
+    app.start_crawler_services()
+    out = sys.stdout if args.output == '-' else open(args.output, 'w', newline='', encoding='utf-8')
+    try:
+        rows = read_catalog(source, input_format, args.chunksize)
+        records = crawl_catalog(rows, app.crawl_item, app.crawl_executor, app.CRAWL_WORKERS)
+        for line in format_records(records, output_format):
+            out.write(line)
+            out.flush()
+    finally:
+        if out is not sys.stdout:
+            out.close()
+        app.stop_crawler_services()
+
+
+if __name__ == '__main__':
+    main()
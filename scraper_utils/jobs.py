@@ -0,0 +1,139 @@
+import os
+import threading
+import time
+import traceback
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
+from scraper_utils.deadline import CrawlCancelled, CrawlInterrupted, Deadline, enforce, interrupted_result
+from scraper_utils.metrics import Timings, activate
+
+
+class Job:
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    FINISHED = 'finished'
+    FAILED = 'failed'
+    TIMED_OUT = 'timed_out'
+    CANCELLED = 'cancelled'
+
+    def __init__(self, sku: Optional[str], url: str, options: dict = None, timeout: float = 300):
+        self.id = uuid.uuid4().hex
+        self.sku = sku
+        self.url = url
+        self.options = options or {}
+        self.status = Job.QUEUED
+        self.result = None
+        self.error = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.future = None
+        self.timings = Timings()
+        # Armed when the job starts running, queue time does not count
+        self.deadline = Deadline(timeout)
+
+    @property
+    def done(self):
+        return self.status in (Job.FINISHED, Job.FAILED, Job.TIMED_OUT, Job.CANCELLED)
+
+    def to_dict(self):
+        return {
+            'job_id': self.id,
+            'sku': self.sku,
+            'url': self.url,
+            'status': self.status,
+            'error': self.error,
+            'created_at': self.created_at,
+            'started_at': self.started_at,
+            'finished_at': self.finished_at,
+            'timings': self.timings.to_dict(),
+        }
+
+
+class JobManager:
+    """Runs crawl jobs on a worker thread pool and keeps their status and results for lookup.
+
+    ``runner`` is a blocking callable taking a URL, plus any options given to ``submit``, and returning
+    the result dict; it runs off the event loop so the API keeps answering while browsers work. It
+    runs under the job's deadline (see scraper_utils.deadline), which ``cancel`` expires early.
+    """
+
+    def __init__(self, runner, max_workers: int = None, max_jobs: int = 10000, timeout: float = 300):
+        self.runner = runner
+        self.max_jobs = max_jobs
+        self.timeout = timeout
+        self.executor = ThreadPoolExecutor(max_workers=max_workers or int(os.getenv('JOB_WORKERS', '4')),
+                                           thread_name_prefix='crawl-job')
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+
+    def submit(self, sku: Optional[str], url: str, **options) -> Job:
+        """Queue a crawl and return its job right away."""
+        job = Job(sku, url, options, timeout=self.timeout)
+        with self._lock:
+            self._jobs[job.id] = job
+            self._evict()
+        job.future = self.executor.submit(self._run, job)
+        return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def cancel(self, job_id: str) -> Optional[Job]:
+        """Cancel a queued or running job. Returns the job, or None if there is no such job."""
+        job = self.get(job_id)
+        if job is None or job.done:
+            return job
+        # A running crawl is stopped by the deadline's hooks and _run then marks the job
+        job.deadline.cancel()
+        if job.status == Job.QUEUED:
+            # Its future still resolves, to the cancelled result, when a worker thread picks it up
+            job.status = Job.CANCELLED
+            job.error = str(job.deadline.error())
+            job.result = interrupted_result(job.deadline)
+            job.finished_at = time.time()
+        return job
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+    def _run(self, job: Job):
+        if job.status == Job.CANCELLED:
+            return job.result
+        job.status = Job.RUNNING
+        job.started_at = time.time()
+        job.timings.add('queue_wait', job.started_at - job.created_at)
+        try:
+            # Spans recorded anywhere in the crawl on this thread land in the job's timings
+            with activate(job.timings), enforce(deadline=job.deadline):
+                job.deadline.check()
+                job.result = self.runner(job.url, **job.options)
+            job.deadline.check()
+            job.status = Job.FINISHED
+            return job.result
+        except CrawlInterrupted as e:
+            # Resolves the future with the typed timeout result rather than an exception
+            job.status = Job.CANCELLED if isinstance(e, CrawlCancelled) else Job.TIMED_OUT
+            job.error = str(e)
+            job.result = interrupted_result(job.deadline)
+            return job.result
+        except Exception as e:
+            traceback.print_exc()
+            job.error = str(e)
+            job.status = Job.FAILED
+            raise
+        finally:
+            job.finished_at = time.time()
+
+    def _evict(self):
+        # Drop the oldest finished jobs once we hold more than max_jobs
+        if len(self._jobs) <= self.max_jobs:
+            return
+        for job_id in [job_id for job_id, job in self._jobs.items() if job.done]:
+            del self._jobs[job_id]
+            if len(self._jobs) <= self.max_jobs:
+                return
@@ -0,0 +1,156 @@
+import contextvars
+import functools
+import time
+from contextlib import contextmanager
+
+from prometheus_client import Counter, Histogram
+
+# Crawl phases run from milliseconds (a DOM snapshot) to minutes (a slow page load)
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 300)
+
+CRAWL_SECONDS = Histogram('crawler_crawl_seconds', 'End to end crawl time',
+                          ['retailer', 'engine', 'outcome'], buckets=BUCKETS)
+PHASE_SECONDS = Histogram('crawler_phase_seconds', 'Time spent in each crawl phase and extractor',
+                          ['retailer', 'phase'], buckets=BUCKETS)
+CRAWLS = Counter('crawler_crawls_total', 'Finished crawls', ['retailer', 'engine', 'outcome'])
+REQUEST_SECONDS = Histogram('crawler_request_seconds', 'Time to answer /run_crawler/ by where the answer came from',
+                            ['retailer', 'source'], buckets=BUCKETS)
+BROWSERS_RECYCLED = Counter('crawler_browsers_recycled_total', 'Pooled browser sessions replaced by the watchdog',
+                            ['reason'])
+BROWSER_REQUESTS = Counter('crawler_browser_requests_total', 'Requests Chrome sent, blocked or saw fail in crawls',
+                           ['retailer', 'kind'])
+BROWSER_BYTES = Counter('crawler_browser_transferred_bytes_total', 'Bytes Chrome downloaded in crawls', ['retailer'])
+
+# Keys of collect_network_stats() and the BROWSER_REQUESTS kind each request counter is exported as
+NETWORK_REQUEST_KINDS = {'requests': 'sent', 'blocked_requests': 'blocked', 'failed_requests': 'failed'}
+
+_current = contextvars.ContextVar('crawl_timings', default=None)
+
+
+class Timings:
+    """The phases of one crawl, in the order they finished, plus what its browser downloaded and skipped."""
+
+    def __init__(self):
+        self.phases = []
+        self.network = {}
+        self.outcome = 'ok'
+        self.total = None
+
+    def add(self, phase: str, seconds: float):
+        self.phases.append((phase, seconds))
+
+    def extend(self, phases):
+        self.phases.extend((phase, seconds) for phase, seconds in phases)
+
+    def add_network(self, stats: dict):
+        """Sum the request and byte counters of ``collect_network_stats``, a crawl may load several pages."""
+        for key, value in stats.items():
+            self.network[key] = self.network.get(key, 0) + value
+
+    @contextmanager
+    def span(self, phase: str):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(phase, time.perf_counter() - started)
+
+    def to_dict(self):
+        """Milliseconds per phase, summed when a phase ran more than once, and the browser's network counters."""
+        totals = {}
+        for phase, seconds in self.phases:
+            totals[phase] = totals.get(phase, 0) + seconds
+        timings = {phase: round(seconds * 1000, 1) for phase, seconds in totals.items()}
+        if self.total is not None:
+            timings['total'] = round(self.total * 1000, 1)
+        if self.network:
+            timings['network'] = dict(self.network)
+        return timings
+
+
+def current_timings():
+    return _current.get()
+
+
+@contextmanager
+def activate(timings: Timings):
+    """Make ``timings`` collect every span recorded on this thread until the block exits."""
+    token = _current.set(timings)
+    try:
+        yield timings
+    finally:
+        _current.reset(token)
+
+
+@contextmanager
+def span(phase: str):
+    """Time a phase into the crawl running on this thread, if any."""
+    timings = _current.get()
+    if timings is None:
+        yield
+        return
+    with timings.span(phase):
+        yield
+
+
+def record_network(stats: dict):
+    """Add a browser's network counters to the crawl running on this thread, if any."""
+    timings = _current.get()
+    if timings is not None:
+        timings.add_network(stats)
+
+
+def timed(method):
+    """Decorator recording every call of a spider method as a phase named after it."""
+    @functools.wraps(method)
+    def wrapper(*args, **kwargs):
+        with span(method.__name__):
+            return method(*args, **kwargs)
+
+    return wrapper
+
+
+def outcome_of(result) -> str:
+    if not isinstance(result, dict):
+        return 'error'
+    if result.get('error_type') in ('timeout', 'cancelled'):
+        return result['error_type']
+    if 'error' in result:
+        return 'error'
+    if result.get('status') == 'Link broken':
+        return 'link_broken'
+    if result.get('status') is None:
+        return 'empty'
+    return 'ok'
+
+
+@contextmanager
+def measure_crawl(retailer: str, engine: str):
+    """Time a whole crawl and export it and its phases. Joins the thread's Timings when one is active.
+
+    The caller sets ``timings.outcome`` (see ``outcome_of``); an exception counts as 'error'.
+    """
+    timings = _current.get()
+    token = None
+    if timings is None:
+        timings = Timings()
+        token = _current.set(timings)
+    started = time.perf_counter()
+    try:
+        yield timings
+    except BaseException:
+        timings.outcome = 'error'
+        raise
+    finally:
+        timings.total = time.perf_counter() - started
+        CRAWL_SECONDS.labels(retailer, engine, timings.outcome).observe(timings.total)
+        CRAWLS.labels(retailer, engine, timings.outcome).inc()
+        for phase, seconds in timings.phases:
+            PHASE_SECONDS.labels(retailer, phase).observe(seconds)
+        for key, kind in NETWORK_REQUEST_KINDS.items():
+            if timings.network.get(key):
+                BROWSER_REQUESTS.labels(retailer, kind).inc(timings.network[key])
+        if timings.network.get('transferred_bytes'):
+            BROWSER_BYTES.labels(retailer).inc(timings.network['transferred_bytes'])
+        if token is not None:
+            _current.reset(token)
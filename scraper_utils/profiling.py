@@ -0,0 +1,158 @@
+import base64
+import cProfile
+import io
+import os
+import pstats
+import re
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+# cProfile and tracemalloc are process wide on recent Pythons, so one capture runs at a time
+_capture_lock = threading.Lock()
+
+PROFILE_ID = re.compile(r'^[A-Za-z0-9_-]+$')
+
+
+def profile_dir():
+    return os.getenv('PROFILE_DIR', 'profiles')
+
+
+def artifact_paths(profile_id: str):
+    """Paths of the (summary, pstats) files of a capture, or None for an invalid id."""
+    if not PROFILE_ID.match(profile_id or ''):
+        return None
+    base = os.path.join(profile_dir(), profile_id)
+    return base + '.txt', base + '.prof'
+
+
+class Capture:
+    """cProfile plus tracemalloc around one crawl, saved as ``<PROFILE_DIR>/<id>.txt`` and ``.prof``.
+
+    The .txt summary holds the slowest functions by cumulative time and the top allocation sites;
+    the .prof file loads into pstats or snakeviz. ``start()`` returns False, and ``stop()`` saves a
+    summary saying so, when another capture is already running in this process.
+    """
+
+    top_functions = 40
+    top_allocations = 25
+
+    def __init__(self, profile_id: str, label: str):
+        self.profile_id = profile_id
+        self.label = label
+        self.profiler = None
+        self.started = None
+        self.busy = False
+        self._owns_tracemalloc = False
+
+    def start(self) -> bool:
+        if not _capture_lock.acquire(blocking=False):
+            self.busy = True
+            return False
+        self._owns_tracemalloc = not tracemalloc.is_tracing()
+        if self._owns_tracemalloc:
+            tracemalloc.start()
+        tracemalloc.reset_peak()
+        self.started = time.perf_counter()
+        self.profiler = cProfile.Profile()
+        self.profiler.enable()
+        return True
+
+    def stop(self):
+        """Stop profiling and write the artifacts. Returns the summary path."""
+        summary_path, stats_path = artifact_paths(self.profile_id)
+        os.makedirs(profile_dir(), exist_ok=True)
+        if self.busy:
+            with open(summary_path, 'w', encoding='utf-8') as f:
+                f.write(f"{self.label}\nNot profiled: another capture was running in this process.\n")
+            return summary_path
+
+        try:
+            self.profiler.disable()
+            elapsed = time.perf_counter() - self.started
+            snapshot = tracemalloc.take_snapshot()
+            _, peak = tracemalloc.get_traced_memory()
+            if self._owns_tracemalloc:
+                tracemalloc.stop()
+        finally:
+            _capture_lock.release()
+
+        self.profiler.dump_stats(stats_path)
+        out = io.StringIO()
+        out.write(f"{self.label}\nWall time: {elapsed:.3f}s, peak traced memory: {peak / 1024:.1f} KiB\n\n")
+        pstats.Stats(self.profiler, stream=out).sort_stats('cumulative').print_stats(self.top_functions)
+        out.write("Top allocations by line\n")
+        for statistic in snapshot.statistics('lineno')[:self.top_allocations]:
+            out.write(f"{statistic}\n")
+        with open(summary_path, 'w', encoding='utf-8') as f:
+            f.write(out.getvalue())
+        prune()
+        return summary_path
+
+
+@contextmanager
+def profiled(profile_id: str, label: str):
+    """Profile the block when ``profile_id`` is set, otherwise do nothing at all."""
+    if not profile_id:
+        yield
+        return
+    capture = Capture(profile_id, label)
+    capture.start()
+    try:
+        yield
+    finally:
+        capture.stop()
+
+
+def export_capture(profile_id: str):
+    """Move a capture out of this process's PROFILE_DIR into a dict that fits a JSON job reply.
+
+    Worker processes send their captures back with the reply, and the API saves them with
+    ``import_capture`` so its /profiles links work. None when there is no capture under the id.
+    """
+    paths = artifact_paths(profile_id)
+    if paths is None or not os.path.exists(paths[0]):
+        return None
+    with open(paths[0], encoding='utf-8') as f:
+        capture = {'summary': f.read(), 'pstats': None}
+    if os.path.exists(paths[1]):
+        with open(paths[1], 'rb') as f:
+            capture['pstats'] = base64.b64encode(f.read()).decode('ascii')
+    for path in paths:
+        if os.path.exists(path):
+            os.remove(path)
+    return capture
+
+
+def import_capture(profile_id: str, capture: dict):
+    """Save a capture made by a worker process, as if it had been taken here."""
+    summary_path, stats_path = artifact_paths(profile_id)
+    os.makedirs(profile_dir(), exist_ok=True)
+    if capture.get('pstats'):
+        with open(stats_path, 'wb') as f:
+            f.write(base64.b64decode(capture['pstats']))
+    with open(summary_path, 'w', encoding='utf-8') as f:
+        f.write(capture['summary'])
+    prune()
+
+
+def prune(keep: int = None):
+    """Delete the oldest captures beyond PROFILE_KEEP (default 50)."""
+    keep = keep or int(os.getenv('PROFILE_KEEP', '50'))
+    directory = profile_dir()
+    summaries = sorted((entry for entry in os.scandir(directory) if entry.name.endswith('.txt')),
+                       key=lambda entry: entry.stat().st_mtime, reverse=True)
+    for entry in summaries[keep:]:
+        for path in artifact_paths(entry.name[:-4]) or ():
+            if os.path.exists(path):
+                os.remove(path)
+
+
+def list_profiles():
+    directory = profile_dir()
+    if not os.path.isdir(directory):
+        return []
+    entries = sorted((entry for entry in os.scandir(directory) if entry.name.endswith('.txt')),
+                     key=lambda entry: entry.stat().st_mtime, reverse=True)
+    return [{'id': entry.name[:-4], 'created_at': entry.stat().st_mtime} for entry in entries]
@@ -0,0 +1,327 @@
+import time
+import uuid
+from typing import Optional
+
+from sqlalchemy import Float, Index, String, Text, create_engine, delete, insert, select, update
+from sqlalchemy.orm import DeclarativeBase, Mapped, Session, mapped_column
+
+from scraper_utils.serialization import dumps, loads
+
+ENGINES = ('scrapy', 'http', 'selenium')
+
+
+def new_job(url: str, retailer: str, engines, timeout: float, profile_id: str = None) -> dict:
+    """A crawl for the workers. ``engines`` are tried in order, a worker hands the job on to the next one
+    when its engine can't answer (the HTTP fast path on a page that needs the browser).
+    """
+    return {
+        'id': uuid.uuid4().hex,
+        'url': url,
+        'retailer': retailer,
+        'engines': list(engines),
+        # Absolute, so time spent queued counts against the crawl's deadline
+        'expires_at': time.time() + timeout,
+        'profile_id': profile_id,
+    }
+
+
+def job_queue_from_url(url: str):
+    """``redis://`` and ``rediss://`` URLs give a RedisJobQueue, any other SQLAlchemy URL a SqlJobQueue."""
+    if url.startswith(('redis://', 'rediss://', 'unix://')):
+        return RedisJobQueue(url)
+    return SqlJobQueue(url)
+
+
+class JobQueue:
+    """Carries crawl jobs from the API to the workers and their replies back.
+
+    Each engine has its own lane, so a worker only receives jobs it can run. A job taken by a worker
+    that dies is handed out again once its deadline has passed by ``lease_margin`` seconds.
+    """
+
+    lease_margin = 60
+    # Workers that have not checked in for this long are left out of ``workers()``
+    worker_ttl = 30
+
+    def put(self, job: dict):
+        """Queue a job in the lane of its first engine."""
+        raise NotImplementedError
+
+    def forward(self, job: dict):
+        """Queue a job again for its next engine."""
+        self.put(dict(job, engines=job['engines'][1:]))
+
+    def get(self, engines, timeout: float) -> Optional[dict]:
+        """Take the oldest job from any of the ``engines`` lanes, waiting up to ``timeout`` seconds."""
+        raise NotImplementedError
+
+    def reply(self, job_id: str, reply: dict):
+        raise NotImplementedError
+
+    def wait(self, job_id: str, timeout: float) -> Optional[dict]:
+        """Block until the job's reply arrives. Returns None on timeout or once the job is cancelled."""
+        raise NotImplementedError
+
+    def cancel(self, job_id: str):
+        raise NotImplementedError
+
+    def cancelled(self, job_ids) -> set:
+        """Which of these running jobs have been cancelled."""
+        raise NotImplementedError
+
+    def heartbeat(self, worker_id: str, info: dict):
+        raise NotImplementedError
+
+    def workers(self) -> list:
+        raise NotImplementedError
+
+
+class Base(DeclarativeBase):
+    pass
+
+
+class QueuedJob(Base):
+    __tablename__ = 'queued_jobs'
+
+    id: Mapped[str] = mapped_column(String(32), primary_key=True)
+    engine: Mapped[str] = mapped_column(String(16))
+    # queued, running, done or cancelled
+    state: Mapped[str] = mapped_column(String(16))
+    payload: Mapped[str] = mapped_column(Text)
+    reply: Mapped[Optional[str]] = mapped_column(Text)
+    lease_until: Mapped[Optional[float]] = mapped_column(Float)
+    created_at: Mapped[float] = mapped_column(Float)
+
+    __table_args__ = (
+        Index('ix_queued_jobs_lane', 'engine', 'state', 'created_at'),
+    )
+
+
+class WorkerBeat(Base):
+    __tablename__ = 'worker_beats'
+
+    id: Mapped[str] = mapped_column(String(255), primary_key=True)
+    info: Mapped[str] = mapped_column(Text)
+    seen_at: Mapped[float] = mapped_column(Float)
+
+
+class SqlJobQueue(JobQueue):
+    """Job queue in a database table, polled by workers and by the API waiting for replies.
+
+    Meant for development and tests (``sqlite:///queue.db`` is shared by every process on the host),
+    though any SQLAlchemy URL works.
+    """
+
+    def __init__(self, database_url: str, poll_interval: float = 0.1, keep_seconds: float = 3600):
+        self.engine = create_engine(database_url, pool_pre_ping=True)
+        self.poll_interval = poll_interval
+        self.keep_seconds = keep_seconds
+        Base.metadata.create_all(self.engine)
+
+    def put(self, job: dict):
+        now = time.time()
+        with Session(self.engine) as session:
+            # Finished rows nobody picked up are dropped eventually
+            session.execute(delete(QueuedJob).where(QueuedJob.state.in_(('done', 'cancelled')),
+                                                    QueuedJob.created_at < now - self.keep_seconds))
+            session.execute(insert(QueuedJob).values(id=job['id'], engine=job['engines'][0], state='queued',
+                                                     payload=dumps(job), created_at=now))
+            session.commit()
+
+    def forward(self, job: dict):
+        """Move the job's row to its next engine's lane, unless the job was cancelled meanwhile."""
+        job = dict(job, engines=job['engines'][1:])
+        with Session(self.engine) as session:
+            session.execute(update(QueuedJob).where(QueuedJob.id == job['id'], QueuedJob.state != 'cancelled')
+                            .values(engine=job['engines'][0], state='queued', payload=dumps(job), lease_until=None))
+            session.commit()
+
+    def get(self, engines, timeout: float) -> Optional[dict]:
+        give_up = time.monotonic() + timeout
+        while True:
+            job = self._claim(list(engines))
+            if job is not None or time.monotonic() >= give_up:
+                return job
+            time.sleep(self.poll_interval)
+
+    def _claim(self, engines) -> Optional[dict]:
+        now = time.time()
+        with Session(self.engine) as session:
+            # Jobs whose worker died go back to their lane
+            session.execute(update(QueuedJob).where(QueuedJob.state == 'running', QueuedJob.lease_until < now)
+                            .values(state='queued'))
+            candidates = session.execute(
+                select(QueuedJob.id, QueuedJob.payload)
+                .where(QueuedJob.state == 'queued', QueuedJob.engine.in_(engines))
+                .order_by(QueuedJob.created_at).limit(5)).all()
+            for job_id, payload in candidates:
+                job = loads(payload)
+                # Another worker may take it between our select and update
+                taken = session.execute(update(QueuedJob).where(QueuedJob.id == job_id, QueuedJob.state == 'queued')
+                                        .values(state='running', lease_until=job['expires_at'] + self.lease_margin))
+                if taken.rowcount:
+                    session.commit()
+                    return job
+            session.commit()
+            return None
+
+    def reply(self, job_id: str, reply: dict):
+        with Session(self.engine) as session:
+            answered = session.execute(update(QueuedJob).where(QueuedJob.id == job_id, QueuedJob.state == 'running')
+                                       .values(state='done', reply=dumps(reply)))
+            if not answered.rowcount:
+                # Cancelled, nobody is waiting for it
+                session.execute(delete(QueuedJob).where(QueuedJob.id == job_id))
+            session.commit()
+
+    def wait(self, job_id: str, timeout: float) -> Optional[dict]:
+        give_up = time.monotonic() + timeout
+        while True:
+            with Session(self.engine) as session:
+                row = session.execute(select(QueuedJob.state, QueuedJob.reply).where(QueuedJob.id == job_id)).first()
+                if row is not None and row.state == 'done':
+                    session.execute(delete(QueuedJob).where(QueuedJob.id == job_id))
+                    session.commit()
+                    return loads(row.reply)
+            if row is None or row.state == 'cancelled' or time.monotonic() >= give_up:
+                return None
+            time.sleep(self.poll_interval)
+
+    def cancel(self, job_id: str):
+        with Session(self.engine) as session:
+            session.execute(update(QueuedJob).where(QueuedJob.id == job_id, QueuedJob.state.in_(('queued', 'running')))
+                            .values(state='cancelled'))
+            session.commit()
+
+    def cancelled(self, job_ids) -> set:
+        job_ids = list(job_ids)
+        if not job_ids:
+            return set()
+        with Session(self.engine) as session:
+            return set(session.execute(select(QueuedJob.id).where(QueuedJob.id.in_(job_ids),
+                                                                  QueuedJob.state == 'cancelled')).scalars())
+
+    def heartbeat(self, worker_id: str, info: dict):
+        with Session(self.engine) as session:
+            session.merge(WorkerBeat(id=worker_id, info=dumps(info), seen_at=time.time()))
+            session.commit()
+
+    def workers(self) -> list:
+        with Session(self.engine) as session:
+            beats = session.execute(select(WorkerBeat).where(WorkerBeat.seen_at >= time.time() - self.worker_ttl))
+            return [dict(loads(beat.info), id=beat.id, seen_at=beat.seen_at) for beat in beats.scalars()]
+
+
+# Pops the oldest job of the first non-empty lane and leases it in one step, so no worker can die
+# holding a job that is neither in a lane nor leased. Cancelled and vanished jobs are dropped.
+CLAIM_SCRIPT = """
+for i = 3, #KEYS do
+    while true do
+        local job_id = redis.call('RPOP', KEYS[i])
+        if not job_id then
+            break
+        end
+        local payload = redis.call('HGET', KEYS[1], job_id)
+        if payload and redis.call('EXISTS', ARGV[1] .. job_id) == 0 then
+            local job = cjson.decode(payload)
+            redis.call('ZADD', KEYS[2], job['expires_at'] + tonumber(ARGV[2]), job_id)
+            return payload
+        end
+        redis.call('HDEL', KEYS[1], job_id)
+    end
+end
+return false
+"""
+
+
+class RedisJobQueue(JobQueue):
+    """Job queue on Redis (or anything speaking its protocol), for workers spread over several nodes.
+
+    Lanes are lists of job ids, payloads live in a hash, taken jobs sit in a sorted set scored by
+    when their lease runs out and replies are single-item lists the API blocks on. Workers take jobs
+    with CLAIM_SCRIPT every ``poll_interval`` seconds while the lanes are empty.
+    """
+
+    def __init__(self, url: str, prefix: str = 'crawl', reply_ttl: int = 600, poll_interval: float = 0.1):
+        # Only needed in distributed mode
+        import redis
+
+        self.redis = redis.Redis.from_url(url)
+        self.prefix = prefix
+        self.reply_ttl = reply_ttl
+        self.poll_interval = poll_interval
+        self._claim = self.redis.register_script(CLAIM_SCRIPT)
+
+    def _key(self, *parts) -> str:
+        return ':'.join((self.prefix,) + parts)
+
+    def put(self, job: dict):
+        pipe = self.redis.pipeline()
+        pipe.hset(self._key('jobs'), job['id'], dumps(job))
+        pipe.zrem(self._key('running'), job['id'])
+        pipe.lpush(self._key('lane', job['engines'][0]), job['id'])
+        pipe.execute()
+
+    def get(self, engines, timeout: float) -> Optional[dict]:
+        self._requeue_expired()
+        give_up = time.monotonic() + timeout
+        keys = [self._key('jobs'), self._key('running')] + [self._key('lane', engine) for engine in engines]
+        while True:
+            payload = self._claim(keys=keys, args=[self._key('cancel', ''), self.lease_margin])
+            if payload is not None:
+                return loads(payload)
+            if time.monotonic() >= give_up:
+                return None
+            time.sleep(self.poll_interval)
+
+    def _requeue_expired(self):
+        for job_id in self.redis.zrangebyscore(self._key('running'), 0, time.time()):
+            # Whoever removes it from the set requeues it
+            if not self.redis.zrem(self._key('running'), job_id):
+                continue
+            payload = self.redis.hget(self._key('jobs'), job_id)
+            if payload is not None:
+                self.redis.rpush(self._key('lane', loads(payload)['engines'][0]), job_id)
+
+    def reply(self, job_id: str, reply: dict):
+        pipe = self.redis.pipeline()
+        pipe.zrem(self._key('running'), job_id)
+        pipe.hdel(self._key('jobs'), job_id)
+        pipe.lpush(self._key('reply', job_id), dumps(reply))
+        pipe.expire(self._key('reply', job_id), self.reply_ttl)
+        pipe.execute()
+
+    def wait(self, job_id: str, timeout: float) -> Optional[dict]:
+        popped = self.redis.brpop([self._key('reply', job_id)], timeout=max(timeout, 0.01))
+        if popped is None:
+            return None
+        reply = loads(popped[1])
+        # cancel() wakes the waiter with an empty reply
+        return reply or None
+
+    def cancel(self, job_id: str):
+        pipe = self.redis.pipeline()
+        pipe.set(self._key('cancel', job_id), 1, ex=self.reply_ttl)
+        pipe.lpush(self._key('reply', job_id), '{}')
+        pipe.expire(self._key('reply', job_id), self.reply_ttl)
+        pipe.execute()
+
+    def cancelled(self, job_ids) -> set:
+        job_ids = list(job_ids)
+        pipe = self.redis.pipeline()
+        for job_id in job_ids:
+            pipe.exists(self._key('cancel', job_id))
+        return {job_id for job_id, exists in zip(job_ids, pipe.execute()) if exists}
+
+    def heartbeat(self, worker_id: str, info: dict):
+        self.redis.hset(self._key('workers'), worker_id, dumps(dict(info, seen_at=time.time())))
+
+    def workers(self) -> list:
+        workers = []
+        for worker_id, info in self.redis.hgetall(self._key('workers')).items():
+            info = loads(info)
+            if info['seen_at'] < time.time() - self.worker_ttl:
+                self.redis.hdel(self._key('workers'), worker_id)
+                continue
+            workers.append(dict(info, id=worker_id.decode()))
+        return workers
@@ -0,0 +1,349 @@
+import heapq
+import itertools
+import logging
+import os
+import threading
+import time
+import traceback
+from typing import Optional
+
+from sqlalchemy import Float, Integer, String, delete, insert, select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import DeclarativeBase, Mapped, Session, mapped_column
+
+from scraper_utils.cache import canonical_url
+from scraper_utils.throttle import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+
+class Base(DeclarativeBase):
+    pass
+
+
+class TrackedRow(Base):
+    """A tracked product as stored, shared by every API process and kept across restarts."""
+
+    __tablename__ = 'tracked_products'
+
+    # canonical_url() of the product, the same key the cache and single flight use
+    key: Mapped[str] = mapped_column(String(2048), primary_key=True)
+    sku: Mapped[Optional[str]] = mapped_column(String(64))
+    url: Mapped[str] = mapped_column(String(2048))
+    retailer: Mapped[str] = mapped_column(String(64))
+    checks: Mapped[int] = mapped_column(Integer, default=0)
+    changes: Mapped[int] = mapped_column(Integer, default=0)
+    last_checked: Mapped[Optional[float]] = mapped_column(Float)
+    last_price: Mapped[Optional[str]] = mapped_column(String(32))
+    last_status: Mapped[Optional[str]] = mapped_column(String(64))
+    due: Mapped[float] = mapped_column(Float)
+
+
+class TrackedProduct:
+    """A product the scheduler keeps fresh, with how often its price or stock turned out to change."""
+
+    def __init__(self, sku: Optional[str], url: str, retailer: str):
+        self.key = canonical_url(url)
+        self.sku = sku
+        self.url = url
+        self.retailer = retailer
+        self.checks = 0
+        self.changes = 0
+        self.last_checked = None
+        self.last_value = None
+        # ``due`` as stored in the table, the claim compares against it
+        self.due = time.time()
+        # Held back in memory until then, e.g. while the retailer's recrawl budget is empty
+        self.not_before = 0
+        self.in_flight = False
+
+    @classmethod
+    def from_row(cls, row: TrackedRow) -> 'TrackedProduct':
+        product = cls(row.sku, row.url, row.retailer)
+        product.load(row)
+        return product
+
+    def load(self, row: TrackedRow):
+        self.sku = row.sku
+        self.checks = row.checks
+        self.changes = row.changes
+        self.last_checked = row.last_checked
+        self.last_value = (row.last_price, row.last_status) if row.checks else None
+        self.due = row.due
+
+    def row_values(self):
+        last_price, last_status = self.last_value or (None, None)
+        return {'sku': self.sku, 'url': self.url, 'retailer': self.retailer, 'checks': self.checks,
+                'changes': self.changes, 'last_checked': self.last_checked, 'last_price': last_price,
+                'last_status': last_status, 'due': self.due}
+
+    @property
+    def volatility(self):
+        # Share of checks that saw a change, smoothed so new products start in the middle
+        return (self.changes + 1) / (self.checks + 2)
+
+    def observe(self, result: dict):
+        value = (result.get('price'), result.get('status'))
+        if self.last_value is not None and value != self.last_value:
+            self.changes += 1
+        self.checks += 1
+        self.last_value = value
+
+    def to_dict(self):
+        return {
+            'sku': self.sku,
+            'url': self.url,
+            'retailer': self.retailer,
+            'checks': self.checks,
+            'changes': self.changes,
+            'volatility': round(self.volatility, 3),
+            'last_checked': self.last_checked,
+            'due': self.due,
+        }
+
+
+class RecrawlScheduler:
+    """Re-crawls tracked products, the volatile ones often and the stable ones rarely.
+
+    A product is due again ``min_interval / volatility`` seconds after its last check (capped at
+    ``max_interval``), so its priority is the time since the last check weighted by how often it
+    changes. Due products come off a heap in due order and are dispatched while their retailer's
+    hourly ``recrawl_budget`` has tokens left; products over budget wait for the next token.
+
+    Tracked products live in the ``tracked_products`` table of ``engine`` (the history database),
+    so they survive restarts and every API process sees them; each process reloads the table every
+    ``sync_interval`` seconds. A process claims a due product by moving its ``due`` forward in the
+    table, so only one of them crawls it. At most ``max_in_flight`` recrawls run at once, by default
+    half of JOB_WORKERS, which leaves the other job threads to interactive crawls.
+
+    ``dispatch(sku, url, spec)`` starts a crawl and returns a Future of its result dict.
+    """
+
+    def __init__(self, resolve, dispatch, engine, min_interval: float = None, max_interval: float = None,
+                 max_in_flight: int = None, sync_interval: float = 60):
+        self.resolve = resolve
+        self.dispatch = dispatch
+        self.engine = engine
+        self.min_interval = min_interval or float(os.getenv('RECRAWL_MIN_INTERVAL', '900'))
+        self.max_interval = max_interval or float(os.getenv('RECRAWL_MAX_INTERVAL', '86400'))
+        job_workers = int(os.getenv('JOB_WORKERS', '4'))
+        self.max_in_flight = max_in_flight or int(os.getenv('RECRAWL_MAX_IN_FLIGHT', max(1, job_workers // 2)))
+        self.sync_interval = sync_interval
+        self._products = {}
+        self._budgets = {}
+        self._heap = []
+        self._sequence = itertools.count()
+        self._in_flight = 0
+        self._dispatched = 0
+        self._condition = threading.Condition()
+        self._threads = []
+        self._stopping = threading.Event()
+
+    def track(self, sku: Optional[str], url: str) -> TrackedProduct:
+        """Start tracking a product, it is crawled as soon as the budget allows."""
+        spec = self.resolve(url)
+        if spec is None:
+            raise ValueError(f"No spider handles {url}")
+        product = TrackedProduct(sku, url, spec.name)
+        with Session(self.engine) as session:
+            try:
+                session.execute(insert(TrackedRow).values(key=product.key, **product.row_values()))
+                session.commit()
+            except IntegrityError:
+                session.rollback()
+                if sku is not None:
+                    session.execute(update(TrackedRow).where(TrackedRow.key == product.key).values(sku=sku))
+                    session.commit()
+            row = session.get(TrackedRow, product.key)
+        return self._merge(row)
+
+    def untrack(self, url: str) -> bool:
+        key = canonical_url(url)
+        with Session(self.engine) as session:
+            removed = session.execute(delete(TrackedRow).where(TrackedRow.key == key)).rowcount
+            session.commit()
+        # Heap entries of untracked products are skipped when they come up
+        with self._condition:
+            return self._products.pop(key, None) is not None or bool(removed)
+
+    def get(self, url: str) -> Optional[TrackedProduct]:
+        key = canonical_url(url)
+        with self._condition:
+            product = self._products.get(key)
+        if product is not None:
+            return product
+        # Tracked by another process since our last sync
+        with Session(self.engine) as session:
+            row = session.get(TrackedRow, key)
+        return self._merge(row) if row is not None else None
+
+    def start(self):
+        Base.metadata.create_all(self.engine)
+        self._stopping.clear()
+        self.sync()
+        self._threads = [threading.Thread(target=self._run, name='recrawl-scheduler', daemon=True),
+                         threading.Thread(target=self._sync_loop, name='recrawl-sync', daemon=True)]
+        for thread in self._threads:
+            thread.start()
+
+    def stop(self):
+        self._stopping.set()
+        with self._condition:
+            self._condition.notify_all()
+        for thread in self._threads:
+            thread.join(timeout=10)
+        self._threads = []
+
+    def sync(self):
+        """Load the tracked products from the table: new ones, ones untracked elsewhere, others' checks."""
+        with Session(self.engine) as session:
+            rows = {row.key: row for row in session.scalars(select(TrackedRow))}
+        with self._condition:
+            for key in set(self._products) - set(rows):
+                self._products.pop(key)
+        for row in rows.values():
+            self._merge(row)
+
+    def interval(self, product: TrackedProduct) -> float:
+        return min(self.max_interval, self.min_interval / product.volatility)
+
+    def stats(self):
+        with self._condition:
+            now = time.time()
+            return {
+                'tracked': len(self._products),
+                'due': sum(1 for product in self._products.values() if product.due <= now),
+                'in_flight': self._in_flight,
+                'dispatched': self._dispatched,
+            }
+
+    def _merge(self, row: TrackedRow) -> TrackedProduct:
+        """Bring the in-memory product of a row up to date, queueing it when its due time moved."""
+        with self._condition:
+            product = self._products.get(row.key)
+            if product is None:
+                product = TrackedProduct.from_row(row)
+                self._products[row.key] = product
+                self._push(product)
+            elif not product.in_flight and product.due != row.due:
+                product.load(row)
+                self._push(product)
+            return product
+
+    def _push(self, product: TrackedProduct):
+        when = max(product.due, product.not_before)
+        heapq.heappush(self._heap, (when, next(self._sequence), product, product.due))
+        self._condition.notify()
+
+    def _budget(self, spec) -> TokenBucket:
+        bucket = self._budgets.get(spec.name)
+        if bucket is None:
+            bucket = TokenBucket(spec.recrawl_budget / 3600, burst=max(1, spec.concurrency))
+            self._budgets[spec.name] = bucket
+        return bucket
+
+    def _next_due(self):
+        """Wait for the next due product with budget left, or return None when stopping."""
+        with self._condition:
+            while not self._stopping.is_set():
+                if self._in_flight >= self.max_in_flight or not self._heap:
+                    self._condition.wait()
+                    continue
+                when, _, product, due = self._heap[0]
+                wait = when - time.time()
+                if wait > 0:
+                    self._condition.wait(wait)
+                    continue
+                heapq.heappop(self._heap)
+                if self._products.get(product.key) is not product or product.due != due or product.in_flight:
+                    continue
+
+                spec = self.resolve(product.url)
+                wait = self._budget(spec).try_acquire()
+                if wait:
+                    # Out of budget for this retailer, keep the product first in line for the next token
+                    product.not_before = time.time() + wait
+                    self._push(product)
+                    continue
+                self._in_flight += 1
+                product.in_flight = True
+                return product, spec, due
+        return None
+
+    def _claim(self, product: TrackedProduct, due: float) -> bool:
+        """Take the product for this process. A crash mid crawl leaves it due again after min_interval."""
+        with Session(self.engine) as session:
+            taken = session.execute(update(TrackedRow).where(TrackedRow.key == product.key, TrackedRow.due == due)
+                                    .values(due=time.time() + self.min_interval))
+            session.commit()
+            return bool(taken.rowcount)
+
+    def _run(self):
+        while True:
+            entry = self._next_due()
+            if entry is None:
+                return
+            product, spec, due = entry
+            try:
+                if not self._claim(product, due):
+                    # Another process took it or it was untracked: the token goes back, the row tells which
+                    self._budget(spec).refund()
+                    self._release(product)
+                    continue
+                future = self.dispatch(product.sku, product.url, spec)
+            except Exception:
+                traceback.print_exc()
+                self._finish(product, None)
+                continue
+            self._dispatched += 1
+            future.add_done_callback(lambda f, product=product: self._finish(product, f))
+
+    def _sync_loop(self):
+        while not self._stopping.wait(self.sync_interval):
+            try:
+                self.sync()
+            except Exception:
+                logger.exception("Could not load the tracked products")
+
+    def _release(self, product: TrackedProduct):
+        """Hand back a product whose claim failed, queued again at the due time the table now has."""
+        try:
+            with Session(self.engine) as session:
+                row = session.get(TrackedRow, product.key)
+        except Exception:
+            # The next sync finds the row's due time differs from ours and queues the product
+            logger.exception("Could not reload %s", product.url)
+            row = None
+        with self._condition:
+            self._in_flight -= 1
+            product.in_flight = False
+            if row is not None and self._products.get(product.key) is product:
+                product.load(row)
+                self._push(product)
+            self._condition.notify()
+
+    def _finish(self, product: TrackedProduct, future):
+        result = None
+        if future is not None and not future.cancelled() and future.exception() is None:
+            result = future.result()
+        with self._condition:
+            product.last_checked = time.time()
+            if isinstance(result, dict) and 'error' not in result:
+                product.observe(result)
+                product.due = product.last_checked + self.interval(product)
+            else:
+                # Failed crawls say nothing about volatility, retry after the shortest interval
+                product.due = product.last_checked + self.min_interval
+            values = product.row_values()
+        try:
+            with Session(self.engine) as session:
+                session.execute(update(TrackedRow).where(TrackedRow.key == product.key).values(**values))
+                session.commit()
+        except Exception:
+            logger.exception("Could not save the recrawl of %s", product.url)
+        with self._condition:
+            self._in_flight -= 1
+            product.in_flight = False
+            if self._products.get(product.key) is product:
+                self._push(product)
+            self._condition.notify()
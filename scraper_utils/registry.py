@@ -0,0 +1,113 @@
+import importlib
+import threading
+from typing import Optional
+from urllib.parse import urlsplit
+
+
+class SpiderSpec:
+    """Declares which hostnames a spider handles, the engine that runs it and how hard to drive it.
+
+    ``spider`` is the dotted import path of the spider class. The module is only imported the first
+    time ``load()`` is called, so the API can start without importing Scrapy or Selenium.
+    ``fast_path`` optionally names a BaseHttpSpider that is tried before the Selenium spider.
+    ``concurrency`` and ``rate_limit`` (crawls per second) are starting points, the throttle adapts
+    them to the retailer's latency and may raise concurrency up to ``max_concurrency``.
+    ``recrawl_budget`` caps how many crawls per hour the recrawl scheduler may spend on the retailer.
+    ``tracking_params`` are query parameters this retailer only uses for tracking, dropped from the
+    cache key along with the analytics parameters of every site (see scraper_utils.cache).
+    """
+
+    def __init__(self, name: str, hostnames, engine: str, spider: str, concurrency: int = 1,
+                 cache_ttl: float = 600, fast_path: str = None, rate_limit: float = 1.0,
+                 max_concurrency: int = None, recrawl_budget: float = 600, tracking_params=()):
+        self.name = name
+        self.hostnames = [hostname.lower() for hostname in hostnames]
+        self.engine = engine
+        self.spider = spider
+        self.concurrency = concurrency
+        self.max_concurrency = max_concurrency or concurrency * 2
+        self.rate_limit = rate_limit
+        self.cache_ttl = cache_ttl
+        self.recrawl_budget = recrawl_budget
+        self.tracking_params = frozenset(tracking_params)
+        self.fast_path = fast_path
+        self._classes = {}
+        self._lock = threading.Lock()
+
+    @property
+    def engines(self):
+        """The engines that can crawl this retailer, in the order to try them."""
+        return (['http'] if self.fast_path else []) + [self.engine]
+
+    def load(self):
+        """Import and return the spider class."""
+        return self._import(self.spider)
+
+    def load_fast_path(self):
+        """Import and return the HTTP fast path spider class, or None if the retailer has none."""
+        return self._import(self.fast_path) if self.fast_path else None
+
+    def _import(self, path: str):
+        if path not in self._classes:
+            with self._lock:
+                if path not in self._classes:
+                    module_path, _, class_name = path.rpartition('.')
+                    self._classes[path] = getattr(importlib.import_module(module_path), class_name)
+        return self._classes[path]
+
+    def __repr__(self):
+        return f"SpiderSpec({self.name!r}, engine={self.engine!r})"
+
+
+class SpiderRegistry:
+    """Maps hostnames to spider specs."""
+
+    def __init__(self):
+        self._by_hostname = {}
+        self._by_name = {}
+
+    def register(self, spec: SpiderSpec):
+        for hostname in spec.hostnames:
+            if hostname in self._by_hostname:
+                raise ValueError(f"Hostname {hostname} is already handled by {self._by_hostname[hostname].name}")
+            self._by_hostname[hostname] = spec
+        self._by_name[spec.name] = spec
+        return spec
+
+    def lookup(self, url: str) -> Optional[SpiderSpec]:
+        """Return the spec whose hostname matches the URL's host or one of its parent domains."""
+        hostname = (urlsplit(url.strip()).hostname or '').lower()
+        # Try www.liverpool.com.mx, then liverpool.com.mx, then com.mx: one dict lookup per label
+        while hostname:
+            spec = self._by_hostname.get(hostname)
+            if spec is not None:
+                return spec
+            _, _, hostname = hostname.partition('.')
+        return None
+
+    def get(self, name: str) -> Optional[SpiderSpec]:
+        return self._by_name.get(name)
+
+    def __iter__(self):
+        return iter(self._by_name.values())
+
+
+registry = SpiderRegistry()
+
+registry.register(SpiderSpec(
+    'costco', ['costco.com.mx'], 'scrapy',
+    'scraper_utils.spiders.CostcoSpider.CostcoSpider', concurrency=4, cache_ttl=900, rate_limit=2.0,
+    recrawl_budget=1200))
+registry.register(SpiderSpec(
+    'palacio', ['elpalaciodehierro.com'], 'scrapy',
+    'scraper_utils.spiders.PalacioSpyder.PalacioSpyder', concurrency=4, cache_ttl=900, rate_limit=2.0,
+    recrawl_budget=1200))
+registry.register(SpiderSpec(
+    'liverpool', ['liverpool.com.mx'], 'selenium',
+    'scraper_utils.spiders.LiverpoolSelenium.LiverPoolSeleniumSpider', concurrency=2, cache_ttl=600,
+    fast_path='scraper_utils.spiders.LiverpoolHttp.LiverPoolHttpSpider'))
+registry.register(SpiderSpec(
+    'mercadolibre', ['mercadolibre.com.mx'], 'selenium',
+    'scraper_utils.spiders.MercadoLibreSelenium.MercadoLibreSeleniumSpider', concurrency=2, cache_ttl=300,
+    fast_path='scraper_utils.spiders.MercadoLibreHttp.MercadoLibreHttpSpider',
+    tracking_params=('pdp_filters', 'tracking_id')))
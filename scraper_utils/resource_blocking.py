@@ -0,0 +1,67 @@
+import json
+
+# URL patterns (Chrome DevTools wildcard syntax) for each kind of resource we can block
+RESOURCE_TYPE_PATTERNS = {
+    'image': ['*.png*', '*.jpg*', '*.jpeg*', '*.gif*', '*.webp*', '*.avif*', '*.svg*', '*.ico', '*.ico?*'],
+    'stylesheet': ['*.css', '*.css?*'],
+    'font': ['*.woff*', '*.ttf*', '*.otf*', '*.eot*'],
+    'media': ['*.mp4*', '*.webm*', '*.m3u8*', '*.mp3*'],
+}
+
+# Analytics, ads and session recording scripts that never affect the fields we read
+TRACKER_PATTERNS = [
+    '*google-analytics.com*', '*googletagmanager.com*', '*googleadservices.com*', '*doubleclick.net*',
+    '*googlesyndication.com*', '*facebook.net*', '*connect.facebook.com*', '*hotjar.com*', '*clarity.ms*',
+    '*criteo.com*', '*criteo.net*', '*taboola.com*', '*tiktok.com*', '*bing.com/bat*', '*newrelic.com*',
+    '*nr-data.net*', '*quantummetric.com*', '*dynatrace.com*', '*optimizely.com*',
+]
+
+
+class ResourceBlockingPolicy:
+    """Which requests a Selenium spider lets the browser make.
+
+    ``block_types`` are resource types from RESOURCE_TYPE_PATTERNS and ``deny_patterns`` extra URL
+    patterns to block. ``allow_types`` and ``allow_patterns`` take entries back out, so a retailer
+    that needs e.g. its stylesheets or a tag manager to render can keep them.
+    """
+
+    def __init__(self, block_types=('image', 'stylesheet', 'font', 'media'), deny_patterns=TRACKER_PATTERNS,
+                 allow_types=(), allow_patterns=()):
+        self.block_types = set(block_types) - set(allow_types)
+        self.deny_patterns = list(deny_patterns)
+        self.allow_patterns = set(allow_patterns)
+
+    def blocked_url_patterns(self):
+        patterns = []
+        for resource_type in sorted(self.block_types):
+            patterns.extend(RESOURCE_TYPE_PATTERNS[resource_type])
+        patterns.extend(self.deny_patterns)
+        return [pattern for pattern in patterns if pattern not in self.allow_patterns]
+
+    def apply(self, driver):
+        """Install the block list on a Chrome session through the DevTools protocol."""
+        driver.execute_cdp_cmd('Network.enable', {})
+        driver.execute_cdp_cmd('Network.setBlockedURLs', {'urls': self.blocked_url_patterns()})
+
+
+def collect_network_stats(driver):
+    """Summarize the requests Chrome made and blocked since the performance log was last read.
+
+    Chrome never sends blocked requests, so their size is unknown; ``blocked_requests`` is what was
+    saved and ``transferred_bytes`` what was still downloaded.
+    """
+    stats = {'requests': 0, 'blocked_requests': 0, 'failed_requests': 0, 'transferred_bytes': 0}
+    for entry in driver.get_log('performance'):
+        message = json.loads(entry['message'])['message']
+        method = message.get('method')
+        params = message.get('params', {})
+        if method == 'Network.requestWillBeSent':
+            stats['requests'] += 1
+        elif method == 'Network.loadingFinished':
+            stats['transferred_bytes'] += int(params.get('encodedDataLength', 0))
+        elif method == 'Network.loadingFailed':
+            if params.get('blockedReason'):
+                stats['blocked_requests'] += 1
+            else:
+                stats['failed_requests'] += 1
+    return stats
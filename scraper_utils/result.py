@@ -1,15 +1,148 @@
-from typing import Optional
+import logging
+import re
+from enum import Enum
+from typing import Optional, Union
+
+logger = logging.getLogger(__name__)
+
+# The first amount in a price text: '$3,149', '$ 669.00', 'MXN 1,299.5'
+PRICE_AMOUNT = re.compile(r'-?\d[\d,]*(?:\.\d+)?')
+
+CURRENCY_SYMBOLS = {'MXN': '$', 'USD': 'US$'}
+
+
+class StockStatus(str, Enum):
+    """What a retailer's page says about availability. Values are the strings the API always returned."""
+
+    IN_STOCK = 'In stock'
+    OUT_OF_STOCK = 'Out of stock'
+    ZIP_CODE_REQUIRED = 'In stock - Zip code required'
+    EXTERNAL_VENDORS = 'Available through external vendors'
+    LINK_BROKEN = 'Link broken'
+    URL_NOT_SUPPORTED = 'URL not supported'
+
+    @classmethod
+    def parse(cls, value) -> Union['StockStatus', str, None]:
+        """The status for a spider's string. A string we don't know is kept as it is, with a warning."""
+        if value is None or isinstance(value, cls):
+            return value
+        text = str(value).strip()
+        try:
+            return cls(text)
+        except ValueError:
+            logger.warning("Unknown stock status %r, add it to StockStatus", text)
+            return text
+
+
+def split_amount(amount: str):
+    """Sign, whole units and fraction digits of an amount matched by PRICE_AMOUNT, commas removed."""
+    whole, _, fraction = amount.replace(',', '').partition('.')
+    return whole.startswith('-'), whole.lstrip('-'), fraction
+
+
+def parse_price(value) -> Optional[int]:
+    """Price in cents from what the spiders scrape: '$3,149', '$669.00', 0 or '0'. None for None, '$None', 'N/A'.
+
+    Fractions past the cents are rounded half up on the digits, the same rule ``parse_prices`` applies.
+    """
+    if value is None:
+        return None
+    if isinstance(value, int):
+        return value * 100
+    match = PRICE_AMOUNT.search(str(value))
+    if match is None:
+        return None
+    negative, whole, fraction = split_amount(match.group())
+    fraction = (fraction + '000')[:3]
+    cents = int(whole) * 100 + int(fraction[:2]) + (fraction[2] >= '5')
+    return -cents if negative else cents
+
+
+def parse_prices(values):
+    """``parse_price`` over a whole column at once, vectorized with pandas. Returns a nullable Int64 Series."""
+    import pandas as pd
+
+    text = pd.Series(values, dtype=object).astype(str)
+    amounts = text.str.extract(PRICE_AMOUNT.pattern.join('()'), expand=False).str.replace(',', '', regex=False)
+    parts = amounts.str.partition('.')
+    fraction = (parts[2] + '000').str[:3]
+    cents = (pd.to_numeric(parts[0].str.lstrip('-'), errors='coerce') * 100
+             + pd.to_numeric(fraction.str[:2], errors='coerce')
+             + (fraction.str[2].fillna('0') >= '5')).astype('Int64')
+    return cents.where(~parts[0].str.startswith('-').fillna(False), -cents)
+
+
+def format_price(cents: Optional[int], currency: str = 'MXN') -> Optional[str]:
+    """'$3,149' for whole amounts, '$2,474.25' otherwise."""
+    if cents is None:
+        return None
+    units, rest = divmod(abs(cents), 100)
+    amount = f"{units:,}" if not rest else f"{units:,}.{rest:02d}"
+    return ('-' if cents < 0 else '') + CURRENCY_SYMBOLS.get(currency, currency + ' ') + amount
+
+
+def normalize_category(value) -> Optional[str]:
+    """Collapse the whitespace breadcrumbs come wrapped in. Empty categories become None."""
+    if value is None:
+        return None
+    return ' '.join(str(value).split()) or None
 
 
 class Result:
-    def __init__(self, price: Optional[str] = None, status: Optional[str] = None, category: Optional[str] = None):
+    """What a crawl found: price in integer cents plus currency, a StockStatus and a clean category.
+
+    Spiders keep assigning the scraped text to ``price``, ``status`` and ``category``; it is parsed
+    once on assignment. ``price`` reads back as the formatted price.
+    """
+
+    __slots__ = ('price_cents', 'currency', '_status', '_category')
+
+    def __init__(self, price=None, status=None, category=None, currency: str = 'MXN'):
+        self.currency = currency
         self.price = price
         self.status = status
         self.category = category
 
+    @property
+    def price(self) -> Optional[str]:
+        return format_price(self.price_cents, self.currency)
+
+    @price.setter
+    def price(self, value):
+        self.price_cents = parse_price(value)
+
+    @property
+    def status(self) -> Union[StockStatus, str, None]:
+        return self._status
+
+    @status.setter
+    def status(self, value):
+        self._status = StockStatus.parse(value)
+
+    @property
+    def category(self) -> Optional[str]:
+        return self._category
+
+    @category.setter
+    def category(self, value):
+        self._category = normalize_category(value)
+
     def to_dict(self):
         return {
             'price': self.price,
-            'status': self.status,
-            'category': self.category
+            'price_cents': self.price_cents,
+            'currency': self.currency,
+            'status': self._status.value if isinstance(self._status, StockStatus) else self._status,
+            'category': self._category,
         }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> 'Result':
+        result = cls(status=data.get('status'), category=data.get('category'),
+                     currency=data.get('currency') or 'MXN')
+        cents = data.get('price_cents')
+        result.price_cents = cents if cents is not None else parse_price(data.get('price'))
+        return result
+
+    def __repr__(self):
+        return f"Result(price={self.price!r}, status={self.status!r}, category={self.category!r})"
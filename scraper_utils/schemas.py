@@ -0,0 +1,12 @@
+from typing import List, Optional
+
+from pydantic import BaseModel
+
+
+class CrawlerRequest(BaseModel):
+    sku: Optional[str]
+    url: str
+
+
+class BatchCrawlerRequest(BaseModel):
+    items: List[CrawlerRequest]
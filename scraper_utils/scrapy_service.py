@@ -0,0 +1,288 @@
+import itertools
+import logging
+import multiprocessing
+import os
+import queue
+import threading
+import time
+from concurrent.futures import CancelledError, Future
+
+logger = logging.getLogger(__name__)
+
+
+def _serve(jobs, results, control):
+    """Worker process entry point: keep one Twisted reactor running and crawl every job sent to it.
+
+    Sends ``('started', job_id, pid)`` when a crawl begins and ``('finished', job_id, (result, error, info))``
+    when it ends. ``control`` carries ``('cancel', job_id)`` requests for this worker.
+    """
+    from scrapy import signals
+    from scrapy.crawler import CrawlerRunner
+    from scrapy.utils.misc import load_object
+    from scrapy.utils.project import get_project_settings
+    from twisted.internet import reactor
+
+    from scraper_utils.httpcache import http_cache_settings
+    from scraper_utils.profiling import Capture
+
+    settings = get_project_settings()
+    settings.setdict(http_cache_settings(), priority='project')
+    runner = CrawlerRunner(settings)
+    crawlers = {}
+    # Cancelled jobs this worker has not pulled yet. Jobs leave the shared queue in id order, so
+    # once a job starts here, cancelled ids below it have been taken by another worker.
+    cancelled = set()
+
+    def start_job(job_id, spider_class, url, profile_id=None, expires_at=None):
+        if job_id in cancelled:
+            cancelled.discard(job_id)
+            return
+        cancelled.difference_update([cancelled_id for cancelled_id in cancelled if cancelled_id < job_id])
+        results.put(('started', job_id, os.getpid()))
+        if isinstance(spider_class, str):
+            spider_class = load_object(spider_class)
+        capture = None
+        if profile_id:
+            # Profiles the reactor thread, so crawls running alongside this one show up too
+            capture = Capture(profile_id, f"{spider_class.__name__} {url} (Scrapy worker {os.getpid()})")
+            capture.start()
+        crawler = runner.create_crawler(spider_class)
+        crawlers[job_id] = crawler
+        info = {'http_status': None, 'phases': []}
+
+        def response_received(response, request, spider):
+            info['http_status'] = response.status
+
+        crawler.signals.connect(response_received, signal=signals.response_received, weak=False)
+        options = {}
+        if expires_at is not None:
+            # No download outlives the crawl's deadline, so a timed out crawl stops without killing the worker
+            options['download_timeout'] = max(0.1, expires_at - time.time())
+        deferred = runner.crawl(crawler, url=url, **options)
+
+        def stop_capture(outcome):
+            if capture is not None:
+                capture.stop()
+            return outcome
+
+        if capture is not None:
+            deferred.addBoth(stop_capture)
+
+        def finished(_):
+            # Phases the spider timed (BaseSpider), merged into the crawl's metrics by the API process
+            timings = getattr(crawler.spider, 'timings', None)
+            if timings is not None:
+                info['phases'] = timings.phases
+            try:
+                results.put(('finished', job_id, (crawler.spider.get_result(), None, info)))
+            except Exception as e:
+                results.put(('finished', job_id, (None, str(e), info)))
+
+        def forget(outcome):
+            crawlers.pop(job_id, None)
+            return outcome
+
+        deferred.addCallback(finished)
+        deferred.addErrback(lambda failure: results.put(('finished', job_id, (None, failure.getErrorMessage(), info))))
+        deferred.addBoth(forget)
+
+    def cancel_job(job_id):
+        crawler = crawlers.get(job_id)
+        if crawler is None:
+            cancelled.add(job_id)
+        elif crawler.crawling:
+            crawler.stop()
+
+    def pull_jobs():
+        # Blocking queue reads happen off the reactor thread, crawls are scheduled onto it
+        while True:
+            job = jobs.get()
+            if job is None:
+                reactor.callFromThread(reactor.stop)
+                return
+            reactor.callFromThread(start_job, *job)
+
+    def pull_control():
+        while True:
+            command, job_id = control.get()
+            if command == 'cancel':
+                reactor.callFromThread(cancel_job, job_id)
+
+    threading.Thread(target=pull_jobs, daemon=True).start()
+    threading.Thread(target=pull_control, daemon=True).start()
+    reactor.run(installSignalHandlers=False)
+
+
+class ScrapyService:
+    """A small pool of long-lived Scrapy worker processes fed from a shared job queue.
+
+    Each worker keeps its reactor running between jobs, so a crawl no longer pays for process
+    start, Scrapy imports and reactor start up, and one worker runs many crawls concurrently.
+    A cancelled crawl is stopped by its worker, and the worker is killed and replaced when it has
+    not stopped after ``cancel_grace`` seconds.
+    """
+
+    # Seconds between checks for crashed workers, whose crawls are failed right away
+    liveness_interval = 1.0
+
+    def __init__(self, workers: int = None, cancel_grace: float = None):
+        self.workers = workers or int(os.getenv('SCRAPY_WORKERS', '1'))
+        self.cancel_grace = cancel_grace or float(os.getenv('SCRAPY_CANCEL_GRACE', '10'))
+        # Spawn rather than fork: the API process holds threads and browser sessions
+        self._context = multiprocessing.get_context('spawn')
+        self._jobs = None
+        self._results = None
+        self._processes = []
+        self._controls = []
+        self._pending = {}
+        # job id -> pid of the worker running it
+        self._started = {}
+        self._pending_lock = threading.Lock()
+        self._ids = itertools.count()
+        self._start_lock = threading.Lock()
+        self._running = False
+
+    def start(self):
+        """Start the worker processes and the thread that collects their results."""
+        with self._start_lock:
+            if self._running:
+                return
+            self._jobs = self._context.Queue()
+            self._results = self._context.Queue()
+            self._controls = [self._context.Queue() for _ in range(self.workers)]
+            self._processes = [self._spawn_worker(control) for control in self._controls]
+            self._running = True
+            threading.Thread(target=self._collect_results, daemon=True).start()
+
+    def submit(self, spider_class, url: str, profile_id: str = None, timeout: float = None) -> Future:
+        """Queue a crawl and return a future resolving to the spider's result dict.
+
+        ``spider_class`` may be the class itself or its dotted import path, in which case only the
+        worker process imports it. Once resolved, ``future.info`` holds crawl details reported by the
+        worker, such as the last HTTP status. With ``profile_id`` the worker profiles the crawl and
+        saves the capture under that id (see scraper_utils.profiling). ``timeout`` caps every download
+        of the crawl, pass the seconds left before the crawl's deadline.
+        """
+        if not self._running:
+            self.start()
+        job_id = next(self._ids)
+        future = Future()
+        future.info = {}
+        future.job_id = job_id
+        future.set_running_or_notify_cancel()
+        with self._pending_lock:
+            self._pending[job_id] = future
+        expires_at = time.time() + timeout if timeout else None
+        self._jobs.put((job_id, spider_class, url, profile_id, expires_at))
+        return future
+
+    def cancel(self, future: Future, error: Exception = None) -> bool:
+        """Fail a crawl's future right away with ``error`` and stop the crawl in its worker.
+
+        Returns False when the crawl had already finished.
+        """
+        with self._pending_lock:
+            if self._pending.pop(future.job_id, None) is None:
+                return False
+            pid = self._started.get(future.job_id)
+        future.set_exception(error or CancelledError())
+        if pid is None:
+            # Still queued, whichever worker pulls it will skip it
+            for control in self._controls:
+                control.put(('cancel', future.job_id))
+            return True
+        self._control_of(pid).put(('cancel', future.job_id))
+        timer = threading.Timer(self.cancel_grace, self._kill_if_running, args=(future.job_id, pid))
+        timer.daemon = True
+        timer.start()
+        return True
+
+    def stop(self):
+        """Ask every worker to stop its reactor and wait for it to exit."""
+        with self._start_lock:
+            if not self._running:
+                return
+            self._running = False
+            for _ in self._processes:
+                self._jobs.put(None)
+            for process in self._processes:
+                process.join(timeout=10)
+                if process.is_alive():
+                    process.terminate()
+            self._processes = []
+            self._controls = []
+
+    def _spawn_worker(self, control):
+        process = self._context.Process(target=_serve, args=(self._jobs, self._results, control), daemon=True)
+        process.start()
+        return process
+
+    def _control_of(self, pid: int):
+        for process, control in zip(self._processes, self._controls):
+            if process.pid == pid:
+                return control
+        return self._controls[0]
+
+    def _kill_if_running(self, job_id: int, pid: int):
+        with self._pending_lock:
+            still_running = self._started.get(job_id) == pid
+        if not still_running:
+            return
+        for process in self._processes:
+            if process.pid == pid and process.is_alive():
+                logger.warning("Scrapy worker %s did not stop cancelled job %s, killing it", pid, job_id)
+                process.kill()
+                process.join(timeout=5)
+        self._replace_dead_workers()
+
+    def _collect_results(self):
+        next_check = time.monotonic() + self.liveness_interval
+        while self._running:
+            # On a timer rather than when results stop coming, so a crash under load is noticed too
+            if time.monotonic() >= next_check:
+                self._replace_dead_workers()
+                next_check = time.monotonic() + self.liveness_interval
+            try:
+                event, job_id, payload = self._results.get(timeout=max(0.0, next_check - time.monotonic()))
+            except queue.Empty:
+                continue
+
+            with self._pending_lock:
+                if event == 'started':
+                    self._started[job_id] = payload
+                    continue
+                self._started.pop(job_id, None)
+                future = self._pending.pop(job_id, None)
+            if future is None:
+                # Cancelled while it ran
+                continue
+            result, error, info = payload
+            future.info = info
+            if error is not None:
+                future.set_exception(RuntimeError(error))
+            else:
+                future.set_result(result)
+
+    def _replace_dead_workers(self):
+        with self._start_lock:
+            if not self._running:
+                return
+            for index, process in enumerate(self._processes):
+                if not process.is_alive():
+                    logger.warning("Scrapy worker %s exited with code %s, restarting it", process.pid,
+                                   process.exitcode)
+                    self._fail_jobs_of(process.pid)
+                    self._processes[index] = self._spawn_worker(self._controls[index])
+
+    def _fail_jobs_of(self, pid: int):
+        """Fail the crawls that were running in a worker that died."""
+        with self._pending_lock:
+            job_ids = [job_id for job_id, worker in self._started.items() if worker == pid]
+            futures = []
+            for job_id in job_ids:
+                del self._started[job_id]
+                future = self._pending.pop(job_id, None)
+                if future is not None:
+                    futures.append(future)
+        for future in futures:
+            future.set_exception(RuntimeError(f"Scrapy worker {pid} died during the crawl"))
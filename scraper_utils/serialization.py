@@ -0,0 +1,20 @@
+import json
+
+# orjson serializes crawl results several times faster; the stdlib is the fallback
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def dumps(obj) -> str:
+    """JSON text of ``obj``, non-ASCII characters kept as they are. Unknown types are written with str()."""
+    if orjson is not None:
+        return orjson.dumps(obj, default=str, option=orjson.OPT_NON_STR_KEYS).decode()
+    return json.dumps(obj, ensure_ascii=False, default=str)
+
+
+def loads(text):
+    if orjson is not None:
+        return orjson.loads(text)
+    return json.loads(text)
@@ -0,0 +1,199 @@
+import asyncio
+import logging
+import os
+import socket
+import threading
+import time
+import uuid
+from concurrent.futures import Future
+from typing import Optional
+
+from sqlalchemy import Float, String, Text, create_engine, delete, insert, select, update
+from sqlalchemy.exc import IntegrityError, SQLAlchemyError
+from sqlalchemy.orm import DeclarativeBase, Mapped, Session, mapped_column
+
+from scraper_utils.serialization import dumps, loads
+
+logger = logging.getLogger(__name__)
+
+
+class Base(DeclarativeBase):
+    pass
+
+
+class Flight(Base):
+    """A crawl in progress for a canonical URL, claimed by one API process."""
+
+    __tablename__ = 'flights'
+
+    key: Mapped[str] = mapped_column(String(2048), primary_key=True)
+    flight_id: Mapped[str] = mapped_column(String(32))
+    owner: Mapped[str] = mapped_column(String(255))
+    # The claim is up for grabs after this, in case its owner died mid crawl
+    expires_at: Mapped[float] = mapped_column(Float)
+
+
+class Landing(Base):
+    """The outcome of the latest finished flight of a URL, read by processes that waited on it."""
+
+    __tablename__ = 'landings'
+
+    key: Mapped[str] = mapped_column(String(2048), primary_key=True)
+    result: Mapped[Optional[str]] = mapped_column(Text)
+    error: Mapped[Optional[str]] = mapped_column(Text)
+    finished_at: Mapped[float] = mapped_column(Float)
+
+
+class SingleFlight:
+    """Runs at most one crawl per canonical URL at a time; concurrent callers share its result.
+
+    Callers in this process wait on the same future. Across API processes (uvicorn workers) the
+    crawl is claimed in a shared table, and the other processes poll for its outcome instead of
+    crawling too. ``database_url`` is any SQLAlchemy URL (INFLIGHT_DATABASE_URL, a SQLite file by
+    default, which every worker on the host shares). A claim lapses after ``lease`` seconds, so a
+    crashed owner's URLs are crawled again by the next caller.
+    """
+
+    def __init__(self, database_url: str = None, lease: float = 360, poll_interval: float = 0.2,
+                 keep_landings: float = 300):
+        self.database_url = database_url or os.getenv('INFLIGHT_DATABASE_URL', 'sqlite:///inflight.db')
+        self.lease = lease
+        self.poll_interval = poll_interval
+        self.keep_landings = keep_landings
+        self.engine = create_engine(self.database_url, pool_pre_ping=True)
+        self.owner = f"{socket.gethostname()}:{os.getpid()}"
+        self._flights = {}
+        self._lock = threading.Lock()
+        self.led = 0
+        self.joined = 0
+        self.joined_remote = 0
+
+    def start(self):
+        Base.metadata.create_all(self.engine)
+
+    async def run(self, key: str, start):
+        """Return ``(result, joined)`` for the crawl of ``key``, starting it with ``start()`` if nobody is.
+
+        ``start`` returns a concurrent future of the result dict. ``joined`` is True when the result
+        came from a crawl another caller started. An exception raised by that crawl is raised here
+        for every caller.
+        """
+        with self._lock:
+            future = self._flights.get(key)
+            joined = future is not None
+            if joined:
+                self.joined += 1
+            else:
+                future = Future()
+                self._flights[key] = future
+                self.led += 1
+        if not joined:
+            # A task of its own, so the crawl is seen through even if this caller goes away
+            asyncio.get_running_loop().create_task(self._lead(key, future, start))
+        # The future holds (result, whether another process crawled it). Shielded, as a caller that
+        # goes away would otherwise cancel it for everyone sharing the crawl.
+        result, remote = await asyncio.shield(asyncio.wrap_future(future))
+        return result, joined or remote
+
+    def stats(self):
+        with self._lock:
+            in_flight = len(self._flights)
+        return {'in_flight': in_flight, 'led': self.led, 'joined': self.joined, 'joined_remote': self.joined_remote}
+
+    async def _lead(self, key: str, future: Future, start):
+        # Every database call runs on a thread: with a shared SQLite file a lock wait can take seconds
+        try:
+            while True:
+                since = time.time()
+                try:
+                    flight_id = await asyncio.to_thread(self._claim, key)
+                except SQLAlchemyError:
+                    logger.exception("Could not claim %s in the shared registry, crawling it anyway", key)
+                    flight_id = ''
+                if flight_id is not None:
+                    await self._fly(key, flight_id, start(), future)
+                    return
+                landing = await self._wait_remote(key, since)
+                if landing is not None:
+                    self.joined_remote += 1
+                    self._resolve(key, future, landing)
+                    return
+                # The other process let its claim lapse, take the crawl over
+        except Exception as e:
+            logger.exception("Single flight of %s failed", key)
+            self._pop(key)
+            future.set_exception(e)
+
+    def _claim(self, key: str) -> Optional[str]:
+        """Claim the URL for this process. Returns the new flight id, or None when another process holds it."""
+        now = time.time()
+        flight_id = uuid.uuid4().hex
+        values = {'flight_id': flight_id, 'owner': self.owner, 'expires_at': now + self.lease}
+        with Session(self.engine) as session:
+            try:
+                session.execute(insert(Flight).values(key=key, **values))
+                session.commit()
+                return flight_id
+            except IntegrityError:
+                session.rollback()
+            # Someone holds it, unless their lease ran out
+            taken = session.execute(update(Flight).where(Flight.key == key, Flight.expires_at < now).values(**values))
+            session.commit()
+            return flight_id if taken.rowcount else None
+
+    async def _wait_remote(self, key: str, since: float):
+        """Poll until the other process lands its flight. Returns the Landing, or None if its claim lapsed."""
+        while True:
+            landing, expires_at = await asyncio.to_thread(self._poll, key)
+            if landing is not None and landing.finished_at >= since:
+                return landing
+            if expires_at is None or expires_at < time.time():
+                return None
+            await asyncio.sleep(self.poll_interval)
+
+    def _poll(self, key: str):
+        """The URL's latest Landing and when the current claim on it expires (None when unclaimed)."""
+        with Session(self.engine) as session:
+            landing = session.get(Landing, key)
+            if landing is not None:
+                session.expunge(landing)
+            return landing, session.execute(select(Flight.expires_at).where(Flight.key == key)).scalar()
+
+    async def _fly(self, key: str, flight_id: str, crawl: Future, future: Future):
+        """See our crawl through, publish it to waiting processes, then hand it to the callers in this one."""
+        try:
+            result, error = await asyncio.wrap_future(crawl), None
+        except Exception as e:
+            result, error = None, e
+        if flight_id:
+            try:
+                await asyncio.to_thread(self._publish, key, flight_id, result, error)
+            except SQLAlchemyError:
+                logger.exception("Could not publish the result of %s", key)
+        self._pop(key)
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result((result, False))
+
+    def _publish(self, key: str, flight_id: str, result, error):
+        now = time.time()
+        with Session(self.engine) as session:
+            session.execute(delete(Landing).where(
+                (Landing.key == key) | (Landing.finished_at < now - self.keep_landings)))
+            session.execute(insert(Landing).values(
+                key=key, result=dumps(result) if error is None else None,
+                error=str(error) if error is not None else None, finished_at=now))
+            session.execute(delete(Flight).where(Flight.key == key, Flight.flight_id == flight_id))
+            session.commit()
+
+    def _resolve(self, key: str, future: Future, landing: Landing):
+        self._pop(key)
+        if landing.error is not None:
+            future.set_exception(RuntimeError(landing.error))
+        else:
+            future.set_result((loads(landing.result), True))
+
+    def _pop(self, key: str):
+        with self._lock:
+            self._flights.pop(key, None)
@@ -1,50 +1,40 @@
-import json
 import time
-import threading
-from selenium.common import NoSuchElementException, TimeoutException, StaleElementReferenceException
+from selenium.common import NoSuchElementException, StaleElementReferenceException
 from selenium.webdriver.common.by import By
 from selenium.webdriver.support.wait import WebDriverWait
 import selenium.webdriver.support.expected_conditions as EC
 from scraper_utils.BaseSelenium import BaseSelenium
+from scraper_utils.metrics import timed
 from scraper_utils.result import Result
 
+# The heading of Costco's "page not found" page
+NOT_FOUND_XPATH = "//h1[contains(@class, 'heading')][contains(., 'no pudo ser encontrada')]"
+
 
 class CostcoSeleniumSpider(BaseSelenium):
     name = 'costco'
 
-    def __init__(self, url: str = 'https://www.costco.com.mx/', result_file: str = 'result_costco.json',
-                 browser: str = 'chrome'):
-        super().__init__(browser)
+    def __init__(self, url: str = 'https://www.costco.com.mx/', browser: str = 'chrome', driver_pool=None):
+        super().__init__(browser, driver_pool=driver_pool)
         self.url = url
-        self.result_file = result_file
         self.result = Result()
-        self.timeout = 300 # Timeout in seconds
-        self.crawling_thread = None  # Thread reference
-        self.timeout_event = threading.Event()  # Event to signal completion
+
+    # The page is readable once the price or the "page not found" heading has rendered. Product pages
+    # have h1.heading elements too, so the not-found page is told apart by its message.
+    ready_selector = (By.XPATH, "//div[contains(@class, 'product-price-container')]"
+                                "//span[contains(@class, 'notranslate') and contains(@class, 'ng-star-inserted')]"
+                                f" | {NOT_FOUND_XPATH}")
 
     def run(self):
+        # The crawl's deadline (scraper_utils.deadline) kills the browser when it runs out of time
         try:
-            # Start the timeout checker
-            self.timeout_event.clear()
-            self.crawling_thread = threading.Thread(target=self.crawl)
-            self.crawling_thread.start()
-
-            # Wait for the crawling to complete or timeout
-            self.crawling_thread.join(timeout=self.timeout)
-
-            # Check if the crawling finished in time
-            if self.crawling_thread.is_alive():
-                print("Crawling timed out.")
-                self.take_screenshot('crawling_timeout.png')  # Capture a screenshot for debugging
-                self.timeout_event.set()  # Signal the timeout event
-            else:
-                self.timeout_event.set()  # Signal that crawling finished on time
-
+            self.crawl()
         except Exception as e:
             print("Error during crawling: ", str(e))
             self.take_screenshot("timeout_error.png")
         finally:
             self.close_browser()
+        return self.result
 
     def crawl(self):
         try:
@@ -60,12 +50,14 @@ class CostcoSeleniumSpider(BaseSelenium):
 
             print("Body tag loaded successfully.")
 
+            if self.extraction_mode == 'snapshot' and self.parse_snapshot(self.snapshot(self.ready_selector)):
+                return
+
             # Check if the page is broken
             if self.is_link_broken():
                 self.result.status = 'Link broken'
                 self.result.price = 0
                 self.result.category = 'Link broken'
-                self.save_result()
                 return
 
             # Extract breadcrumbs (category)
@@ -91,29 +83,64 @@ class CostcoSeleniumSpider(BaseSelenium):
             inventory_status = self.extract_inventory_status()
             self.result.status = inventory_status
 
-            self.save_result()
-
         except Exception as e:
             print("Page did not load fully, there might be a loading issue. " + str(e))
             self.take_screenshot("timeout_error.png")
         finally:
             self.close_browser()
 
-    def is_link_broken(self):
-        try:
-            # This should match the container class or a reliable identifying element for that section
-            wait = WebDriverWait(self.driver, 10)  # Increased timeout
-            section_element = wait.until(
-                EC.presence_of_element_located((By.CSS_SELECTOR, "div.product-page-container")))
-            link_working_div = self.driver.find_element(By.CSS_SELECTOR,
-                                                        'div.product-price-container.col-xs-12.col-sm-12')
-            if section_element or not link_working_div:
-                # Section was found, meaning the link is not broken
-                return False
-        except (NoSuchElementException, TimeoutException):
-            # In case the element or page fails to load, return True indicating the link is broken
+    @timed
+    def parse_snapshot(self, selector):
+        """Fill the result from one DOM snapshot. Returns False if a field is missing and live extraction is needed."""
+        if not selector.css('div.product-page-container'):
+            self.result.status = 'Link broken'
+            self.result.price = 0
+            self.result.category = 'Link broken'
             return True
 
+        price = selector.css('span.notranslate.ng-star-inserted::text').get()
+        if selector.css('div.discount span.discount-value sip-format-price span.notranslate'):
+            price = selector.css('div.price-after-discount div.you-pay-value span.you-pay-value::text').get()
+
+        status = self.inventory_status_from_snapshot(selector)
+        if price is None or status is None:
+            return False
+
+        breadcrumbs = [breadcrumb.strip() for breadcrumb in selector.css('ol.breadcrumb li a::text').getall()]
+        if len(breadcrumbs) > 1:
+            self.result.category = breadcrumbs[1]
+        self.result.price = price.strip()
+        self.result.status = status
+        return True
+
+    @staticmethod
+    def inventory_status_from_snapshot(selector):
+        # Same rules as extract_inventory_status, applied to the snapshot's buttons
+        for button in selector.css('button[type="submit"], button[type="button"]'):
+            button_text = button.xpath('normalize-space(.)').get()
+            is_disabled = button.attrib.get('disabled') is not None
+
+            if button_text == "Agotado" or ("disabled" in button.attrib.get('class', '') and is_disabled):
+                return "Out of stock"
+            elif button_text == "Agregar al Carrito":
+                return "In stock"
+            elif button_text == "Seleccionar Código Postal":
+                return "In stock - Zip code required"
+            elif selector.css('input[name="postalCode"]'):
+                return "In stock - Zip code required"
+        return None
+
+    @timed
+    def is_link_broken(self):
+        # Resolve as soon as either the product section or the "page not found" heading renders
+        outcome, _ = self.wait_for_any({
+            'product': (By.CSS_SELECTOR, 'div.product-page-container'),
+            'not_found': (By.XPATH, NOT_FOUND_XPATH),
+        })
+        # No product section (page not found, or the page failed to load) means the link is broken
+        return outcome != 'product'
+
+    @timed
     def extract_breadcrumbs(self):
         try:
             wait = WebDriverWait(self.driver, 10)
@@ -122,6 +149,7 @@ class CostcoSeleniumSpider(BaseSelenium):
         except (NoSuchElementException, StaleElementReferenceException):
             return []
 
+    @timed
     def extract_original_price(self):
         try:
             wait = WebDriverWait(self.driver, 10)
@@ -131,18 +159,32 @@ class CostcoSeleniumSpider(BaseSelenium):
         except NoSuchElementException:
             return None
 
+    @staticmethod
+    def price_container_rendered(driver):
+        """Whether the price block has finished rendering: no skeletons left and the cart button is out.
+
+        Discounted pages show the plain price too, so the price alone says nothing about a discount.
+        """
+        containers = driver.find_elements(By.CSS_SELECTOR, 'div.product-price-container')
+        return bool(containers
+                    and not containers[0].find_elements(By.CSS_SELECTOR, 'sip-skeleton')
+                    and containers[0].find_elements(By.CSS_SELECTOR, 'span.notranslate.ng-star-inserted')
+                    and driver.find_elements(By.CSS_SELECTOR, 'div.add-to-cart button'))
+
+    @timed
     def extract_discount_value(self):
-        try:
-            wait = WebDriverWait(self.driver, 10)
-            # Try to find the discount element
-            discount_value = wait.until(EC.presence_of_element_located(
-                (By.CSS_SELECTOR, 'div.discount span.discount-value sip-format-price span.notranslate')))
-            return discount_value.text.strip()
-        except (NoSuchElementException, TimeoutException):
-            # If no discount is found, return None or a default value
+        # Race the discount against the fully rendered price block: a product without a discount resolves
+        # once its price block is complete instead of waiting out the whole timeout
+        outcome, discount_value = self.wait_for_any({
+            'discount': (By.CSS_SELECTOR, 'div.discount span.discount-value sip-format-price span.notranslate'),
+            'rendered': self.price_container_rendered,
+        })
+        if outcome != 'discount':
             print("No discount found, skipping.")
             return None
+        return discount_value.text.strip()
 
+    @timed
     def extract_price_after_discount(self):
 
         try:
@@ -154,6 +196,7 @@ class CostcoSeleniumSpider(BaseSelenium):
         except NoSuchElementException:
             return None
 
+    @timed
     def extract_inventory_status(self):
         max_retries = 3
         retry_count = 0
@@ -193,7 +236,3 @@ class CostcoSeleniumSpider(BaseSelenium):
                 break  # Break the loop on unexpected errors
 
         return "Link broken"
-
-    def save_result(self):
-        with open(self.result_file, 'w') as f:
-            json.dump(self.result.to_dict(), f, indent=4)
\ No newline at end of file
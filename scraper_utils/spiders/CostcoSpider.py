@@ -1,4 +1,3 @@
-import json
 import re
 
 from scraper_utils.BaseSpider import BaseSpider
@@ -12,7 +11,6 @@ class CostcoSpider(BaseSpider):
     def __init__(self, url='https://www.costco.com.mx/', *args, **kwargs):
         super(CostcoSpider, self).__init__(url, *args, **kwargs)
         self.result = Result()
-        self.result_file = 'result_costco.json'
 
     def parse(self, response, **kwargs):
 
@@ -37,7 +35,6 @@ class CostcoSpider(BaseSpider):
                 self.result.status = result
                 self.result.price = 0
                 self.result.category = result
-                self.save_result()
                 return
 
         broken_link_text = response.css('h1.heading::text').get()
@@ -47,7 +44,6 @@ class CostcoSpider(BaseSpider):
             self.result.status = result
             self.result.price = 0
             self.result.category = result
-            self.save_result()
             return
 
         breadcrumbs = response.css('ol.breadcrumb li a::text').getall()
@@ -99,12 +95,5 @@ class CostcoSpider(BaseSpider):
                 result = "Link broken"
 
         self.logger.info(f"Assigned price: {self.result.price}")
-        # Save result to file
         self.result.status = result
         self.logger.info(f"Assigned status: {self.result.status}")
-
-        self.save_result()
-
-    def save_result(self):
-        with open(self.result_file, 'w') as f:
-            json.dump(self.result.to_dict(), f, indent=4)
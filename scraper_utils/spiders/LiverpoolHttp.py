@@ -0,0 +1,46 @@
+from parsel import Selector
+
+from scraper_utils.BaseHttpSpider import BaseHttpSpider
+from scraper_utils.result import format_price, parse_price
+
+
+class LiverPoolHttpSpider(BaseHttpSpider):
+    name = 'LiverPoolHttp'
+
+    def parse(self, selector: Selector):
+        if selector.css('.o-content__noResultsNullSearch'):
+            return self.link_broken()
+
+        objects = self.json_ld(selector)
+        product = self.find_type(objects, 'Product') or {}
+
+        price, availability = self.offer_price(product)
+        if price is not None:
+            price = format_price(parse_price(price))
+        else:
+            price = selector.css('p.a-product__paragraphDiscountPrice::text').get()
+            price = price.strip() if price else None
+
+        status = self.availability_status(availability)
+        if status is None and selector.css('#opc_pdp_buyNowButton'):
+            status = 'In stock'
+
+        breadcrumbs = [
+            element.css('a.a-breadcrumb__label::text, span.a-breadcrumb__label strong::text').get('').strip()
+            for element in selector.css('ul.m-breadcrumb-list li')
+        ]
+        current_category = selector.css('ul.m-breadcrumb-list li.active span.a-breadcrumb__label strong::text').get()
+        if current_category:
+            breadcrumbs.append(current_category.strip())
+        if not breadcrumbs:
+            breadcrumbs = self.breadcrumb_names(objects)
+        # Same position the Selenium spider takes from its reversed breadcrumb list
+        categories = list(reversed(breadcrumbs))
+
+        if price is None or status is None or len(categories) < 3:
+            return None
+
+        self.result.price = price
+        self.result.status = status
+        self.result.category = categories[2]
+        return self.result
@@ -1,26 +1,34 @@
-import json
-
 from selenium.common.exceptions import NoSuchElementException, TimeoutException
 from selenium.webdriver.common.by import By
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
 from scraper_utils.BaseSelenium import BaseSelenium
+from scraper_utils.metrics import timed
+from scraper_utils.resource_blocking import ResourceBlockingPolicy
 from scraper_utils.result import Result
 
 
 class LiverPoolSeleniumSpider(BaseSelenium):
     name = 'LiverPoolSelenium'
 
-    def __init__(self, url: str, result_file: str, browser: str = 'chrome'):
-        super().__init__(browser)
+    # Stylesheets stay, the live extraction checks whether the buy button is displayed
+    resource_blocking = ResourceBlockingPolicy(allow_types=('stylesheet',))
+
+    def __init__(self, url: str, browser: str = 'chrome', driver_pool=None):
+        super().__init__(browser, driver_pool=driver_pool)
         self.url = url
-        self.result_file = result_file
         self.result = Result()
 
+    # The page is readable once either the price or the "not found" block has rendered
+    ready_selector = 'p.a-product__paragraphDiscountPrice, .o-content__noResultsNullSearch'
+
     def run(self):
         # Navigate to the given URL
         self.navigate_to_page(self.url)
 
+        if self.extraction_mode == 'snapshot' and self.parse_snapshot(self.snapshot(self.ready_selector)):
+            return self.result
+
         try:
             # Wait until the page is fully loaded by checking for a critical element
             self.wait_for_element(By.TAG_NAME, 'body', timeout=10)
@@ -42,28 +50,51 @@ class LiverPoolSeleniumSpider(BaseSelenium):
                 self.result.category = breadcrumbs[2]
                 price = self.extract_prices()
                 self.result.price = price
-            self.save_result(self.result)
         except TimeoutException:
             print("Page did not load fully, the link might be broken or there was a loading issue.")
-
-    def is_link_broken(self):
-        try:
-            # Check for specific broken link div
-            broken_link_element = WebDriverWait(self.driver, 10).until(
-                EC.presence_of_element_located((By.CLASS_NAME, 'o-content__noResultsNullSearch'))
-            )
-            if broken_link_element.is_displayed():
-                return True
-
-            # Fallback check using page title
-            page_title = self.driver.title.lower()
-            if "página no encontrada" in page_title or "lo sentimos" in page_title:
-                return True
-
-        except (NoSuchElementException, TimeoutException):
+        return self.result
+
+    @timed
+    def parse_snapshot(self, selector):
+        """Fill the result from one DOM snapshot. Returns False if a field is missing and live extraction is needed."""
+        if selector.css('.o-content__noResultsNullSearch'):
+            self.result.status = "Link broken"
+            self.result.price = 0
+            self.result.category = "Link broken"
+            return True
+
+        breadcrumbs = [
+            element.css('a.a-breadcrumb__label::text, span.a-breadcrumb__label strong::text').get('').strip()
+            for element in selector.css('ul.m-breadcrumb-list li')
+        ]
+        current_category = selector.css('ul.m-breadcrumb-list li.active span.a-breadcrumb__label strong::text').get()
+        if current_category:
+            breadcrumbs.append(current_category.strip())
+        breadcrumbs = list(reversed(breadcrumbs))
+
+        price = selector.css('p.a-product__paragraphDiscountPrice::text').get()
+        if len(breadcrumbs) < 3 or not price:
             return False
-        return False
 
+        self.result.status = "In stock" if selector.css('#opc_pdp_buyNowButton') else "Out of stock"
+        self.result.category = breadcrumbs[2]
+        self.result.price = price.strip()
+        return True
+
+    @timed
+    def is_link_broken(self):
+        # Race the "not found" block against the product price so valid pages don't wait out the timeout
+        outcome, element = self.wait_for_any({
+            'not_found': (By.CLASS_NAME, 'o-content__noResultsNullSearch'),
+            'not_found_title': lambda driver: any(marker in driver.title.lower()
+                                                  for marker in ("página no encontrada", "lo sentimos")),
+            'product': (By.CSS_SELECTOR, 'p.a-product__paragraphDiscountPrice'),
+        })
+        if outcome == 'not_found':
+            return element.is_displayed()
+        return outcome == 'not_found_title'
+
+    @timed
     def check_if_in_stock(self):
         try:
             # Explicitly wait for the "Comprar ahora" button to appear
@@ -76,6 +107,7 @@ class LiverPoolSeleniumSpider(BaseSelenium):
             return False
         return False
 
+    @timed
     def extract_breadcrumbs(self):
         try:
             self.driver.set_window_size(1920, 1080)
@@ -116,6 +148,7 @@ class LiverPoolSeleniumSpider(BaseSelenium):
         except (NoSuchElementException, TimeoutException):
             return []
 
+    @timed
     def extract_prices(self):
         try:
             price = WebDriverWait(self.driver, 10).until(
@@ -128,10 +161,6 @@ class LiverPoolSeleniumSpider(BaseSelenium):
         except (NoSuchElementException, TimeoutException):
             return None
 
-    def save_result(self, result):
-        with open(self.result_file, 'w') as f:
-            json.dump(self.result.to_dict(), f, indent=4)
-
     def scroll_to_element(self, element):
         self.driver.execute_script("arguments[0].scrollIntoView();", element)
 
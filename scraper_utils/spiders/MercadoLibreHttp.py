@@ -0,0 +1,38 @@
+from parsel import Selector
+
+from scraper_utils.BaseHttpSpider import BaseHttpSpider
+from scraper_utils.result import format_price, parse_price
+
+
+class MercadoLibreHttpSpider(BaseHttpSpider):
+    name = "MercadoLibreHttp"
+
+    def parse(self, selector: Selector):
+        objects = self.json_ld(selector)
+        product = self.find_type(objects, 'Product')
+        if product is None:
+            # Not a product page we understand (or a bot check), let the browser have a look
+            return None
+
+        price, availability = self.offer_price(product)
+        if price is not None:
+            price = format_price(parse_price(price))
+        else:
+            fraction = selector.css('span.andes-money-amount__fraction::text').get()
+            price = f"${fraction}" if fraction else None
+
+        status = self.availability_status(availability)
+
+        breadcrumbs = selector.css(
+            'ol.andes-breadcrumb li.andes-breadcrumb__item a.andes-breadcrumb__link::text').getall()
+        breadcrumbs = [breadcrumb.strip() for breadcrumb in breadcrumbs] or self.breadcrumb_names(objects)
+        # Same position the Selenium spider takes from its reversed breadcrumb list
+        categories = list(reversed(breadcrumbs))
+
+        if price is None or status is None or len(categories) < 3:
+            return None
+
+        self.result.price = price
+        self.result.status = status
+        self.result.category = categories[2]
+        return self.result
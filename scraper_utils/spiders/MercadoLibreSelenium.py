@@ -1,29 +1,36 @@
-import json
 from selenium.common.exceptions import NoSuchElementException, TimeoutException
 from selenium.webdriver.common.by import By
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
 from scraper_utils.BaseSelenium import BaseSelenium
+from scraper_utils.metrics import timed
+from scraper_utils.resource_blocking import TRACKER_PATTERNS, ResourceBlockingPolicy
 from scraper_utils.result import Result
 
 
 class MercadoLibreSeleniumSpider(BaseSelenium):
     name = "MercadoLibreSelenium"
 
-    def __init__(self, url: str, result_file: str, browser: str = 'chrome'):
-        super().__init__(browser)
+    # MercadoLibre also ships its own analytics (melidata) on every page. Stylesheets stay, the
+    # live extraction decides stock from which buttons are displayed.
+    resource_blocking = ResourceBlockingPolicy(deny_patterns=TRACKER_PATTERNS + ['*melidata*'],
+                                               allow_types=('stylesheet',))
+
+    def __init__(self, url: str, browser: str = 'chrome', driver_pool=None):
+        super().__init__(browser, driver_pool=driver_pool)
         self.url = url
-        self.result_file = result_file
         self.result = Result()
 
-    def save_result(self, result):
-        with open(self.result_file, 'w') as f:
-            json.dump(self.result.to_dict(), f, indent=4)
+    # The product container renders together with the price, breadcrumbs and buy buttons
+    ready_selector = '#ui-pdp-main-container'
 
     def run(self):
         # Navigate to the given URL
         self.navigate_to_page(self.url)
 
+        if self.extraction_mode == 'snapshot' and self.parse_snapshot(self.snapshot(self.ready_selector, timeout=2)):
+            return self.result
+
         try:
             # Wait until the page is fully loaded by checking for a critical element
             self.wait_for_element(By.TAG_NAME, 'body', timeout=2)
@@ -41,55 +48,66 @@ class MercadoLibreSeleniumSpider(BaseSelenium):
                 self.result.price = f"${price}"
                 categories = self.extract_breadcrumbs()
                 self.result.category = categories[2]
-            self.save_result(self.result)
         except TimeoutException:
             print("Page did not load fully, the link might be broken or there was a loading issue")
-
-    def is_link_broken(self):
-        try:
-            # Check for the specific div that indicates a valid page structure
-            valid_div_element = WebDriverWait(self.driver, 2).until(
-                EC.presence_of_element_located(
-                    (By.XPATH, '//div[@class="ui-pdp-container ui-pdp-container--pdp"]'
-                               '/div[@class="ui-pdp-container__row ui-pdp--relative ui-pdp-with--separator--fluid '
-                               'pb-24" and @id="ui-pdp-main-container"]')
-                )
-            )
-            if valid_div_element.is_displayed():
-                return False
-
-        except (NoSuchElementException, TimeoutException):
+        return self.result
+
+    @timed
+    def parse_snapshot(self, selector):
+        """Fill the result from one DOM snapshot. Returns False if a field is missing and live extraction is needed."""
+        if not selector.css('div.ui-pdp-container--pdp #ui-pdp-main-container'):
+            self.result.status = "Link broken"
+            self.result.price = 0
+            self.result.category = "Link broken"
             return True
 
-        # Fallback check using page title
-        page_title = self.driver.title.lower()
-        if "página no encontrada" in page_title or "lo sentimos" in page_title:
+        if selector.css('[id=":R9b9k5l9im:"]'):
+            status = "In stock"
+        elif selector.css('[id=":R16qakck4um:"]'):
+            status = "Available through external vendors"
+        else:
+            status = "Out of stock"
+
+        price = selector.css('span.andes-money-amount__fraction::text').get()
+        breadcrumbs = selector.css(
+            'ol.andes-breadcrumb li.andes-breadcrumb__item a.andes-breadcrumb__link::text').getall()
+        categories = list(reversed([breadcrumb.strip() for breadcrumb in breadcrumbs]))
+        if len(categories) < 3 or price is None:
+            return False
+
+        self.result.status = status
+        self.result.price = f"${price}"
+        self.result.category = categories[2]
+        return True
+
+    @timed
+    def is_link_broken(self):
+        # Race the valid page structure against a "not found" title, whichever comes first decides
+        outcome, valid_div_element = self.wait_for_any({
+            'product': (By.XPATH, '//div[@class="ui-pdp-container ui-pdp-container--pdp"]'
+                                  '/div[@class="ui-pdp-container__row ui-pdp--relative ui-pdp-with--separator--fluid '
+                                  'pb-24" and @id="ui-pdp-main-container"]'),
+            'not_found': lambda driver: any(marker in driver.title.lower()
+                                            for marker in ("página no encontrada", "lo sentimos")),
+        }, timeout=2)
+        if outcome != 'product':
             return True
+        return not valid_div_element.is_displayed()
 
-        return False
-
+    @timed
     def check_if_in_stock(self):
-        try:
-            # Explicitly wait for the "Comprar ahora" button to appear
-            buy_now_button = WebDriverWait(self.driver, 2).until(
-                EC.presence_of_element_located((By.ID, ':R9b9k5l9im:'))
-            )
-            if buy_now_button.is_displayed():
-                return "In stock"
-
-        except (NoSuchElementException, TimeoutException):
-            # If "Comprar ahora" button is not found, check for external vendors
-            try:
-                external_vendor_element = WebDriverWait(self.driver, 2).until(
-                    EC.presence_of_element_located((By.ID, ':R16qakck4um:'))
-                )
-                if external_vendor_element.is_displayed():
-                    return "Available through external vendors"
-            except (NoSuchElementException, TimeoutException):
-                return "Out of stock"
-
+        # Wait for the "Comprar ahora" button and the external vendors block at the same time
+        outcome, element = self.wait_for_any({
+            'buy_now': (By.ID, ':R9b9k5l9im:'),
+            'external_vendor': (By.ID, ':R16qakck4um:'),
+        }, timeout=2)
+        if outcome == 'buy_now' and element.is_displayed():
+            return "In stock"
+        if outcome == 'external_vendor' and element.is_displayed():
+            return "Available through external vendors"
         return "Out of stock"
 
+    @timed
     def extract_price(self):
         try:
             price = WebDriverWait(self.driver, 10).until(
@@ -100,6 +118,7 @@ class MercadoLibreSeleniumSpider(BaseSelenium):
         except (NoSuchElementException, TimeoutException):
             return None
 
+    @timed
     def extract_breadcrumbs(self):
         try:
             # Wait until the breadcrumb container is present
@@ -124,17 +143,10 @@ class MercadoLibreSeleniumSpider(BaseSelenium):
             print("An error occurred:", e)
             return []
 
-    def close_browser(self):
-        """Close the browser and release memory resources."""
-        if self.driver:
-            self.driver.quit()
-            self.driver = None
-
-
 
 if __name__ == '__main__':
     spider = MercadoLibreSeleniumSpider(
-        url="https://www.mercadolibre.com.mx/asador-electrico-george-foreman-grd6090b-gris/p/MLM18983601?pdp_filters=item_id:MLM1431792087",
-        result_file="result_mercado.json"
+        url="https://www.mercadolibre.com.mx/asador-electrico-george-foreman-grd6090b-gris/p/MLM18983601?pdp_filters=item_id:MLM1431792087"
     )
-    spider.run()
+    print(spider.run().to_dict())
+    spider.close_browser()
@@ -1,4 +1,3 @@
-import json
 import logging
 from scraper_utils.BaseSpider import BaseSpider
 from scraper_utils.result import Result
@@ -18,7 +17,6 @@ class PalacioSpyder(BaseSpider):
     def __init__(self, url='https://www.elpalaciodehierro.com/', *args, **kwargs):
         super(PalacioSpyder, self).__init__(url, *args, **kwargs)
         self.result = Result()
-        self.result_file = 'result_palacio.json'
 
     def parse(self, response, **kwargs):
 
@@ -46,11 +44,4 @@ class PalacioSpyder(BaseSpider):
         else:
             result = "Link broken"
 
-        # Save the result to a file
         self.result.status = result
-
-        self.save_result()
-
-    def save_result(self):
-        with open(self.result_file, 'w') as f:
-            json.dump(self.result.to_dict(), f, indent=4)
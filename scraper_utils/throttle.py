@@ -0,0 +1,152 @@
+import threading
+import time
+from contextlib import contextmanager
+
+# Responses that mean the retailer is pushing back
+BLOCK_STATUSES = (403, 429)
+
+
+class TokenBucket:
+    """Allows ``rate`` acquisitions per second on average, with bursts of up to ``burst``."""
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = burst
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Take a token, sleeping until one is available."""
+        while True:
+            wait = self.try_acquire()
+            if not wait:
+                return
+            time.sleep(wait)
+
+    def try_acquire(self) -> float:
+        """Take a token if one is available. Returns 0 on success, else the seconds until one will be."""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return 0
+            return (1 - self._tokens) / self.rate
+
+    def refund(self):
+        """Give back a token taken for work that did not happen."""
+        with self._lock:
+            self._tokens = min(self.burst, self._tokens + 1)
+
+
+class ThrottleSlot:
+    """Handed to the crawl holding the slot, which flags it when it hits a block page or a 403/429."""
+
+    def __init__(self):
+        self.blocked = False
+
+
+class RetailerThrottle:
+    """Token bucket plus an adaptive concurrency cap for one retailer.
+
+    The feedback follows Scrapy's AutoThrottle: after each crawl the request rate moves halfway
+    towards ``concurrency limit / latency``, and the concurrency cap grows by one while latency
+    stays under ``target_latency``. A block halves both and holds them down for ``cooldown`` seconds.
+    """
+
+    def __init__(self, name: str, rate: float = 1.0, concurrency: int = 2, max_concurrency: int = 4,
+                 min_rate: float = 0.05, max_rate: float = 10.0, target_latency: float = 5.0,
+                 cooldown: float = 60.0):
+        self.name = name
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.max_concurrency = max_concurrency
+        self.target_latency = target_latency
+        self.cooldown = cooldown
+        self.bucket = TokenBucket(rate, burst=max(1, concurrency))
+        self.limit = concurrency
+        self.active = 0
+        self.blocks = 0
+        self.completed = 0
+        self.backoff_until = 0
+        self._condition = threading.Condition()
+
+    @property
+    def rate(self):
+        return self.bucket.rate
+
+    @contextmanager
+    def slot(self):
+        """Wait for a concurrency slot and a rate token, then time the crawl and learn from it."""
+        with self._condition:
+            while self.active >= self.limit:
+                self._condition.wait()
+            self.active += 1
+        slot = ThrottleSlot()
+        self.bucket.acquire()
+        started = time.monotonic()
+        try:
+            yield slot
+        finally:
+            with self._condition:
+                self.active -= 1
+                self._condition.notify()
+            # Failed and timed out crawls count too, their long latency slows us down
+            self.feedback(time.monotonic() - started, slot.blocked)
+
+    def feedback(self, latency: float, blocked: bool = False):
+        with self._condition:
+            now = time.monotonic()
+            if blocked:
+                self.blocks += 1
+                self.bucket.rate = max(self.min_rate, self.bucket.rate / 2)
+                self.limit = max(1, self.limit // 2)
+                self.backoff_until = now + self.cooldown
+                return
+
+            self.completed += 1
+            if now < self.backoff_until:
+                return
+            # Target as many requests in flight per second as the retailer answers comfortably
+            target_rate = max(self.min_rate, min(self.max_rate, self.limit / max(latency, 0.001)))
+            self.bucket.rate = (self.bucket.rate + target_rate) / 2
+            if latency < self.target_latency and self.limit < self.max_concurrency:
+                self.limit += 1
+                self._condition.notify()
+            elif latency > 2 * self.target_latency and self.limit > 1:
+                self.limit -= 1
+
+    def stats(self):
+        with self._condition:
+            return {
+                'rate': round(self.bucket.rate, 3),
+                'concurrency_limit': self.limit,
+                'active': self.active,
+                'completed': self.completed,
+                'blocks': self.blocks,
+                'backing_off': time.monotonic() < self.backoff_until,
+            }
+
+
+class Throttler:
+    """One RetailerThrottle per retailer, created from its SpiderSpec the first time it crawls."""
+
+    def __init__(self):
+        self._throttles = {}
+        self._lock = threading.Lock()
+
+    def get(self, spec) -> RetailerThrottle:
+        with self._lock:
+            throttle = self._throttles.get(spec.name)
+            if throttle is None:
+                throttle = RetailerThrottle(spec.name, rate=spec.rate_limit, concurrency=spec.concurrency,
+                                            max_concurrency=spec.max_concurrency)
+                self._throttles[spec.name] = throttle
+            return throttle
+
+    def stats(self):
+        with self._lock:
+            throttles = list(self._throttles.values())
+        return {throttle.name: throttle.stats() for throttle in throttles}
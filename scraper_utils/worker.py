@@ -0,0 +1,174 @@
+"""Crawl worker for the distributed mode.
+
+    JOB_QUEUE_URL=redis://queue:6379/0 python -m scraper_utils.worker --engines http,scrapy --concurrency 8
+    JOB_QUEUE_URL=redis://queue:6379/0 python -m scraper_utils.worker --engines selenium --concurrency 2
+
+The API (started with the same JOB_QUEUE_URL) queues every crawl in the lane of the engine that
+should run it, and each worker only takes jobs from the lanes of the engines it was started with,
+so browser workers and cheap HTTP workers scale separately.
+"""
+import argparse
+import logging
+import os
+import signal
+import socket
+import threading
+import time
+import traceback
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+
+from scraper_utils.deadline import Deadline, enforce, interrupted_result
+from scraper_utils.metrics import Timings, activate
+from scraper_utils.profiling import export_capture
+from scraper_utils.queues import ENGINES, job_queue_from_url
+from scraper_utils.registry import registry
+
+logger = logging.getLogger(__name__)
+
+
+class Worker:
+    """Takes jobs for ``engines`` from the queue and runs up to ``concurrency`` of them at once.
+
+    ``app`` is the main module, whose engines (Scrapy workers, driver pool, HTTP fast paths) run the
+    crawls. Every ``heartbeat_interval`` seconds the worker advertises its engines and load, and
+    expires the deadline of any running job the API has cancelled.
+    """
+
+    def __init__(self, app, job_queue, engines, concurrency: int = 4, heartbeat_interval: float = 5):
+        self.app = app
+        self.job_queue = job_queue
+        self.engines = list(engines)
+        self.concurrency = concurrency
+        self.heartbeat_interval = heartbeat_interval
+        self.id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+        self.executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='queue-worker')
+        self.completed = 0
+        self._slots = threading.BoundedSemaphore(concurrency)
+        self._running = {}
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+
+    def start_engines(self):
+        if 'scrapy' in self.engines:
+            self.app.scrapy_service.start()
+        if 'selenium' in self.engines:
+            self.app.get_driver_pool().start()
+
+    def stop_engines(self):
+        self.app.scrapy_service.stop()
+        if self.app.driver_pool is not None:
+            self.app.driver_pool.close()
+
+    def run(self):
+        """Take and run jobs until ``stop()``."""
+        threading.Thread(target=self._beat, name='worker-heartbeat', daemon=True).start()
+        while not self._stopping.is_set():
+            # Only take a job when a thread is free to run it, the rest stay queued for other workers
+            if not self._slots.acquire(timeout=1):
+                continue
+            try:
+                job = self.job_queue.get(self.engines, timeout=1)
+            except Exception:
+                logger.exception("Could not read the job queue")
+                job = None
+                time.sleep(1)
+            if job is None:
+                self._slots.release()
+                continue
+            self.executor.submit(self._run_job, job)
+        self.executor.shutdown(wait=True)
+
+    def stop(self):
+        self._stopping.set()
+
+    def _run_job(self, job: dict):
+        try:
+            reply = self.handle(job)
+            if reply is not None:
+                self.job_queue.reply(job['id'], reply)
+        except Exception:
+            traceback.print_exc()
+        finally:
+            self._slots.release()
+
+    def handle(self, job: dict):
+        """Crawl one job with its first engine. Returns the reply, or None when the job was handed on."""
+        engine = job['engines'][0]
+        spec = registry.get(job['retailer'])
+        timings = Timings()
+        slot = SimpleNamespace(blocked=False)
+        deadline = Deadline(max(0.0, job['expires_at'] - time.time()))
+        with self._lock:
+            self._running[job['id']] = deadline
+        try:
+            with activate(timings), enforce(deadline=deadline):
+                deadline.check()
+                result = self.app.run_engine(job['url'], spec, engine, slot, job.get('profile_id'))
+                deadline.check()
+            if result is None and len(job['engines']) > 1:
+                print(f"Fast path could not extract {job['url']}, handing it to {job['engines'][1]}")
+                self.job_queue.forward(job)
+                return None
+        except Exception as e:
+            result = interrupted_result(deadline) if deadline.expired else {"error": str(e)}
+        finally:
+            with self._lock:
+                self._running.pop(job['id'], None)
+        self.completed += 1
+        reply = {'result': result, 'blocked': slot.blocked, 'phases': timings.phases, 'network': timings.network,
+                 'engine': engine, 'worker': self.id}
+        if job.get('profile_id'):
+            # The capture was saved on this machine, the API serves it from its own PROFILE_DIR
+            reply['profile'] = export_capture(job['profile_id'])
+        return reply
+
+    def _beat(self):
+        while not self._stopping.is_set():
+            with self._lock:
+                running = dict(self._running)
+            try:
+                self.job_queue.heartbeat(self.id, {'engines': self.engines, 'concurrency': self.concurrency,
+                                                   'running': len(running), 'completed': self.completed})
+                for job_id in self.job_queue.cancelled(running):
+                    running[job_id].cancel()
+            except Exception:
+                logger.exception("Worker heartbeat failed")
+            self._stopping.wait(self.heartbeat_interval)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run crawl jobs queued by the API.")
+    parser.add_argument('--engines', default=','.join(ENGINES),
+                        help="Comma separated, from scrapy, http and selenium (needs Chrome)")
+    parser.add_argument('--concurrency', type=int, default=4, help="Crawls run at once")
+    parser.add_argument('--queue', default=os.getenv('JOB_QUEUE_URL'),
+                        help="Job queue URL, redis://... or a SQLAlchemy URL (default JOB_QUEUE_URL)")
+    args = parser.parse_args(argv)
+
+    engines = [engine.strip() for engine in args.engines.split(',') if engine.strip()]
+    unknown = set(engines) - set(ENGINES)
+    if unknown:
+        parser.error(f"Unknown engines: {', '.join(sorted(unknown))}")
+    if not args.queue:
+        parser.error("Pass --queue or set JOB_QUEUE_URL")
+
+    # Importing main sets up the same registry and engines as the API
+    import main as app
+
+    worker = Worker(app, job_queue_from_url(args.queue), engines, args.concurrency)
+    # Finish the crawls in hand when the container is stopped
+    signal.signal(signal.SIGTERM, lambda *_: worker.stop())
+    worker.start_engines()
+    print(f"Worker {worker.id} running {', '.join(engines)} jobs")
+    try:
+        worker.run()
+    except KeyboardInterrupt:
+        worker.stop()
+    finally:
+        worker.stop_engines()
+
+
+if __name__ == '__main__':
+    main()